@@ -0,0 +1,124 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+# The modules imported by the entry points of the apps
+ENTRY_POINTS = {
+    "cli-app": "speaker_calibration.__main__",
+    "gui-app": "speaker_calibration.gui",
+    "monitor-app": "speaker_calibration.monitor",
+}
+
+
+def import_time(module: str) -> tuple[float, dict[str, float]]:
+    """
+    Measures the import time of a module in a new interpreter with `python -X importtime`.
+
+    Parameters
+    ----------
+    module : str
+        The module to be imported.
+
+    Returns
+    -------
+    total : float
+        The cumulative import time of the module (ms).
+    packages : dict[str, float]
+        The import time of every top-level package imported, i.e. the sum of the self times of its modules (ms).
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=False,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.splitlines()[-1])
+
+    total = 0
+    packages = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_time, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+
+        # The self times are added, so that the time of a package does not include the packages it imports
+        name = name.strip()
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_time) / 1000
+        if name == module:
+            total = int(cumulative) / 1000
+
+    return total, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measures the import time of the apps, to keep track of their startup time."
+    )
+    parser.add_argument(
+        "--apps",
+        nargs="+",
+        choices=list(ENTRY_POINTS),
+        default=list(ENTRY_POINTS),
+        help="The apps to be measured.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="The number of measurements of each app. The median is reported.",
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="The number of packages reported."
+    )
+    parser.add_argument(
+        "--history",
+        help="A JSON lines file to which the results are appended, to follow them over time.",
+    )
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        help="The maximum import time accepted (ms). The script fails if an app is slower.",
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for app in args.apps:
+        module = ENTRY_POINTS[app]
+        try:
+            runs = [import_time(module) for _ in range(args.repeat)]
+        except RuntimeError as error:
+            print(f"{app}: failed to import {module} ({error})")
+            continue
+
+        total = statistics.median(run[0] for run in runs)
+        packages = {
+            package: statistics.median(run[1].get(package, 0) for run in runs)
+            for package in runs[0][1]
+        }
+        results[app] = {"total_ms": total, "packages_ms": packages}
+
+        print(f"{app} ({module}): {total:.0f} ms")
+        slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+        for package, time in slowest[: args.top]:
+            print(f"  {package:<30} {time:8.1f} ms")
+
+    if args.history is not None:
+        with open(args.history, "a") as file:
+            record = {"time": datetime.now().isoformat(), "python": sys.version}
+            file.write(json.dumps(record | results) + "\n")
+
+    if args.max_ms is not None and any(
+        result["total_ms"] > args.max_ms for result in results.values()
+    ):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,9 @@ import time
 from typing import Literal
 
 import matplotlib.pyplot as plt
-import numpy as np
 from scipy.signal import butter, sosfilt
 
+from speaker_calibration.calibration import CalibrationModel
 from speaker_calibration.recording import NiDaq
 from speaker_calibration.soundcards import HarpSoundCard
 
@@ -27,17 +27,14 @@ def measure_db(
 ):
     soundcard = HarpSoundCard(SERIAL_PORT)
     adc = NiDaq(1)
-    left_cal = np.load(calibration_left)
-    right_cal = np.load(calibration_right)
+    left_cal = CalibrationModel.load(calibration_left)
+    right_cal = CalibrationModel.load(calibration_right)
 
     db_left = abl - ild / 2
     db_right = abl + ild / 2
 
-    att_left = (-20 * (db_left - left_cal[1]) / left_cal[0]) * 10
-    soundcard.device.write_attenuation_left(int(att_left))
-
-    att_right = (-20 * (db_right - right_cal[1]) / right_cal[0]) * 10
-    soundcard.device.write_attenuation_right(int(att_right))
+    att_left = left_cal.attenuation(db_left)
+    att_right = right_cal.attenuation(db_right)
 
     # Create the result list to pass to the recording thread
     result = []
@@ -45,7 +42,12 @@ def measure_db(
     # Create the start event and the threads that will play and record the sound
     start_event = threading.Event()
     play_thread = threading.Thread(
-        target=soundcard.play, kwargs={"index": index, "start_event": start_event}
+        target=soundcard.play,
+        kwargs={
+            "index": index,
+            "start_event": start_event,
+            "attenuation": (int(att_left), int(att_right)),
+        },
     )
     record_thread = threading.Thread(
         target=adc.record_signal,
@@ -1,73 +1,7 @@
-import os
-import time
-from datetime import datetime
-from typing import Optional
+from speaker_calibration.bank import Bank, StimulusSpec, build_bank, upload_bank
+from speaker_calibration.soundcards import HarpSoundCard
 
-import numpy as np
-from speaker_calibration.sound import WhiteNoise
-from speaker_calibration.soundcards import create_sound_file
-
-
-def upload_sound(
-    duration: float,
-    calib_left: np.ndarray,
-    eq_left: np.ndarray,
-    calib_right: np.ndarray,
-    eq_right: np.ndarray,
-    abl: Optional[float] = None,
-    ild: float = 0,
-    fs: int = 192000,
-    ramp_time: float = 0.005,
-    filename: str = "sound.bin",
-    soundcard_index: Optional[int] = None,
-):
-    if soundcard_index is not None and soundcard_index < 2 and soundcard_index > 31:
-        raise (ValueError("soundcard_index must be between 2 and 31"))
-
-    if abl is None:
-        attenuation_left = 1
-        attenuation_right = 1
-    else:
-        db_left = abl - ild / 2
-        attenuation_left = 10 ** ((db_left - calib_left[1]) / calib_left[0])
-        db_right = abl + ild / 2
-        attenuation_right = 10 ** ((db_right - calib_right[1]) / calib_right[0])
-
-    signal_left = WhiteNoise(
-        duration,
-        fs,
-        amplitude=attenuation_left,
-        ramp_time=ramp_time,
-        freq_min=5000,
-        freq_max=20000,
-        eq_filter=eq_left,
-    )
-    signal_right = WhiteNoise(
-        duration,
-        fs,
-        amplitude=attenuation_right,
-        ramp_time=ramp_time,
-        freq_min=5000,
-        freq_max=20000,
-        eq_filter=eq_right,
-    )
-
-    create_sound_file(signal_left, signal_right, filename)
-    if soundcard_index is not None:
-        while True:
-            output = os.popen(
-                "cmd /c .\\assets\\toSoundCard.exe "
-                + str(filename)
-                + " "
-                + str(soundcard_index)
-                + " 0 "
-                + str(fs)
-            ).read()
-
-            if "Bandwidth: " in output:
-                break
-            print(output)
-            time.sleep(3)
+SERIAL_PORT = "COMx"
 
 
 def main():
@@ -78,38 +12,26 @@ def main():
         "C:/Users/RenartLab/Desktop/cdc-speaker-calibration/output/250925_150000"
     )
 
-    calib_left = np.load(path_left + "/calibration_parameters.npy")
-    eq_left = np.load(path_left + "/eq_filter.npy")
-    calib_right = np.load(path_right + "/calibration_parameters.npy")
-    eq_right = np.load(path_right + "/eq_filter.npy")
-
-    date = datetime.now().strftime("%y%m%d_%H%M%S")
-    os.makedirs("output/sounds/" + date)
-
-    for i in range(5):
-        upload_sound(
-            10,
-            calib_left,
-            eq_left,
-            calib_right,
-            eq_right,
-            fs=192000,
-            filename="output/sounds/" + date + "/noise" + str(i) + ".bin",
-            soundcard_index=(2 * i + 2),
-        )
-
-    upload_sound(
-        0.001,
-        calib_left,
-        eq_left,
-        calib_right,
-        eq_right,
-        abl=0,
-        fs=96000,
-        ramp_time=0,
-        filename="output/sounds/" + date + "/silence.bin",
-        soundcard_index=31,
+    # Five full scale noises and a silence, which are rendered in parallel
+    # The noises have fixed seeds, so that they are reused from the stimulus cache when the bank is built again
+    stimuli = [StimulusSpec(index=2 * i + 2, duration=10, seed=i) for i in range(5)]
+    stimuli.append(StimulusSpec(index=31, duration=0.001, abl=0, ramp_time=0))
+
+    bank = Bank(
+        calibration_left=path_left,
+        calibration_right=path_right,
+        output="output/sounds",
+        fs=192000,
+        cache="output/cache",
+        stimuli=stimuli,
     )
+    path = build_bank(bank)
+
+    soundcard = HarpSoundCard(SERIAL_PORT, bank.fs)
+    try:
+        upload_bank(path, soundcard)
+    finally:
+        soundcard.device.disconnect()
 
 
 if __name__ == "__main__":
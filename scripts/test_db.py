@@ -1,6 +1,6 @@
 from typing import Literal
 
-import numpy as np
+from speaker_calibration.calibration import CalibrationModel
 from speaker_calibration.soundcards import HarpSoundCard
 
 SERIAL_PORT = "COMx"
@@ -15,19 +15,16 @@ def test_db(
     filename: str = "sound",
 ):
     soundcard = HarpSoundCard(SERIAL_PORT)
-    left_cal = np.load(calibration_left)
-    right_cal = np.load(calibration_right)
+    left_cal = CalibrationModel.load(calibration_left)
+    right_cal = CalibrationModel.load(calibration_right)
 
     db_left = abl - ild / 2
     db_right = abl + ild / 2
 
-    att_left = (-20 * (db_left - left_cal[1]) / left_cal[0]) * 10
-    soundcard.device.write_attenuation_left(int(att_left))
+    att_left = left_cal.attenuation(db_left)
+    att_right = right_cal.attenuation(db_right)
 
-    att_right = (-20 * (db_right - right_cal[1]) / right_cal[0]) * 10
-    soundcard.device.write_attenuation_right(int(att_right))
-
-    soundcard.play(index)
+    soundcard.play(index, attenuation=(int(att_left), int(att_right)))
 
 
 test_db(
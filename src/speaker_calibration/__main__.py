@@ -1,4 +1,6 @@
+import argparse
 import os
+from contextlib import AbstractContextManager
 from datetime import datetime
 from pathlib import Path
 from typing import Callable, Optional
@@ -6,56 +8,116 @@ from typing import Callable, Optional
 import yaml
 
 import speaker_calibration.config as settings
-from speaker_calibration.config import Config
-from speaker_calibration.protocol import NoiseProtocol, PureToneProtocol
-from speaker_calibration.recording import Moku, NiDaq
+from speaker_calibration.backends import create_adc, create_soundcard
+from speaker_calibration.catalogue import Catalogue
+from speaker_calibration.config import Config, load_config
+from speaker_calibration.history import ResultIndex, result_key, stored_result
+from speaker_calibration.protocol import (
+    MultisineProtocol,
+    NoiseProtocol,
+    PureToneProtocol,
+)
 from speaker_calibration.soundcards import HarpSoundCard
 
 
 def main():
-    with open("./config/config.yml", "r") as file:
-        config_dict = yaml.safe_load(file)
-
-    config = Config(**config_dict)
-    run_calibration(config)
-
-
-def run_calibration(config: Config, callback: Optional[Callable] = None):
-    # Define the path for the output directory for the current calibration
-    path = Path() / config.paths.output / datetime.now().strftime("%y%m%d_%H%M%S")
-    # Create the output directory structure for the current calibration
-    os.makedirs(path / "sounds")
-
-    config_dict = config.model_dump(by_alias=True, exclude_unset=True)
-    with open(path / "config.yml", "w") as file:
-        yaml.dump(config_dict, file, default_flow_style=False)
-
-    # Initiate the soundcard to be used in the calibration
-    match config.soundcard:
-        case settings.HarpSoundCard():
-            soundcard = HarpSoundCard(
-                config.soundcard.serial_port,
-                config.soundcard.fs,
-                config.soundcard.speaker,
-            )
-        case settings.ComputerSoundCard():
-            # TODO: implement interface with computer soundcard
-            soundcard = None
+    parser = argparse.ArgumentParser(description="Performs a speaker calibration.")
+    parser.add_argument(
+        "--resume",
+        type=Path,
+        help="The output directory of an interrupted calibration. Its configuration is reloaded and only the missing points are measured.",
+    )
+    args = parser.parse_args()
+
+    # A resumed calibration uses the configuration saved in its output directory
+    if args.resume is not None:
+        config_path = args.resume / "config.yml"
+    else:
+        config_path = Path("./config/config.yml")
+
+    config = load_config(config_path)
+    run_calibration(config, resume=args.resume)
+
+
+def run_calibration(
+    config: Config,
+    callback: Optional[Callable] = None,
+    resume: Optional[Path] = None,
+    session_lock: Optional[AbstractContextManager] = None,
+) -> Path:
+    if resume is not None:
+        # Continue the calibration in the output directory of the interrupted run
+        path = resume
+    else:
+        # Define the path for the output directory for the current calibration
+        path = Path() / config.paths.output / datetime.now().strftime("%y%m%d_%H%M%S")
+        # Create the output directory structure for the current calibration
+        os.makedirs(path / "sounds")
+
+        config_dict = config.model_dump(mode="json", by_alias=True, exclude_unset=True)
+        with open(path / "config.yml", "w") as file:
+            yaml.dump(config_dict, file, default_flow_style=False)
+
+    # Initiate the soundcard and the ADC to be used in the calibration (only their backends are imported)
+    soundcard = create_soundcard(config.soundcard)
+    adc = create_adc(config.adc)
 
-    # Initiate the ADC to be used in the calibration
-    match config.adc:
-        case settings.NiDaq():
-            adc = NiDaq(config.adc.device_id, config.adc.fs)
-        case settings.Moku():
-            adc = Moku(config.adc.address, config.adc.fs)
+    # Share the acquisition sessions with the other rigs calibrated at the same time
+    if session_lock is not None:
+        adc.session_lock = session_lock
+
+    # Look for the newest result measured with the same hardware, unless the results to be used are given
+    index = ResultIndex(Path(config.paths.output) / "index.jsonl")
+    key = result_key(config)
+    previous = None
+    if (
+        config.protocol.reuse is not None
+        and key is not None
+        and config.paths.eq_filter is None
+        and config.paths.calibration is None
+    ):
+        previous = index.latest(key, config.protocol.reuse.max_age)
 
     match config.protocol:
         case settings.NoiseProtocolSettings():
-            NoiseProtocol(config.protocol, soundcard, adc, path, config.paths, callback)
-        case settings.PureToneProtocolSettings():
-            PureToneProtocol(
-                config.protocol, soundcard, adc, path, config.paths, callback
+            protocol = NoiseProtocol(
+                config.protocol, soundcard, adc, path, config.paths, callback, previous
             )
+        case settings.PureToneProtocolSettings():
+            if config.protocol.calibration.stimulus == "multisine":
+                protocol = MultisineProtocol(
+                    config.protocol,
+                    soundcard,
+                    adc,
+                    path,
+                    config.paths,
+                    callback,
+                    previous,
+                )
+            else:
+                protocol = PureToneProtocol(
+                    config.protocol,
+                    soundcard,
+                    adc,
+                    path,
+                    config.paths,
+                    callback,
+                    previous,
+                )
 
     if isinstance(soundcard, HarpSoundCard):
         soundcard.device.disconnect()
+
+    # Index the result of the run (or the reused result, now verified), so that the following runs can reuse it
+    if key is not None:
+        result = stored_result(key, path, protocol.paths)
+        if result is not None:
+            index.add(result)
+
+    # Add the run to the catalogue of the calibration history
+    catalogue = config.paths.catalogue
+    if catalogue is None:
+        catalogue = Path(config.paths.output) / "catalogue.sqlite"
+    Catalogue(Path(catalogue)).add_run(path, config, protocol.paths)
+
+    return path
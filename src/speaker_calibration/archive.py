@@ -0,0 +1,221 @@
+import json
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Literal, Optional
+
+import numpy as np
+
+from speaker_calibration.sound import RecordedSound
+
+# Every record starts with the marker and the length of its JSON header
+_MARKER = b"SCAR"
+_PREFIX = struct.Struct("<4sI")
+# The data of every record starts at a multiple of this size, so that it can be memory-mapped with any dtype
+_ALIGNMENT = 64
+
+
+class RunArchive:
+    """
+    The archive of a calibration run, a single append-only file with the recordings, the results and the description of the generated stimuli.
+
+    Each record is a JSON header (its name, dtype, shape, compression and metadata, e.g. the sweep coordinates of a recording) followed by its data. The index of the records is rebuilt from the headers when the archive is opened, without reading the data, so loading a recording only reads that recording: uncompressed records are memory-mapped and compressed ones are read and decompressed on their own. A record written again under the same name replaces the previous one, and an incomplete record left by a crash is ignored and overwritten by the next one.
+
+    Attributes
+    ----------
+    path : Path
+        The path to the archive file.
+    compression : Literal["zlib"], optional
+        The compression of the records written. If not provided, they are not compressed.
+    level : int
+        The compression level.
+    dtype : Literal["float64", "float32"]
+        The dtype in which the recordings are stored.
+    """
+
+    path: Path
+    compression: Optional[Literal["zlib"]]
+    level: int
+    dtype: Literal["float64", "float32"]
+
+    def __init__(
+        self,
+        path: Path,
+        compression: Optional[Literal["zlib"]] = None,
+        level: int = 1,
+        dtype: Literal["float64", "float32"] = "float64",
+    ):
+        self.path = path
+        self.compression = compression
+        self.level = level
+        self.dtype = dtype
+
+        self._records = {}
+        self._end = 0
+        self._lock = threading.Lock()
+        self._scan()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def names(self, **coordinates) -> list[str]:
+        """
+        Lists the names of the records, in the order in which they were written.
+
+        Parameters
+        ----------
+        **coordinates
+            The metadata values the records must have, e.g. `sweep="calibration", index=3`.
+        """
+        return [
+            name
+            for name, (_, header) in self._records.items()
+            if all(
+                header["metadata"].get(key) == value
+                for key, value in coordinates.items()
+            )
+        ]
+
+    def metadata(self, name: str) -> dict:
+        """
+        Returns the metadata of a record.
+
+        Parameters
+        ----------
+        name : str
+            The name of the record.
+        """
+        return self._records[name][1]["metadata"]
+
+    def write(self, name: str, array: Optional[np.ndarray] = None, **metadata):
+        """
+        Appends a record to the archive and flushes it to the disk.
+
+        Parameters
+        ----------
+        name : str
+            The name of the record.
+        array : numpy.ndarray, optional
+            The data of the record. If not provided, the record only has metadata.
+        **metadata
+            The JSON serializable metadata of the record.
+        """
+        array = np.zeros(0) if array is None else np.ascontiguousarray(array)
+        data = array.tobytes()
+        if self.compression == "zlib":
+            data = zlib.compress(data, self.level)
+
+        header = {
+            "name": name,
+            "dtype": array.dtype.str,
+            "shape": array.shape,
+            "compression": self.compression,
+            "size": len(data),
+            "metadata": metadata,
+        }
+        encoded = json.dumps(header).encode()
+
+        with self._lock:
+            # The header is padded so that the data is aligned
+            start = self._end + _PREFIX.size + len(encoded)
+            encoded += b" " * (-start % _ALIGNMENT)
+            offset = self._end + _PREFIX.size + len(encoded)
+
+            with open(self.path, "r+b" if self.path.exists() else "wb") as file:
+                # Overwrite the incomplete record left by a crash, if any (the file is only truncated then, since a file mapped by a memmap of a previous record cannot be truncated on Windows)
+                if os.fstat(file.fileno()).st_size > self._end:
+                    file.truncate(self._end)
+                file.seek(self._end)
+                file.write(_PREFIX.pack(_MARKER, len(encoded)))
+                file.write(encoded)
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+
+            self._records[name] = (offset, header)
+            self._end = offset + len(data)
+
+    def write_recording(self, name: str, sound: RecordedSound, **coordinates):
+        """
+        Appends a recording to the archive. Only the signal is stored, in the dtype of the archive, since the time axis follows from the sampling frequency.
+
+        Parameters
+        ----------
+        name : str
+            The name of the recording.
+        sound : RecordedSound
+            The recording.
+        **coordinates
+            The sweep coordinates of the recording, e.g. `sweep="calibration", index=3`.
+        """
+        self.write(
+            name,
+            np.asarray(sound.signal, dtype=self.dtype),
+            fs=sound.fs,
+            **coordinates,
+        )
+
+    def read(self, name: str) -> np.ndarray:
+        """
+        Reads the data of a record. Uncompressed records are memory-mapped (read-only), so only the samples used are read from the disk.
+
+        Parameters
+        ----------
+        name : str
+            The name of the record.
+        """
+        offset, header = self._records[name]
+        dtype = np.dtype(header["dtype"])
+        shape = tuple(header["shape"])
+
+        if header["compression"] is None:
+            if header["size"] == 0:
+                return np.zeros(shape, dtype)
+            return np.memmap(self.path, dtype, "r", offset, shape)
+
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            data = zlib.decompress(file.read(header["size"]))
+        return np.frombuffer(data, dtype).reshape(shape)
+
+    def read_recording(self, name: str) -> RecordedSound:
+        """
+        Reads a recording.
+
+        Parameters
+        ----------
+        name : str
+            The name of the recording.
+        """
+        return RecordedSound(self.read(name), self.metadata(name)["fs"])
+
+    def _scan(self):
+        # Rebuild the index from the headers, stopping at the first incomplete record
+        if not self.path.exists():
+            return
+
+        size = self.path.stat().st_size
+        with open(self.path, "rb") as file:
+            while self._end + _PREFIX.size <= size:
+                file.seek(self._end)
+                marker, length = _PREFIX.unpack(file.read(_PREFIX.size))
+                if marker != _MARKER:
+                    break
+                try:
+                    header = json.loads(file.read(length))
+                except ValueError:
+                    break
+
+                offset = self._end + _PREFIX.size + length
+                if offset + header["size"] > size:
+                    break
+
+                # The newest record with a name replaces the previous ones
+                self._records.pop(header["name"], None)
+                self._records[header["name"]] = (offset, header)
+                self._end = offset + header["size"]
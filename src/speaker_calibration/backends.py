@@ -0,0 +1,72 @@
+from importlib.metadata import EntryPoint, entry_points
+
+from pydantic import BaseModel
+
+from speaker_calibration.recording import RecordingDevice
+from speaker_calibration.soundcards import SoundCard
+
+# The entry point groups in which the backends are registered. The name of each entry point is the name of the settings class that selects it in the configuration
+SOUNDCARDS = "speaker_calibration.soundcards"
+ADCS = "speaker_calibration.adcs"
+
+# The backends of the package, which are resolved without going through the metadata of every installed package (so they are not registered as entry points)
+_BUILTIN = {
+    SOUNDCARDS: {
+        "HarpSoundCard": "speaker_calibration.soundcards:HarpSoundCard",
+        "ComputerSoundCard": "speaker_calibration.soundcards:ComputerSoundCard",
+    },
+    ADCS: {
+        "NiDaq": "speaker_calibration.recording:NiDaq",
+        "Moku": "speaker_calibration.recording:Moku",
+    },
+}
+
+
+def load_backend(group: str, name: str) -> type:
+    """
+    Loads the class of a backend. Only the module of the selected backend is imported, and its driver is only imported once the device is created.
+
+    Parameters
+    ----------
+    group : str
+        The entry point group of the backend: `SOUNDCARDS` or `ADCS`.
+    name : str
+        The name of the backend, i.e. the name of its settings class.
+
+    Returns
+    -------
+    backend : type
+        The class implementing the backend.
+    """
+    if name in _BUILTIN[group]:
+        return EntryPoint(name, _BUILTIN[group][name], group).load()
+
+    # Backends provided by other packages
+    for entry_point in entry_points(group=group, name=name):
+        return entry_point.load()
+
+    raise ValueError(f'There is no backend named "{name}" in {group}.')
+
+
+def create_soundcard(config: BaseModel) -> SoundCard:
+    """
+    Creates the soundcard selected by its settings.
+
+    Parameters
+    ----------
+    config : BaseModel
+        The soundcard settings, e.g. `speaker_calibration.config.HarpSoundCard`.
+    """
+    return load_backend(SOUNDCARDS, type(config).__name__).from_config(config)
+
+
+def create_adc(config: BaseModel) -> RecordingDevice:
+    """
+    Creates the recording device selected by its settings.
+
+    Parameters
+    ----------
+    config : BaseModel
+        The ADC settings, e.g. `speaker_calibration.config.NiDaq`.
+    """
+    return load_backend(ADCS, type(config).__name__).from_config(config)
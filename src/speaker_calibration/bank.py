@@ -0,0 +1,330 @@
+import argparse
+import hashlib
+import json
+import os
+import secrets
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Literal, Optional
+
+import numpy as np
+import yaml
+from pydantic import BaseModel, Field, model_validator
+
+from speaker_calibration.cache import StimulusCache
+from speaker_calibration.calibration import CalibrationModel
+from speaker_calibration.eq import EQDesign, EQDesignMode, design_eq
+from speaker_calibration.sound import WhiteNoise
+from speaker_calibration.soundcards import HarpSoundCard, create_sound_file
+
+
+class StimulusSpec(BaseModel):
+    index: int = Field(
+        description="The index of the Harp SoundCard in which the sound will be stored.",
+        ge=2,
+        le=31,
+    )
+    duration: float = Field(description="The duration of the sound (s).", gt=0)
+    abl: Optional[float] = Field(
+        description="The average binaural level (dB SPL). If not provided, the noises are generated at full scale.",
+        default=None,
+    )
+    ild: float = Field(
+        description="The interaural level difference, i.e. the level of the right speaker minus the level of the left one (dB).",
+        default=0,
+    )
+    side: Literal["both", "left", "right"] = Field(
+        description="The speakers in which the sound is played. The other one is muted.",
+        default="both",
+    )
+    ramp_time: float = Field(
+        description="The ramp time of the sound (s).", ge=0, default=0.005
+    )
+    seed: Optional[int] = Field(
+        description="The seed of the noises. If not provided, a random one is chosen and written to the manifest, so that the sound can be rebuilt. Only the sounds with a seed are reused from the stimulus cache in later builds.",
+        default=None,
+    )
+
+
+class Bank(BaseModel):
+    calibration_left: str = Field(
+        description="The output directory of the calibration of the left speaker. It must contain the EQ filter and either the calibration model or the calibration parameters."
+    )
+    calibration_right: str = Field(
+        description="The output directory of the calibration of the right speaker."
+    )
+    output: str = Field(
+        description="The directory in which a timestamped directory with the sounds and the manifest is created."
+    )
+    fs: Literal[96000, 192000] = Field(
+        description="The sampling frequency of the sounds (Hz).", default=192000
+    )
+    freq_min: float = Field(
+        description="The minimum frequency of the noises (Hz).", gt=0, default=5000
+    )
+    freq_max: float = Field(
+        description="The maximum frequency of the noises (Hz).", gt=0, default=20000
+    )
+    eq_design: EQDesignMode = Field(
+        description="The implementation of the EQ filters used to render the noises. Auto chooses the cheapest design within the maximum error.",
+        default="linear_phase",
+    )
+    max_error_db: float = Field(
+        description="The maximum error of the magnitude response of the reduced EQ filter designs (dB).",
+        gt=0,
+        default=0.5,
+    )
+    cache: Optional[str] = Field(
+        description="The path to the directory of the stimulus cache, which can be shared with the calibration runs. The sounds already in the cache are copied instead of rendered. If not provided, every sound is rendered.",
+        default=None,
+    )
+    cache_max_size: float = Field(
+        description="The maximum size of the stimulus cache (MB).",
+        gt=0,
+        default=2048,
+    )
+    stimuli: list[StimulusSpec] = Field(description="The sounds of the bank.")
+
+    @model_validator(mode="after")
+    def check_indices(self):
+        # Every sound is stored in its own index of the soundcard, so a repeated index would overwrite one of the sounds of the bank
+        indices = [spec.index for spec in self.stimuli]
+        if len(set(indices)) != len(indices):
+            raise ValueError("The indices of the stimuli must be unique.")
+        return self
+
+
+# The calibration of both speakers, loaded once by every worker process
+_shared = {}
+
+
+def build_bank(bank: Bank, workers: Optional[int] = None) -> Path:
+    """
+    Renders the sounds of a bank in parallel and writes their .bin files and a manifest.
+
+    Parameters
+    ----------
+    bank : Bank
+        The specification of the bank.
+    workers : int, optional
+        The number of worker processes. If not provided, every core is used.
+
+    Returns
+    -------
+    path : Path
+        The directory of the bank.
+    """
+    path = Path(bank.output) / datetime.now().strftime("%y%m%d_%H%M%S")
+    os.makedirs(path)
+
+    # Choose the missing seeds here, so that they are written to the manifest
+    stimuli = [
+        spec.model_copy(update={"seed": secrets.randbits(32)})
+        if spec.seed is None
+        else spec
+        for spec in bank.stimuli
+    ]
+
+    # The EQ filters are designed once, instead of in every worker
+    calibration = []
+    for directory in (bank.calibration_left, bank.calibration_right):
+        model, eq_filter = _load_calibration(Path(directory))
+        design = design_eq(
+            eq_filter,
+            bank.fs,
+            bank.eq_design,
+            bank.max_error_db,
+            bank.freq_min,
+            bank.freq_max,
+        )
+        print(design.report())
+        calibration.append((model, design))
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(
+            tuple(calibration),
+            bank.fs,
+            bank.freq_min,
+            bank.freq_max,
+            bank.cache,
+            bank.cache_max_size,
+        ),
+    ) as executor:
+        entries = list(
+            executor.map(
+                _render,
+                stimuli,
+                [path / f"sound_{spec.index}.bin" for spec in stimuli],
+            )
+        )
+
+    manifest = {
+        "created": datetime.now().isoformat(),
+        "calibration_left": bank.calibration_left,
+        "calibration_right": bank.calibration_right,
+        "fs": bank.fs,
+        "freq_min": bank.freq_min,
+        "freq_max": bank.freq_max,
+        "eq_design": [design.mode for _, design in calibration],
+        "sounds": entries,
+    }
+    with open(path / "manifest.json", "w") as file:
+        json.dump(manifest, file, indent=2)
+
+    return path
+
+
+def upload_bank(path: Path, soundcard: HarpSoundCard):
+    """
+    Uploads the sounds of a bank to the Harp SoundCard, one at a time.
+
+    Parameters
+    ----------
+    path : Path
+        The directory of the bank.
+    soundcard : HarpSoundCard
+        The soundcard to which the sounds are uploaded.
+    """
+    with open(path / "manifest.json", "r") as file:
+        manifest = json.load(file)
+
+    for entry in manifest["sounds"]:
+        soundcard.load_sound(path / entry["filename"], entry["index"])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Builds a bank of calibrated sounds for the Harp SoundCard."
+    )
+    parser.add_argument(
+        "bank", type=Path, help="The YAML file with the specification of the bank."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="The number of worker processes. Every core is used by default.",
+    )
+    parser.add_argument(
+        "--upload",
+        metavar="SERIAL_PORT",
+        help="The serial port of the Harp SoundCard to which the bank is uploaded.",
+    )
+    args = parser.parse_args()
+
+    with open(args.bank, "r") as file:
+        bank = Bank(**yaml.safe_load(file))
+
+    path = build_bank(bank, args.workers)
+    print(f"Bank written to {path}")
+
+    if args.upload is not None:
+        soundcard = HarpSoundCard(args.upload, bank.fs)
+        try:
+            upload_bank(path, soundcard)
+        finally:
+            soundcard.device.disconnect()
+
+
+def _load_calibration(path: Path) -> tuple[CalibrationModel, np.ndarray]:
+    if (path / "calibration_model.npz").exists():
+        model = CalibrationModel.load(path / "calibration_model.npz")
+    else:
+        model = CalibrationModel.load(path / "calibration_parameters.npy")
+
+    # The level of a noise does not depend on a frequency, which a pure tone calibration needs
+    if model.freqs is not None:
+        raise ValueError(
+            f"The calibration in {path} is a pure tone calibration, but the sounds of a bank need a noise calibration."
+        )
+
+    return model, np.load(path / "eq_filter.npy")
+
+
+def _init_worker(
+    calibration: tuple[tuple[CalibrationModel, EQDesign], ...],
+    fs: int,
+    freq_min: float,
+    freq_max: float,
+    cache: Optional[str],
+    cache_max_size: float,
+):
+    _shared["calibration"] = calibration
+    _shared["fs"] = fs
+    _shared["freq_min"] = freq_min
+    _shared["freq_max"] = freq_max
+    _shared["cache"] = (
+        StimulusCache(Path(cache), cache_max_size) if cache is not None else None
+    )
+
+
+def _render(spec: StimulusSpec, filename: Path) -> dict:
+    db = (None, None)
+    if spec.abl is not None:
+        db = (spec.abl - spec.ild / 2, spec.abl + spec.ild / 2)
+
+    amplitudes = []
+    renders = []
+    keys = []
+    for speaker, ((model, eq_design), level) in enumerate(
+        zip(_shared["calibration"], db)
+    ):
+        amplitude = 1 if level is None else float(model.amplitude(level))
+        if spec.side != "both" and spec.side != ("left", "right")[speaker]:
+            amplitude = 0
+
+        # The noises of both speakers are independent
+        renders.append(
+            lambda amplitude=amplitude, eq_design=eq_design, speaker=speaker: (
+                WhiteNoise(
+                    spec.duration,
+                    _shared["fs"],
+                    amplitude=amplitude,
+                    ramp_time=spec.ramp_time,
+                    freq_min=_shared["freq_min"],
+                    freq_max=_shared["freq_max"],
+                    eq_filter=eq_design,
+                    seed=(spec.seed, speaker),
+                )
+            )
+        )
+        keys.append(
+            StimulusCache.key(
+                "white_noise",
+                _shared["fs"],
+                eq_filter=eq_design,
+                seed=(spec.seed, speaker),
+                duration=spec.duration,
+                amplitude=amplitude,
+                ramp_time=spec.ramp_time,
+                filter=False,
+                freq_min=_shared["freq_min"],
+                freq_max=_shared["freq_max"],
+                noise_type="gaussian",
+            )
+        )
+        amplitudes.append(amplitude)
+
+    cache = _shared["cache"]
+    if cache is None:
+        create_sound_file(renders[0](), renders[1](), filename)
+    else:
+        # The noises are only rendered if their file is not in the cache
+        key = StimulusCache.key("stereo", _shared["fs"], left=keys[0], right=keys[1])
+        cached = cache.sound_file(
+            key, lambda path: create_sound_file(renders[0](), renders[1](), path)
+        )
+        shutil.copyfile(cached, filename)
+
+    with open(filename, "rb") as file:
+        digest = hashlib.file_digest(file, "sha256").hexdigest()
+
+    return spec.model_dump() | {
+        "filename": filename.name,
+        "amplitude_left": amplitudes[0],
+        "amplitude_right": amplitudes[1],
+        "sha256": digest,
+    }
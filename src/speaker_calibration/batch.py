@@ -0,0 +1,222 @@
+import argparse
+import multiprocessing
+import queue
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import yaml
+from pydantic import BaseModel, Field
+
+from speaker_calibration.config import Config
+
+
+class Rig(BaseModel):
+    name: str = Field(
+        description="The name of the rig, used in the progress messages and as the name of its output directory."
+    )
+    config: str = Field(
+        description="The path to the configuration file of the calibration of the rig."
+    )
+
+
+class Batch(BaseModel):
+    output: str = Field(
+        description="The directory in which the output directory of every rig is created. It replaces the output path of the configuration files."
+    )
+    max_rigs: Optional[int] = Field(
+        description="The maximum number of rigs calibrated at the same time. If not provided, every rig is calibrated at once.",
+        gt=0,
+        default=None,
+    )
+    max_daq_sessions: int = Field(
+        description="The maximum number of acquisitions running at the same time in all rigs. The remaining steps of the calibrations (e.g. the generation, upload and analysis of the sounds) are not limited.",
+        gt=0,
+        default=1,
+    )
+    rigs: list[Rig] = Field(description="The rigs to be calibrated.")
+
+
+class RigProgress:
+    """
+    The progress of the calibration of a rig, built from the messages sent by its process.
+
+    Attributes
+    ----------
+    stage : str
+        The current stage of the calibration: "Calibration" or "Test".
+    done : int
+        The number of points of the current stage measured.
+    total : int
+        The number of points of the current stage.
+    status : str
+        The status of the calibration: "waiting", "running", "done" or "failed".
+    path : Path, optional
+        The output directory of the calibration, once it has finished.
+    error : str, optional
+        The error that stopped the calibration, if it failed.
+    """
+
+    stage: str
+    done: int
+    total: int
+    status: str
+    path: Optional[Path]
+    error: Optional[str]
+
+    def __init__(self):
+        self.stage = ""
+        self.done = 0
+        self.total = 0
+        self.status = "waiting"
+        self.path = None
+        self.error = None
+
+    def __str__(self):
+        if self.status == "running" and self.total > 0:
+            return f"{self.stage} {self.done}/{self.total}"
+        return self.status
+
+
+def run_batch(
+    batch: Batch, on_progress: Optional[Callable] = None
+) -> dict[str, RigProgress]:
+    """
+    Calibrates several rigs at the same time, each one in its own process with its own devices and output directory.
+
+    The acquisitions of all rigs share a limited number of sessions. A rig that fails does not stop the other ones.
+
+    Parameters
+    ----------
+    batch : Batch
+        The specification of the batch.
+    on_progress : Callable, optional
+        A function called with the name of the rig and the progress of every rig whenever a rig progresses. If not provided, the progress is printed.
+
+    Returns
+    -------
+    progress : dict[str, RigProgress]
+        The final progress of every rig, with its output directory or its error.
+    """
+    if on_progress is None:
+        on_progress = _print_progress
+
+    progress = {rig.name: RigProgress() for rig in batch.rigs}
+
+    with multiprocessing.Manager() as manager:
+        session_lock = manager.BoundedSemaphore(batch.max_daq_sessions)
+        messages = manager.Queue()
+
+        with ProcessPoolExecutor(
+            max_workers=batch.max_rigs or len(batch.rigs)
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _run_rig,
+                    rig,
+                    Path(batch.output) / rig.name,
+                    session_lock,
+                    messages,
+                )
+                for rig in batch.rigs
+            ]
+
+            # Update the progress with the messages of the rigs until every calibration finishes
+            while not all(future.done() for future in futures) or not messages.empty():
+                try:
+                    name, code, values = messages.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+
+                _update(progress[name], code, values)
+                on_progress(name, progress)
+
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calibrates several rigs at the same time."
+    )
+    parser.add_argument(
+        "batch", type=Path, help="The YAML file with the specification of the batch."
+    )
+    parser.add_argument(
+        "--max-daq-sessions",
+        type=int,
+        help="The maximum number of acquisitions running at the same time. It overrides the one of the batch file.",
+    )
+    args = parser.parse_args()
+
+    with open(args.batch, "r") as file:
+        batch = Batch(**yaml.safe_load(file))
+    if args.max_daq_sessions is not None:
+        batch.max_daq_sessions = args.max_daq_sessions
+
+    progress = run_batch(batch)
+
+    print("Batch finished:")
+    for name, rig in progress.items():
+        if rig.status == "done":
+            print(f"  {name}: done, results in {rig.path}")
+        else:
+            print(f"  {name}: {rig.status}\n{rig.error}")
+
+
+def _run_rig(rig: Rig, output: Path, session_lock, messages):
+    # The calibration is imported in the worker, so that the devices are only opened in its process
+    from speaker_calibration.__main__ import run_calibration
+
+    def callback(code: str, *args):
+        # Only the counts are sent to the coordinator, not the sounds
+        if code.startswith("Pre-"):
+            shape = np.shape(args[0])
+            total = (
+                int(np.prod(shape[:-1])) if len(shape) > 1 else int(np.size(args[0]))
+            )
+            messages.put((rig.name, "stage", (code[4:].capitalize(), total)))
+        elif code.endswith(("Calibration", "Test")):
+            messages.put((rig.name, "point", None))
+
+    messages.put((rig.name, "start", None))
+    # Any error of a rig (its configuration, its devices or its protocol) is reported to the coordinator with its traceback, so that the other rigs keep running
+    try:
+        with open(rig.config, "r") as file:
+            config = Config(**yaml.safe_load(file))
+        config.paths.output = str(output)
+        # The rigs share the catalogue of the batch, so that their histories are queried together
+        if config.paths.catalogue is None:
+            config.paths.catalogue = str(output.parent / "catalogue.sqlite")
+
+        path = run_calibration(config, callback, session_lock=session_lock)
+    except Exception:  # noqa: BLE001
+        messages.put((rig.name, "failed", traceback.format_exc()))
+        return
+
+    messages.put((rig.name, "done", str(path)))
+
+
+def _update(progress: RigProgress, code: str, values):
+    match code:
+        case "start":
+            progress.status = "running"
+        case "stage":
+            progress.stage = values[0]
+            progress.done = 0
+            progress.total = values[1]
+        case "point":
+            progress.done += 1
+        case "done":
+            progress.status = "done"
+            progress.path = Path(values)
+        case "failed":
+            progress.status = "failed"
+            progress.error = values
+
+
+def _print_progress(name: str, progress: dict[str, RigProgress]):
+    finished = sum(rig.status in ("done", "failed") for rig in progress.values())
+    summary = ", ".join(f"{rig_name}: {rig}" for rig_name, rig in progress.items())
+    print(f"[{finished}/{len(progress)} rigs finished] {summary}")
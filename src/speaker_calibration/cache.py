@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from speaker_calibration.eq import EQDesign
+from speaker_calibration.sound import Sound
+
+
+class StimulusCache:
+    """
+    The cache of the rendered stimuli, shared by the calibration runs and the stimulus banks.
+
+    Every stimulus is stored under the hash of everything it depends on (its type, parameters, sampling frequency, EQ filter and seed), either as a float array (.npy) or as the int32 file of the Harp SoundCard (.bin). The least recently used files are removed once the cache grows beyond its maximum size.
+
+    Attributes
+    ----------
+    path : Path
+        The directory of the cache.
+    max_size : int
+        The maximum size of the cache (bytes).
+    """
+
+    path: Path
+    max_size: int
+
+    def __init__(self, path: Path, max_size_mb: float = 2048):
+        self.path = path
+        self.max_size = int(max_size_mb * 2**20)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(
+        kind: str,
+        fs: float,
+        eq_filter: Optional[np.ndarray | EQDesign] = None,
+        seed: Optional[int | tuple] = None,
+        **parameters,
+    ) -> str:
+        """
+        Calculates the key of a stimulus.
+
+        Parameters
+        ----------
+        kind : str
+            The type of the stimulus, e.g. "white_noise".
+        fs : float
+            The sampling frequency of the stimulus (Hz).
+        eq_filter : numpy.ndarray | EQDesign, optional
+            The EQ filter applied to the stimulus.
+        seed : int | tuple, optional
+            The seed of the stimulus, if it is random.
+        **parameters
+            The remaining parameters of the stimulus. They must be JSON serializable (arrays are converted to lists).
+
+        Returns
+        -------
+        key : str
+            The SHA-256 hash of the stimulus description.
+        """
+        description = StimulusCache.describe(kind, fs, eq_filter, seed, **parameters)
+        encoded = json.dumps(description, sort_keys=True).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    @staticmethod
+    def describe(
+        kind: str,
+        fs: float,
+        eq_filter: Optional[np.ndarray | EQDesign] = None,
+        seed: Optional[int | tuple] = None,
+        **parameters,
+    ) -> dict:
+        """
+        Describes a stimulus with JSON serializable values, i.e. what its key is calculated from. The EQ filter is described by the hash of its coefficients. The parameters are the same as the ones of `key`.
+
+        Returns
+        -------
+        description : dict
+            The description of the stimulus.
+        """
+        return {
+            "kind": kind,
+            "fs": fs,
+            "eq_filter": _digest(eq_filter),
+            "seed": seed,
+            "parameters": {
+                name: value.tolist() if isinstance(value, np.ndarray) else value
+                for name, value in parameters.items()
+            },
+        }
+
+    def sound(self, key: str, fs: float, render: Callable[[], Sound]) -> Sound:
+        """
+        Returns the signal of a stimulus, rendering and storing it if it is not in the cache.
+
+        Parameters
+        ----------
+        key : str
+            The key of the stimulus.
+        fs : float
+            The sampling frequency of the stimulus (Hz).
+        render : Callable[[], Sound]
+            The function that renders the stimulus.
+
+        Returns
+        -------
+        sound : Sound
+            The rendered stimulus, or a plain sound with its signal if it was in the cache.
+        """
+        filename = self.path / (key + ".npy")
+        if filename.exists():
+            try:
+                signal = np.load(filename)
+                os.utime(filename)
+                return Sound(signal, fs, np.linspace(0, signal.size / fs, signal.size))
+            except (OSError, ValueError):
+                # The file was removed or is corrupted, so the stimulus is rendered again
+                pass
+
+        sound = render()
+        self._store(filename, lambda path: np.save(path, sound.signal))
+        return sound
+
+    def sound_file(self, key: str, write: Callable[[Path], None]) -> Path:
+        """
+        Returns the .bin file of a stimulus, writing and storing it if it is not in the cache.
+
+        Parameters
+        ----------
+        key : str
+            The key of the stimulus.
+        write : Callable[[Path], None]
+            The function that writes the file to the path it receives, e.g. with `create_sound_file`.
+
+        Returns
+        -------
+        filename : Path
+            The path to the file, inside the cache.
+        """
+        filename = self.path / (key + ".bin")
+        if filename.exists():
+            try:
+                os.utime(filename)
+                return filename
+            except OSError:
+                pass
+
+        self._store(filename, write)
+        return filename
+
+    def _store(self, filename: Path, write: Callable[[Path], None]):
+        # The file is written to a temporary file and moved at once, so that other runs never read an incomplete file
+        descriptor, temporary = tempfile.mkstemp(
+            suffix=filename.suffix, dir=self.path, prefix=".tmp_"
+        )
+        os.close(descriptor)
+        try:
+            write(Path(temporary))
+            os.replace(temporary, filename)
+        except BaseException:
+            Path(temporary).unlink(missing_ok=True)
+            raise
+
+        self._evict(keep=filename)
+
+    def _evict(self, keep: Path):
+        # Remove the least recently used files until the cache fits its maximum size
+        files = []
+        for filename in self.path.iterdir():
+            if filename.name.startswith(".tmp_") or filename == keep:
+                continue
+            try:
+                stat = filename.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, filename))
+
+        size = sum(file[1] for file in files) + keep.stat().st_size
+        for _, file_size, filename in sorted(files):
+            if size <= self.max_size:
+                break
+            try:
+                filename.unlink()
+                size -= file_size
+            except OSError:
+                # The file is being used by another run
+                continue
+
+
+def _digest(eq_filter: Optional[np.ndarray | EQDesign]) -> Optional[str]:
+    if eq_filter is None:
+        return None
+
+    digest = hashlib.sha256()
+    if isinstance(eq_filter, EQDesign):
+        digest.update(eq_filter.mode.encode())
+        coefficients = eq_filter.sos if eq_filter.mode == "iir" else eq_filter.taps
+    else:
+        coefficients = eq_filter
+    digest.update(np.ascontiguousarray(coefficients, dtype=float).tobytes())
+
+    return digest.hexdigest()
@@ -0,0 +1,185 @@
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from speaker_calibration.utils import amplitude_to_attenuation
+
+
+class CalibrationModel:
+    """
+    The class representing the result of a calibration, which converts dB SPL values into amplitude factors and attenuation values and vice versa.
+
+    The intensity is modelled as a linear function of the logarithm of the amplitude. A noise calibration has a single fit, while a pure tone calibration has one fit per frequency and the fits of the frequencies in between are linearly interpolated.
+
+    Attributes
+    ----------
+    slopes : numpy.ndarray
+        The slope of the fit of each frequency (dB SPL per decade of amplitude).
+    intercepts : numpy.ndarray
+        The intercept of the fit of each frequency, i.e. the intensity at full scale (dB SPL).
+    freqs : numpy.ndarray, optional
+        The frequencies of the fits, sorted (Hz). It is None for a noise calibration.
+    """
+
+    slopes: np.ndarray
+    intercepts: np.ndarray
+    freqs: Optional[np.ndarray]
+
+    def __init__(
+        self,
+        slopes: np.ndarray,
+        intercepts: np.ndarray,
+        freqs: Optional[np.ndarray] = None,
+    ):
+        self.slopes = np.atleast_1d(np.asarray(slopes, dtype=float))
+        self.intercepts = np.atleast_1d(np.asarray(intercepts, dtype=float))
+        self.freqs = None if freqs is None else np.asarray(freqs, dtype=float)
+
+    @classmethod
+    def from_parameters(cls, calibration_parameters: np.ndarray):
+        """
+        Creates the model of a noise calibration.
+
+        Parameters
+        ----------
+        calibration_parameters : numpy.ndarray
+            The slope and intercept of the calibration curve (dB SPL as a function of the logarithm of the amplitude).
+        """
+        return cls(calibration_parameters[0], calibration_parameters[1])
+
+    @classmethod
+    def from_pure_tones(cls, calibration: np.ndarray):
+        """
+        Creates the model of a pure tone calibration, by fitting a line to the points of each frequency.
+
+        Parameters
+        ----------
+        calibration : numpy.ndarray
+            The (n, 3) array with the frequency, amplitude and dB SPL of each calibration point. The points that were not measured (NaN) are ignored, as well as the frequencies with less than two points.
+        """
+        valid = ~np.isnan(calibration).any(axis=1) & (calibration[:, 1] > 0)
+        calibration = calibration[valid]
+
+        freqs = []
+        fits = []
+        for freq in np.unique(calibration[:, 0]):
+            points = calibration[calibration[:, 0] == freq]
+            if np.unique(points[:, 1]).size < 2:
+                continue
+            freqs.append(freq)
+            fits.append(np.polyfit(np.log10(points[:, 1]), points[:, 2], 1))
+
+        if not fits:
+            raise ValueError("The calibration has no frequency with two valid points.")
+
+        fits = np.array(fits)
+        return cls(fits[:, 0], fits[:, 1], np.array(freqs))
+
+    @classmethod
+    def load(cls, filename: Path | str):
+        """
+        Loads a model saved with `save` or creates it from the file saved by a calibration protocol.
+
+        Parameters
+        ----------
+        filename : Path | str
+            The path to the model (.npz), to the calibration parameters of a noise calibration or to the calibration array of a pure tone calibration (.npy).
+        """
+        if Path(filename).suffix == ".npz":
+            with np.load(filename) as data:
+                freqs = data.get("freqs")
+                return cls(data["slopes"], data["intercepts"], freqs)
+
+        data = np.load(filename)
+        if data.ndim == 1:
+            return cls.from_parameters(data)
+        return cls.from_pure_tones(data)
+
+    def save(self, filename: Path | str):
+        """
+        Saves the model to a .npz file.
+
+        Parameters
+        ----------
+        filename : Path | str
+            The path to the file.
+        """
+        arrays = {"slopes": self.slopes, "intercepts": self.intercepts}
+        if self.freqs is not None:
+            arrays["freqs"] = self.freqs
+        np.savez(filename, **arrays)
+
+    def amplitude(
+        self, db: float | np.ndarray, freq: Optional[float | np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Converts dB SPL values into amplitude factors.
+
+        Parameters
+        ----------
+        db : float | numpy.ndarray
+            The desired dB SPL values.
+        freq : float | numpy.ndarray, optional
+            The frequencies of the sounds (Hz), broadcast against `db`. Required by a pure tone calibration. The fits of the closest frequencies are used outside the calibrated range.
+
+        Returns
+        -------
+        amplitude : numpy.ndarray
+            The amplitude factors. The ones above 1 cannot be achieved by the speaker.
+        """
+        slope, intercept = self._fit(freq)
+        return 10 ** ((np.asarray(db, dtype=float) - intercept) / slope)
+
+    def attenuation(
+        self, db: float | np.ndarray, freq: Optional[float | np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Converts dB SPL values into attenuation register values of the Harp SoundCard.
+
+        Parameters
+        ----------
+        db : float | numpy.ndarray
+            The desired dB SPL values.
+        freq : float | numpy.ndarray, optional
+            The frequencies of the sounds (Hz), broadcast against `db`. Required by a pure tone calibration.
+
+        Returns
+        -------
+        attenuation : numpy.ndarray
+            The attenuation values, in which 1 LSB corresponds to 0.1 dB.
+        """
+        return amplitude_to_attenuation(self.amplitude(db, freq))
+
+    def db_spl(
+        self, amplitude: float | np.ndarray, freq: Optional[float | np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Converts amplitude factors into the expected dB SPL values.
+
+        Parameters
+        ----------
+        amplitude : float | numpy.ndarray
+            The amplitude factors.
+        freq : float | numpy.ndarray, optional
+            The frequencies of the sounds (Hz), broadcast against `amplitude`. Required by a pure tone calibration.
+
+        Returns
+        -------
+        db : numpy.ndarray
+            The expected dB SPL values.
+        """
+        slope, intercept = self._fit(freq)
+        return slope * np.log10(amplitude) + intercept
+
+    def _fit(self, freq: Optional[float | np.ndarray]):
+        if self.freqs is None:
+            return self.slopes[0], self.intercepts[0]
+
+        if freq is None:
+            raise ValueError("The frequency is required by a pure tone calibration.")
+
+        return (
+            np.interp(freq, self.freqs, self.slopes),
+            np.interp(freq, self.freqs, self.intercepts),
+        )
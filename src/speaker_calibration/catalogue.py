@@ -0,0 +1,460 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import yaml
+from pydantic import BaseModel, Field
+
+import speaker_calibration.config as settings
+from speaker_calibration.calibration import CalibrationModel
+from speaker_calibration.config import Config, Paths, load_config
+from speaker_calibration.history import result_key
+from speaker_calibration.protocol.journal import Journal
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    time TEXT NOT NULL,
+    protocol TEXT NOT NULL,
+    config_digest TEXT NOT NULL,
+    result_key TEXT,
+    soundcard TEXT NOT NULL,
+    soundcard_id TEXT,
+    audio_amp_id TEXT,
+    speaker TEXT NOT NULL,
+    adc TEXT NOT NULL,
+    adc_id TEXT NOT NULL,
+    mic_factor REAL NOT NULL,
+    reused INTEGER NOT NULL,
+    eq_filter TEXT,
+    calibration TEXT
+);
+CREATE TABLE IF NOT EXISTS fits (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    freq REAL,
+    slope REAL NOT NULL,
+    intercept REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS levels (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    sweep TEXT NOT NULL,
+    freq REAL,
+    amplitude REAL NOT NULL,
+    db_spl REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_hardware ON runs(soundcard_id, speaker, time);
+CREATE INDEX IF NOT EXISTS runs_key ON runs(result_key, time);
+CREATE INDEX IF NOT EXISTS fits_run ON fits(run_id, freq);
+CREATE INDEX IF NOT EXISTS levels_run ON levels(run_id, freq);
+"""
+
+
+class DriftPoint(BaseModel):
+    time: datetime = Field(description="The time of the run.")
+    path: str = Field(description="The output directory of the run.")
+    freq: Optional[float] = Field(
+        description="The frequency of the fit (Hz), the nearest one to the frequency queried. It is None for a noise calibration."
+    )
+    slope: float = Field(
+        description="The slope of the fit (dB SPL per decade of amplitude)."
+    )
+    intercept: float = Field(
+        description="The intercept of the fit, i.e. the intensity at full scale (dB SPL)."
+    )
+    reused: bool = Field(
+        description="Whether the run reused the calibration of a previous run after verifying it."
+    )
+
+
+class Catalogue:
+    """
+    The catalogue of the calibration runs, a SQLite database with the configuration digest, the hardware IDs, the fits, the measured levels and the files of every run, so that the history of a speaker is queried without loading the output directories.
+
+    Every finished run is added by `run_calibration`. The runs measured before the catalogue existed are added with `scan`.
+
+    Attributes
+    ----------
+    path : Path
+        The path to the database.
+    """
+
+    path: Path
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # The rigs of a batch add their runs at the same time, so a writer waits for the others instead of failing
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.execute("PRAGMA journal_mode = WAL")
+        return connection
+
+    def add_run(
+        self,
+        path: Path,
+        config: Config,
+        paths: Optional[Paths] = None,
+        time: Optional[datetime] = None,
+    ) -> bool:
+        """
+        Adds a finished run to the catalogue, replacing it if it was already there.
+
+        Parameters
+        ----------
+        path : Path
+            The output directory of the run.
+        config : Config
+            The configuration of the run.
+        paths : Paths, optional
+            The paths used by the protocol, which point to the reused results. If not provided, the ones of the configuration are used.
+        time : datetime, optional
+            The time of the run. If not provided, the current time is used.
+
+        Returns
+        -------
+        added : bool
+            Whether the run was added, i.e. whether it has a calibration.
+        """
+        paths = config.paths if paths is None else paths
+        eq_filter = path / "eq_filter.npy"
+        eq_filter = eq_filter if eq_filter.exists() else paths.eq_filter
+        calibration = paths.calibration
+        for name in ("calibration_parameters.npy", "calibration.npy"):
+            if (path / name).exists():
+                calibration = path / name
+
+        # The runs measured before the model was saved are fitted from their calibration
+        model_path = path / "calibration_model.npz"
+        if model_path.exists():
+            model = CalibrationModel.load(model_path)
+        elif calibration is not None:
+            model = CalibrationModel.load(calibration)
+        else:
+            return False
+
+        soundcard = config.soundcard
+        adc = config.adc
+        protocol = config.protocol
+        journal = Journal(path / "journal.jsonl")
+        reused = (
+            "verification.npy" in journal and journal.get("verification.npy")["passed"]
+        )
+
+        encoded = json.dumps(config.model_dump(mode="json"), sort_keys=True).encode()
+        run = {
+            "path": str(path.resolve()),
+            "time": (time or datetime.now()).isoformat(),
+            "protocol": _protocol_name(protocol),
+            "config_digest": hashlib.sha256(encoded).hexdigest(),
+            "result_key": result_key(config),
+            "soundcard": type(soundcard).__name__,
+            "soundcard_id": getattr(soundcard, "soundcard_id", None),
+            "audio_amp_id": getattr(soundcard, "audio_amp_id", None),
+            "speaker": soundcard.speaker.name,
+            "adc": type(adc).__name__,
+            "adc_id": str(
+                adc.device_id if isinstance(adc, settings.NiDaq) else adc.address
+            ),
+            "mic_factor": protocol.mic_factor,
+            "reused": reused,
+            "eq_filter": None if eq_filter is None else str(Path(eq_filter).resolve()),
+            "calibration": (
+                None if calibration is None else str(Path(calibration).resolve())
+            ),
+        }
+
+        freqs = [None] * model.slopes.size if model.freqs is None else model.freqs
+        fits = [
+            (None if freq is None else float(freq), float(slope), float(intercept))
+            for freq, slope, intercept in zip(freqs, model.slopes, model.intercepts)
+        ]
+
+        with self._connect() as connection:
+            connection.execute("DELETE FROM runs WHERE path = ?", (run["path"],))
+            cursor = connection.execute(
+                f"INSERT INTO runs ({', '.join(run)}) VALUES ({', '.join('?' * len(run))})",
+                tuple(run.values()),
+            )
+            run_id = cursor.lastrowid
+            connection.executemany(
+                "INSERT INTO fits VALUES (?, ?, ?, ?)",
+                [(run_id, *fit) for fit in fits],
+            )
+            connection.executemany(
+                "INSERT INTO levels VALUES (?, ?, ?, ?, ?)",
+                [(run_id, *level) for level in _levels(path, protocol, journal)],
+            )
+        connection.close()
+
+        return True
+
+    def drift(
+        self,
+        soundcard_id: Optional[str] = None,
+        speaker: Optional[str] = None,
+        key: Optional[str] = None,
+        freq: Optional[float] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> list[DriftPoint]:
+        """
+        Returns the fits of the runs of a speaker over time.
+
+        Parameters
+        ----------
+        soundcard_id : str, optional
+            The ID of the soundcard, e.g. "V1.0 X0003".
+        speaker : str, optional
+            The speaker: "LEFT", "RIGHT" or "BOTH".
+        key : str, optional
+            The key of the hardware, ADC, microphone and frequency band (see `result_key`), to only compare runs measured in the same conditions.
+        freq : float, optional
+            The frequency of the fits of the pure tone calibrations (Hz), whose nearest fit is returned for every run. If not provided, the fits of the noise calibrations are returned.
+        since : datetime, optional
+            The time of the oldest run.
+        until : datetime, optional
+            The time of the newest run.
+
+        Returns
+        -------
+        points : list[DriftPoint]
+            The fit of every matching run, from the oldest to the newest.
+        """
+        conditions = []
+        parameters = []
+        for column, value in (
+            ("runs.soundcard_id = ?", soundcard_id),
+            ("runs.speaker = ?", speaker),
+            ("runs.result_key = ?", key),
+            ("runs.time >= ?", None if since is None else since.isoformat()),
+            ("runs.time <= ?", None if until is None else until.isoformat()),
+        ):
+            if value is not None:
+                conditions.append(column)
+                parameters.append(value)
+
+        if freq is None:
+            conditions.append("fits.freq IS NULL")
+        else:
+            # The fit of every run nearest to the frequency
+            conditions.append(
+                "fits.freq = (SELECT nearest.freq FROM fits AS nearest WHERE nearest.run_id = runs.id "
+                "ORDER BY ABS(nearest.freq - ?) LIMIT 1)"
+            )
+            parameters.append(freq)
+
+        query = (
+            "SELECT runs.time, runs.path, fits.freq, fits.slope, fits.intercept, runs.reused "
+            "FROM runs JOIN fits ON fits.run_id = runs.id "
+            f"WHERE {' AND '.join(conditions)} ORDER BY runs.time"
+        )
+        with self._connect() as connection:
+            rows = connection.execute(query, parameters).fetchall()
+        connection.close()
+
+        return [
+            DriftPoint(
+                time=row[0],
+                path=row[1],
+                freq=row[2],
+                slope=row[3],
+                intercept=row[4],
+                reused=row[5],
+            )
+            for row in rows
+        ]
+
+    def scan(self, output: Path) -> int:
+        """
+        Adds the runs found in an output directory (and its subdirectories, e.g. the ones of the rigs of a batch) to the catalogue.
+
+        Parameters
+        ----------
+        output : Path
+            The output directory.
+
+        Returns
+        -------
+        count : int
+            The number of runs added.
+        """
+        count = 0
+        for config_path in sorted(output.rglob("config.yml")):
+            path = config_path.parent
+            try:
+                config = load_config(config_path)
+            except (OSError, ValueError, yaml.YAMLError) as error:
+                print(f"Skipping {path}: {error}")
+                continue
+
+            # The name of the output directory is the time of the run
+            try:
+                run_time = datetime.strptime(path.name, "%y%m%d_%H%M%S")
+            except ValueError:
+                run_time = datetime.fromtimestamp(config_path.stat().st_mtime)
+
+            count += self.add_run(path, config, time=run_time)
+
+        return count
+
+
+def trend(points: list[DriftPoint]) -> Optional[float]:
+    """
+    Calculates the linear trend of the intercepts of a drift query.
+
+    Parameters
+    ----------
+    points : list[DriftPoint]
+        The points returned by `Catalogue.drift`.
+
+    Returns
+    -------
+    trend : float, optional
+        The change of the intensity at full scale (dB SPL per year), or None if there are less than two runs.
+    """
+    if len(points) < 2:
+        return None
+
+    days = np.array(
+        [(point.time - points[0].time).total_seconds() / 86400 for point in points]
+    )
+    if np.ptp(days) == 0:
+        return None
+    return np.polyfit(days / 365.25, [point.intercept for point in points], 1)[0]
+
+
+def _protocol_name(
+    protocol: settings.NoiseProtocolSettings | settings.PureToneProtocolSettings,
+) -> str:
+    if isinstance(protocol, settings.NoiseProtocolSettings):
+        return "noise"
+    return protocol.calibration.stimulus
+
+
+def _levels(
+    path: Path,
+    protocol: settings.NoiseProtocolSettings | settings.PureToneProtocolSettings,
+    journal: Journal,
+) -> list[tuple[str, Optional[float], float, float]]:
+    # The measured points of the run: the calibration and test arrays of a pure tone calibration and the journal of a noise calibration
+    levels = []
+
+    if isinstance(protocol, settings.PureToneProtocolSettings):
+        for sweep in ("calibration", "test"):
+            if not (path / (sweep + ".npy")).exists():
+                continue
+            # The test array has the requested intensity before the measured one
+            array = np.load(path / (sweep + ".npy"))
+            array = array.reshape(-1, array.shape[-1])
+            for row in array[~np.isnan(array[:, -1])]:
+                levels.append((sweep, float(row[0]), float(row[1]), float(row[-1])))
+        return levels
+
+    calibration = protocol.calibration
+    log_amp = np.linspace(
+        calibration.min_amp, calibration.max_amp, calibration.amp_steps
+    )
+    # The levels are committed with the recording of every amplitude or, in a staircase calibration, all together with the recording of the staircase
+    staircase = {}
+    if "calibration_staircase.npy" in journal:
+        staircase = journal.get("calibration_staircase.npy")
+
+    for i, amp in enumerate(log_amp):
+        key = f"calibration_{i}.npy"
+        db_spl = None
+        if "db_spl" in staircase:
+            db_spl = staircase["db_spl"][i]
+        elif key in journal:
+            db_spl = journal.get(key).get("db_spl")
+
+        if db_spl is not None:
+            # The amplitudes of the noise calibration are logarithmic
+            levels.append(("calibration", None, 10 ** float(amp), db_spl))
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Queries the catalogue of the calibration runs, e.g. the drift of the intensity of a speaker over time."
+    )
+    parser.add_argument(
+        "--catalogue",
+        type=Path,
+        default=Path("output/catalogue.sqlite"),
+        help="The path to the catalogue.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan = subparsers.add_parser(
+        "scan", help="Adds the runs of an output directory to the catalogue."
+    )
+    scan.add_argument("output", type=Path, help="The output directory.")
+
+    drift = subparsers.add_parser(
+        "drift", help="Shows the intensity at full scale of a speaker over time."
+    )
+    drift.add_argument("--soundcard-id", help='The ID of the soundcard ("V?.? X????").')
+    drift.add_argument(
+        "--speaker",
+        choices=[speaker.name.lower() for speaker in settings.Speaker],
+        help="The speaker.",
+    )
+    drift.add_argument(
+        "--key", help="The key of the hardware, ADC, microphone and frequency band."
+    )
+    drift.add_argument(
+        "--freq", type=float, help="The frequency of the pure tone calibrations (Hz)."
+    )
+    drift.add_argument(
+        "--since", type=datetime.fromisoformat, help="The oldest date (YYYY-MM-DD)."
+    )
+    drift.add_argument(
+        "--until", type=datetime.fromisoformat, help="The newest date (YYYY-MM-DD)."
+    )
+    args = parser.parse_args()
+
+    catalogue = Catalogue(args.catalogue)
+    if args.command == "scan":
+        start_time = time.perf_counter()
+        count = catalogue.scan(args.output)
+        print(f"Added {count} runs in {time.perf_counter() - start_time:.1f} s")
+        return
+
+    start_time = time.perf_counter()
+    points = catalogue.drift(
+        args.soundcard_id,
+        None if args.speaker is None else args.speaker.upper(),
+        args.key,
+        args.freq,
+        args.since,
+        args.until,
+    )
+    elapsed = time.perf_counter() - start_time
+
+    for point in points:
+        freq = "" if point.freq is None else f"{point.freq:8.0f} Hz  "
+        reused = "  (reused)" if point.reused else ""
+        print(
+            f"{point.time:%Y-%m-%d %H:%M}  {freq}{point.intercept:6.2f} dB SPL  {point.slope:6.2f} dB/decade  {point.path}{reused}"
+        )
+
+    slope = trend(points)
+    if slope is not None:
+        print(f"Trend: {slope:+.2f} dB/year")
+    print(f"{len(points)} runs found in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 import json
+from pathlib import Path
 from typing import Literal, Optional, Union
 
-from pydantic import BaseModel, Field
+import yaml
+from pydantic import BaseModel, Field, model_validator
 from pydantic.types import StringConstraints
 from typing_extensions import Annotated
 
@@ -38,6 +40,26 @@ class Calibration(BaseModel):
         gt=0,
         default=12,
     )
+    adaptive: bool = Field(
+        description="Indicates whether the calibration points are chosen adaptively. The noise calibration only measures the amplitude values needed to fit the calibration curve and the pure tone calibration refines the frequency grid where the speaker response is not smooth. The amplitude (noise) or frequency (pure tone) steps become the maximum number of measurements.",
+        default=False,
+    )
+    anchor_points: int = Field(
+        description="The number of amplitude values measured before the adaptive calibration starts choosing them. Noise calibration only!",
+        ge=3,
+        default=3,
+    )
+    tolerance_db: float = Field(
+        description="The maximum residual and confidence interval half-width (noise) or interpolation error (pure tone) accepted by the adaptive calibration (dB SPL).",
+        gt=0,
+        default=0.5,
+    )
+    confidence: float = Field(
+        description="The confidence level of the intervals used by the adaptive calibration. Noise calibration only!",
+        gt=0,
+        lt=1,
+        default=0.95,
+    )
 
 
 class EQFilter(BaseModel):
@@ -56,6 +78,15 @@ class EQFilter(BaseModel):
     )
     min_boost_db: float = Field(description="TODO", default=-24)
     max_boost_db: float = Field(description="TODO", default=12)
+    design: Literal["linear_phase", "minimum_phase", "iir", "fft", "auto"] = Field(
+        description="The implementation of the EQ filter used to generate the noises. The linear-phase filter is the reference one. The minimum-phase and IIR filters are cheaper and have no latency, while the FFT convolution applies the reference filter faster. Auto chooses the cheapest design within the maximum error.",
+        default="linear_phase",
+    )
+    max_error_db: float = Field(
+        description="The maximum error of the magnitude response of the reduced designs relative to the reference filter, inside the calibrated band (dB).",
+        gt=0,
+        default=0.5,
+    )
 
 
 class Filter(BaseModel):
@@ -79,12 +110,109 @@ class Filter(BaseModel):
     )
 
 
+class Pipeline(BaseModel):
+    workers: int = Field(
+        description="The number of threads used by each of the analysis stages (filtering and dB SPL calculation).",
+        gt=0,
+        default=2,
+    )
+    queue_size: int = Field(
+        description="The maximum number of items waiting between two consecutive stages of the pipeline.",
+        gt=0,
+        default=2,
+    )
+    concurrent_upload: bool = Field(
+        description="Indicates whether the next sound is uploaded to the soundcard while the current one is being played. Connect the soundcard and the ADC to different hubs before enabling it.",
+        default=False,
+    )
+
+
+class Staircase(BaseModel):
+    gap_duration: float = Field(
+        description="The duration of the silent gap between two consecutive steps of the staircase (s).",
+        ge=0,
+        default=0.2,
+    )
+
+
+class EarlyStop(BaseModel):
+    tolerance_db: float = Field(
+        description="The half-width of the confidence interval of the level below which a recording is stopped (dB SPL).",
+        gt=0,
+        default=0.1,
+    )
+    confidence: float = Field(
+        description="The confidence level of the interval of the level.",
+        gt=0,
+        lt=1,
+        default=0.95,
+    )
+    min_duration: float = Field(
+        description="The minimum duration of a recording (s). It is raised to 10 times the settle time of the filters applied to the sounds (e.g. the EQ filter) if it is shorter, so that their transient is left out of the level. The maximum duration is the duration of the sound.",
+        gt=0,
+        default=1,
+    )
+    block_duration: float = Field(
+        description="The duration of the blocks in which the samples are read from the ADC and added to the level estimate (s).",
+        gt=0,
+        default=0.1,
+    )
+
+
+class Reuse(BaseModel):
+    max_age: float = Field(
+        description="The maximum time since a previous result was measured or last verified (days).",
+        gt=0,
+        default=30,
+    )
+    tolerance_db: float = Field(
+        description="The maximum difference between the levels measured in the verification and the ones predicted by the previous calibration (dB). If it is exceeded, the whole calibration is performed.",
+        gt=0,
+        default=1,
+    )
+    sound_duration: float = Field(
+        description="The duration of the verification sounds (s).", gt=0, default=1
+    )
+    points: int = Field(
+        description="The number of verification sounds: amplitudes in the noise calibration and frequencies in the pure tone calibration.",
+        gt=0,
+        default=3,
+    )
+
+
+class Archive(BaseModel):
+    compression: Optional[Literal["zlib"]] = Field(
+        description="The compression of the recordings in the archive of the run. If not provided, they are not compressed and are memory-mapped when they are loaded.",
+        default=None,
+    )
+    level: int = Field(
+        description="The compression level, from 1 (fastest) to 9 (smallest).",
+        ge=1,
+        le=9,
+        default=1,
+    )
+    dtype: Literal["float64", "float32"] = Field(
+        description="The dtype in which the recordings are stored.",
+        default="float64",
+    )
+
+
 class ComputerSoundCard(BaseModel):
     soundcard_name: str = Field(
-        description="The name of the soundcard being used in the calibration."
+        description='The name of the soundcard being used in the calibration. An empty string selects the default soundcard and "null" selects a null device, which plays nothing.'
     )
     fs: int = Field(description="The sampling frequency of the soundcard (Hz).", gt=0)
     speaker: Speaker = Field(description="Indicates which speaker will be calibrated.")
+    block_size: int = Field(
+        description="The number of samples streamed to the soundcard at a time.",
+        gt=0,
+        default=1024,
+    )
+    latency: Optional[float] = Field(
+        description="The size of the output buffer of the soundcard (s). If not provided, the default of the soundcard is used.",
+        gt=0,
+        default=None,
+    )
 
 
 class HarpSoundCard(BaseModel):
@@ -167,6 +295,30 @@ class NoiseProtocolSettings(BaseModel):
             filter_input=True, filter_acquisition=True, min_freq=5000, max_freq=20000
         ),
     )
+    pipeline: Pipeline = Field(
+        description="The settings of the pipeline that overlaps the generation, upload, acquisition and analysis of the sounds.",
+        default=Pipeline(),
+    )
+    early_stop: Optional[EarlyStop] = Field(
+        description="The settings used to stop the recordings of the calibration and test sweeps as soon as their level is known within the tolerance. If not provided, every recording lasts the duration of the sound. Only the NI-DAQ supports it.",
+        default=None,
+    )
+    staircase: Optional[Staircase] = Field(
+        description="The settings of the staircase stimulus, in which every amplitude of a sweep is played in a single sound, one after the other. If not provided, each amplitude is played and recorded separately. The adaptive noise calibration and the multisine sweeps do not use it.",
+        default=None,
+    )
+    reuse: Optional[Reuse] = Field(
+        description="The settings used to reuse the results of the newest previous run with the same hardware, ADC and microphone, after a quick verification confirms they are still valid. If not provided, or if there is no such run, the whole calibration is performed.",
+        default=None,
+    )
+    archive: Optional[Archive] = Field(
+        description="The settings of the archive of the run, a single file (run.archive) with every recording, the results and the description of the generated stimuli. If not provided, every recording is saved to its own .npy file in the sounds directory.",
+        default=Archive(),
+    )
+    seed: Optional[int] = Field(
+        description="The seed of the noises. If provided, the noises are reproducible and can be reused from the stimulus cache. If not provided, new noises are generated in every run.",
+        default=None,
+    )
 
 
 class PureToneCalibration(Calibration):
@@ -183,6 +335,29 @@ class PureToneCalibration(Calibration):
     freq_steps: int = Field(
         description="The number of pure tones to use in the calibration.", gt=0
     )
+    initial_freq_steps: int = Field(
+        description="The number of pure tones of the coarse grid from which the adaptive calibration starts.",
+        ge=2,
+        default=5,
+    )
+    min_freq_spacing: float = Field(
+        description="The minimum spacing between the pure tones of the adaptive calibration (Hz).",
+        gt=0,
+        default=100,
+    )
+    stimulus: Literal["pure_tone", "multisine"] = Field(
+        description="The stimulus used in the calibration. A multisine plays every frequency at once and extracts the level of each one from the same recording, so it cannot be used with the adaptive calibration.",
+        default="pure_tone",
+    )
+    frequency_resolution: float = Field(
+        description="The frequency resolution of the multisine (Hz). The frequencies are rounded to multiples of it and both sampling frequencies must be multiples of it.",
+        gt=0,
+        default=10,
+    )
+    phase_method: Literal["schroeder", "clipping"] = Field(
+        description="The method used to choose the phases of the tones of the multisine, in order to reduce its crest factor.",
+        default="schroeder",
+    )
     min_amp: float = Field(
         description="The minimum amplitude value.", gt=0, le=1, default=0.1
     )
@@ -190,6 +365,15 @@ class PureToneCalibration(Calibration):
         description="The maximum amplitude value.", gt=0, le=1, default=1.0
     )
 
+    @model_validator(mode="after")
+    def check_stimulus(self):
+        # The recordings of a multisine are named after their amplitude only, so the refinement passes of the adaptive grid would reuse the ones of the first pass. A multisine already measures every frequency of the grid at once anyway
+        if self.stimulus == "multisine" and self.adaptive:
+            raise ValueError(
+                "The multisine stimulus cannot be used with the adaptive calibration."
+            )
+        return self
+
 
 class PureToneTest(Test):
     min_freq: float = Field(
@@ -229,6 +413,26 @@ class PureToneProtocolSettings(BaseModel):
             filter_input=True, filter_acquisition=True, min_freq=5000, max_freq=20000
         ),
     )
+    pipeline: Pipeline = Field(
+        description="The settings of the pipeline that overlaps the generation, upload, acquisition and analysis of the sounds.",
+        default=Pipeline(),
+    )
+    early_stop: Optional[EarlyStop] = Field(
+        description="The settings used to stop the recordings of the calibration and test sweeps as soon as their level is known within the tolerance. If not provided, every recording lasts the duration of the sound. Only the NI-DAQ supports it.",
+        default=None,
+    )
+    staircase: Optional[Staircase] = Field(
+        description="The settings of the staircase stimulus, in which every amplitude of a sweep is played in a single sound, one after the other. If not provided, each amplitude is played and recorded separately. The adaptive noise calibration and the multisine sweeps do not use it.",
+        default=None,
+    )
+    reuse: Optional[Reuse] = Field(
+        description="The settings used to reuse the results of the newest previous run with the same hardware, ADC and microphone, after a quick verification confirms they are still valid. If not provided, or if there is no such run, the whole calibration is performed.",
+        default=None,
+    )
+    archive: Optional[Archive] = Field(
+        description="The settings of the archive of the run, a single file (run.archive) with every recording, the results and the description of the generated stimuli. If not provided, every recording is saved to its own .npy file in the sounds directory.",
+        default=Archive(),
+    )
 
 
 class Paths(BaseModel):
@@ -243,6 +447,19 @@ class Paths(BaseModel):
         description="The calibration parameters to be used to test the calibration.",
         default=None,
     )
+    cache: Optional[str] = Field(
+        description="The path to the directory of the stimulus cache, shared by the runs. The generated sounds are stored there and reused by the following runs with the same sound parameters. If not provided, the sounds are always generated.",
+        default=None,
+    )
+    cache_max_size: float = Field(
+        description="The maximum size of the stimulus cache (MB). The least recently used sounds are removed once it is exceeded.",
+        gt=0,
+        default=2048,
+    )
+    catalogue: Optional[str] = Field(
+        description="The path to the catalogue of the calibration runs, a SQLite database with the fits and the measured levels of every run, e.g. to query the drift of a speaker over time. If not provided, the catalogue.sqlite file of the output directory is used.",
+        default=None,
+    )
 
 
 class Config(BaseModel):
@@ -256,6 +473,35 @@ class Config(BaseModel):
     )
 
 
+class _ConfigLoader(yaml.SafeLoader):
+    pass
+
+
+# The configurations saved by the runs before the enums were dumped as JSON values have the speaker as a Python object
+_ConfigLoader.add_constructor(
+    "tag:yaml.org,2002:python/object/apply:speaker_calibration.utils.Speaker",
+    lambda loader, node: Speaker(*loader.construct_sequence(node)).value,
+)
+
+
+def load_config(path: Path) -> Config:
+    """
+    Loads a configuration file, either written by the user or saved in the output directory of a run.
+
+    Parameters
+    ----------
+    path : Path
+        The path to the configuration file.
+
+    Returns
+    -------
+    config : Config
+        The configuration.
+    """
+    with open(path, "r") as file:
+        return Config(**yaml.load(file, _ConfigLoader))
+
+
 if __name__ == "__main__":
     with open("config/schemas/config-schema.json", "w") as file:
         json.dump(Config.model_json_schema(), file, indent=2)
@@ -0,0 +1,241 @@
+from typing import Literal, Optional
+
+import numpy as np
+from scipy.linalg import solve_toeplitz
+from scipy.signal import (
+    butter,
+    lfilter,
+    minimum_phase,
+    oaconvolve,
+    sosfilt,
+    sosfreqz,
+    tf2sos,
+)
+
+EQDesignMode = Literal["linear_phase", "minimum_phase", "iir", "fft", "auto"]
+
+# The filter lengths and orders tried by the reduced designs, from the cheapest
+_MINIMUM_PHASE_LENGTHS = (32, 64, 128, 256, 512, 1024, 2048)
+_IIR_ORDERS = (4, 8, 12, 16, 24, 32, 48, 64)
+
+
+class EQDesign:
+    """
+    The class representing an implementation of the EQ filter, which approximates the magnitude response of the reference linear-phase FIR filter.
+
+    Attributes
+    ----------
+    mode : str
+        The design mode: "linear_phase" (the reference filter itself), "minimum_phase" (a shorter minimum-phase FIR filter), "iir" (an all-pole filter in second-order sections) or "fft" (the reference filter applied with FFT convolution).
+    fs : float
+        The sampling frequency of the filter (Hz).
+    taps : numpy.ndarray, optional
+        The coefficients of the FIR filter, if the design is a FIR filter.
+    sos : numpy.ndarray, optional
+        The second-order sections of the IIR filter, if the design is an IIR filter.
+    error_db : float
+        The maximum error of the magnitude response in the frequency band of the filter, relative to the reference filter (dB).
+    cost : float
+        The estimated number of floating point operations needed to filter each sample.
+    latency : float
+        The delay introduced by the filter (samples). It is 0 for the minimum-phase and IIR designs.
+    """
+
+    mode: str
+    fs: float
+    taps: Optional[np.ndarray]
+    sos: Optional[np.ndarray]
+    error_db: float
+    cost: float
+    latency: float
+
+    def __init__(
+        self,
+        mode: str,
+        fs: float,
+        error_db: float,
+        cost: float,
+        latency: float,
+        taps: Optional[np.ndarray] = None,
+        sos: Optional[np.ndarray] = None,
+    ):
+        self.mode = mode
+        self.fs = fs
+        self.error_db = error_db
+        self.cost = cost
+        self.latency = latency
+        self.taps = taps
+        self.sos = sos
+
+    def apply(self, signal: np.ndarray) -> np.ndarray:
+        """
+        Filters a signal, keeping its length.
+
+        Parameters
+        ----------
+        signal : numpy.ndarray
+            The signal to be filtered.
+
+        Returns
+        -------
+        filtered : numpy.ndarray
+            The filtered signal.
+        """
+        match self.mode:
+            case "iir":
+                return sosfilt(self.sos, signal)
+            case "fft":
+                return oaconvolve(signal, self.taps)[: signal.size]
+            case _:
+                return lfilter(self.taps, 1, signal)
+
+    def report(self) -> str:
+        """
+        Returns a one-line summary of the design.
+        """
+        if self.mode == "iir":
+            size = f"{self.sos.shape[0]} sections"
+        else:
+            size = f"{self.taps.size} taps"
+
+        return (
+            f"EQ filter ({self.mode}, {size}): error {self.error_db:.2f} dB, "
+            f"{self.cost:.0f} flops/sample, latency {self.latency:.0f} samples"
+        )
+
+
+def design_eq(
+    taps: np.ndarray,
+    fs: float,
+    mode: EQDesignMode = "auto",
+    max_error_db: float = 0.5,
+    freq_min: float = 5000,
+    freq_max: float = 20000,
+) -> EQDesign:
+    """
+    Designs an implementation of the EQ filter from the reference linear-phase FIR filter.
+
+    Parameters
+    ----------
+    taps : numpy.ndarray
+        The coefficients of the reference FIR filter.
+    fs : float
+        The sampling frequency of the filter (Hz).
+    mode : EQDesignMode, optional
+        The design mode. "auto" chooses the cheapest design whose error is within `max_error_db`.
+    max_error_db : float, optional
+        The maximum error of the magnitude response accepted by the reduced designs (dB).
+    freq_min : float, optional
+        The minimum frequency of the band in which the error is evaluated (Hz).
+    freq_max : float, optional
+        The maximum frequency of the band in which the error is evaluated (Hz).
+
+    Returns
+    -------
+    design : EQDesign
+        The design. If no reduced design is within the error bound, the most accurate one is returned.
+    """
+    nfft = 2 ** int(np.ceil(np.log2(taps.size)) + 1)
+    freq = np.fft.rfftfreq(nfft, 1 / fs)
+    band = (freq >= freq_min) & (freq <= freq_max)
+    target = np.abs(np.fft.rfft(taps, nfft))
+
+    def error(response: np.ndarray) -> float:
+        ratio = np.abs(response[band]) / np.maximum(target[band], 1e-12)
+        return float(np.max(np.abs(20 * np.log10(np.maximum(ratio, 1e-12)))))
+
+    match mode:
+        case "linear_phase":
+            return EQDesign(
+                "linear_phase", fs, 0, 2 * taps.size, (taps.size - 1) / 2, taps=taps
+            )
+        case "fft":
+            return EQDesign(
+                "fft", fs, 0, _fft_cost(taps.size), (taps.size - 1) / 2, taps=taps
+            )
+        case "minimum_phase":
+            return _design_minimum_phase(taps, fs, max_error_db, nfft, error)
+        case "iir":
+            return _design_iir(
+                fs, max_error_db, freq_min, freq_max, target, freq, band, error
+            )
+        case "auto":
+            designs = [
+                design_eq(taps, fs, candidate, max_error_db, freq_min, freq_max)
+                for candidate in ("linear_phase", "fft", "minimum_phase", "iir")
+            ]
+            valid = [design for design in designs if design.error_db <= max_error_db]
+            return min(valid, key=lambda design: design.cost)
+
+
+def _fft_cost(num_taps: int) -> float:
+    # Overlap-add with blocks that fill an FFT of twice the filter length: a forward and an inverse real FFT and a complex product per block
+    nfft = 2 ** int(np.ceil(np.log2(num_taps)) + 1)
+    block = nfft - num_taps + 1
+    return (2 * 2.5 * nfft * np.log2(nfft) + 3 * nfft) / block
+
+
+def _design_minimum_phase(taps, fs, max_error_db, nfft, error) -> EQDesign:
+    # The minimum-phase filter with the same magnitude response concentrates its energy at the beginning, so it can be truncated
+    full = minimum_phase(taps, method="homomorphic", half=False)
+
+    best = None
+    for length in _MINIMUM_PHASE_LENGTHS + (full.size,):
+        length = min(length, full.size)
+        truncated = full[:length]
+        design = EQDesign(
+            "minimum_phase",
+            fs,
+            error(np.fft.rfft(truncated, nfft)),
+            2 * length,
+            0,
+            taps=truncated,
+        )
+        if best is None or design.error_db < best.error_db:
+            best = design
+        if design.error_db <= max_error_db:
+            return design
+
+    return best
+
+
+def _design_iir(
+    fs, max_error_db, freq_min, freq_max, target, freq, band, error
+) -> EQDesign:
+    # The steep edges of the band are reproduced by the same band-pass filter used in the design of the reference filter, so the all-pole filter only has to follow the response inside the band
+    edges = butter(32, [freq_min, freq_max], btype="bandpass", output="sos", fs=fs)
+    _, h_edges = sosfreqz(edges, worN=freq, fs=fs)
+    inside = target / np.maximum(np.abs(h_edges), 1e-12)
+    inside = np.interp(freq, freq[band], inside[band])
+
+    # The autocorrelation of the response gives the all-pole filter (Yule-Walker equations) that best matches its power spectrum
+    autocorrelation = np.fft.irfft(inside**2)
+
+    best = None
+    for order in _IIR_ORDERS:
+        coefficients = solve_toeplitz(
+            autocorrelation[:order], -autocorrelation[1 : order + 1]
+        )
+        a = np.concatenate(([1], coefficients))
+        sos = tf2sos([1], a)
+
+        # Match the gain of the filter to the target inside the band
+        _, h = sosfreqz(sos, worN=freq, fs=fs)
+        h = h * h_edges
+        gain = np.exp(np.mean(np.log(target[band]) - np.log(np.abs(h[band]))))
+        sos[0, :3] *= gain
+
+        design = EQDesign(
+            "iir",
+            fs,
+            error(gain * h),
+            9 * (sos.shape[0] + edges.shape[0]),
+            0,
+            sos=np.vstack((edges, sos)),
+        )
+        if best is None or design.error_db < best.error_db:
+            best = design
+        if design.error_db <= max_error_db:
+            return design
+
+    return best
@@ -2,7 +2,6 @@ import ctypes
 import sys
 from typing import Literal, Optional
 
-import nidaqmx
 from PySide6.QtCore import QObject, Qt, QThread, QThreadPool, Signal, Slot
 from PySide6.QtGui import QIcon
 from PySide6.QtWidgets import (
@@ -25,6 +24,7 @@ from PySide6.QtWidgets import (
 )
 
 from speaker_calibration.__main__ import run_calibration
+from speaker_calibration.backends import create_adc
 from speaker_calibration.config import (
     Calibration,
     ComputerSoundCard,
@@ -41,19 +41,21 @@ from speaker_calibration.config import (
     PureToneCalibration,
     PureToneTest,
 )
+from speaker_calibration.gui.bus import CallbackBus
 from speaker_calibration.gui.soundcard import SoundCardLayout
 from speaker_calibration.gui.adc import ADCLayout
 from speaker_calibration.gui.filter import FilterLayout
 from speaker_calibration.gui.utils import (
     EQFilterPlot,
+    MonitorPlot,
     NoiseDataPlot,
     NoiseSignalsPlot,
     PureTonesDataPlot,
     PureTonesSignalsPlot,
 )
+from speaker_calibration.monitor import LevelMonitor
 
 myappid = "fchampalimaud.cdc.speaker_calibration"
-ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 
 
 class SettingsLayout(QWidget):
@@ -82,6 +84,10 @@ class SettingsLayout(QWidget):
         self.run = QPushButton("Run")
         self.vlayout.addWidget(self.run)
 
+        self.monitor = QPushButton("Monitor")
+        self.monitor.setCheckable(True)
+        self.vlayout.addWidget(self.monitor)
+
         self.setLayout(self.vlayout)
 
         self.on_sound_type_changed(0)
@@ -515,6 +521,17 @@ class PlotLayout(QWidget):
 
         self.plot_selection.addItems(self.plots.keys())
 
+    def show_monitor(self, plot: MonitorPlot):
+        while self.plot_selection.count() > 0:
+            self.plot_selection.removeItem(0)
+
+        while self.fig.count() > 0:
+            self.fig.removeWidget(self.fig.currentWidget())
+
+        self.plots = {"Monitor": plot}
+        self.fig.addWidget(plot.figure)
+        self.plot_selection.addItems(self.plots.keys())
+
     def generate_selection(self):
         layout = QHBoxLayout()
 
@@ -529,36 +546,42 @@ class PlotLayout(QWidget):
         self.vlayout.addLayout(layout)
 
     def calibration_callback(self, code: str, *args):
+        # The events arrive through the callback bus, already reduced, in the GUI thread
         if code == "EQ Filter":
             self.plots["EQ Filter"].add_data(*args)
         elif code == "Pre-calibration":
             self.plots["Calibration Data"].add_xx(*args)
         elif code == "Noise Calibration":
-            self.plots["Calibration Data"].add_point(
-                args[0], args[1].calculate_db_spl()
-            )
-            self.plots["Calibration Signals"].plot_signal(args[1])
+            self.plots["Calibration Data"].add_point(*args)
+        elif code == "Noise Calibration Spectrum":
+            self.plots["Calibration Signals"].plot_spectrum(*args)
         elif code == "Pure Tone Calibration":
-            self.plots["Calibration Data"].add_point(
-                args[0], args[1], args[3].calculate_db_spl()
-            )
-            self.plots["Calibration Signals"].add_signal(
-                args[0], args[1], args[2], args[3]
-            )
+            i, j, db_spl, traces = args
+            self.plots["Calibration Data"].add_point(i, j, db_spl)
+            if traces is not None:
+                self.plots["Calibration Signals"].add_signal(i, j, *traces)
+        elif code == "Multisine Calibration":
+            row_offset, j, levels, traces = args
+            for i, db_spl in enumerate(levels, row_offset):
+                self.plots["Calibration Data"].add_point(i, j, db_spl)
+                if traces is not None:
+                    self.plots["Calibration Signals"].add_signal(i, j, *traces)
         elif code == "Pre-test":
             self.plots["Test Data"].add_xx(*args, True)
         elif code == "Noise Test":
-            self.plots["Test Data"].add_point(args[0], args[1].calculate_db_spl())
-            self.plots["Test Signals"].plot_signal(args[1])
+            self.plots["Test Data"].add_point(*args)
+        elif code == "Noise Test Spectrum":
+            self.plots["Test Signals"].plot_spectrum(*args)
         elif code == "Pure Tone Test":
-            self.plots["Test Data"].add_point(
-                args[0], args[1], args[3].calculate_db_spl()
-            )
-            self.plots["Test Signals"].add_signal(args[0], args[1], args[2], args[3])
+            i, j, db_spl, traces = args
+            self.plots["Test Data"].add_point(i, j, db_spl)
+            if traces is not None:
+                self.plots["Test Signals"].add_signal(i, j, *traces)
 
 
 class ApplicationWindow(QMainWindow):
     work_requested = Signal()
+    monitor_requested = Signal()
 
     def __init__(self):
         super().__init__()
@@ -578,6 +601,7 @@ class ApplicationWindow(QMainWindow):
         scroll_area.setFixedWidth(320)
 
         self.config.run.clicked.connect(self.run_calibration)
+        self.config.monitor.toggled.connect(self.toggle_monitor)
         self.plot.plot_selection.currentIndexChanged.connect(self.switch_plots)
 
         layout.addWidget(self.plot)
@@ -602,32 +626,14 @@ class ApplicationWindow(QMainWindow):
             )
         else:
             soundcard = ComputerSoundCard(
-                soundcard_name="",  # FIXME
-                fs=self.config.sc.serial_port.fs_computer.value(),
+                soundcard_name="",
+                fs=self.config.sc.fs_computer.value(),
                 speaker=self.config.sc.convert_speaker(),
             )
 
-        match self.config.adc.adc.currentText():
-            case "NI-DAQ":
-                if not self.nidaqmx_available():
-                    QMessageBox.warning(
-                        self,
-                        "Warning",
-                        "The NI-DAQ is not connected. Please turn it on.",
-                    )
-                    return
-
-                adc = NiDaq(
-                    fs=self.config.adc.fs_adc.value(),
-                    device_id=self.config.adc.device_id.value(),
-                    channel=self.config.adc.channel.value(),
-                )
-            case "Moku":
-                adc = Moku(
-                    fs=self.config.adc.fs_adc.value(),
-                    address=self.config.adc.address.text(),
-                    channel=self.config.adc.channel.value(),
-                )
+        adc = self.adc_settings()
+        if adc is None:
+            return
 
         filt = Filter(
             filter_input=self.config.filter.filter_input.isChecked(),
@@ -725,7 +731,8 @@ class ApplicationWindow(QMainWindow):
         )
 
         self.worker_thread = QThread()
-        self.worker = Worker(self.settings, self.plot.calibration_callback)
+        self.bus = CallbackBus(self.plot.calibration_callback)
+        self.worker = Worker(self.settings, self.bus.publish)
         self.worker.moveToThread(self.worker_thread)
         self.worker.finished.connect(self.on_task_finished)
         self.work_requested.connect(self.worker.run)
@@ -734,9 +741,77 @@ class ApplicationWindow(QMainWindow):
         self.work_requested.emit()
 
         self.config.run.setEnabled(False)
+        self.config.monitor.setEnabled(False)
+
+    def adc_settings(self) -> Optional[NiDaq | Moku]:
+        match self.config.adc.adc.currentText():
+            case "NI-DAQ":
+                if not self.nidaqmx_available():
+                    QMessageBox.warning(
+                        self,
+                        "Warning",
+                        "The NI-DAQ is not connected. Please turn it on.",
+                    )
+                    return None
+
+                return NiDaq(
+                    fs=self.config.adc.fs_adc.value(),
+                    device_id=self.config.adc.device_id.value(),
+                    channel=self.config.adc.channel.value(),
+                )
+            case _:
+                return Moku(
+                    fs=self.config.adc.fs_adc.value(),
+                    address=self.config.adc.address.text(),
+                    channel=self.config.adc.channel.value(),
+                )
+
+    def toggle_monitor(self, checked: bool):
+        if not checked:
+            # The acquisition stops after its current block
+            if hasattr(self, "monitor_worker"):
+                self.monitor_worker.stop()
+            return
+
+        adc = self.adc_settings()
+        if adc is None:
+            self.config.monitor.setChecked(False)
+            return
+
+        level = LevelMonitor(
+            adc.fs,
+            mic_factor=self.config.mic_factor.value(),
+            reference_pressure=self.config.reference_pressure.value(),
+        )
+        self.plot.show_monitor(MonitorPlot(adc.fs, level.band_centers))
+
+        self.monitor_thread = QThread()
+        self.monitor_worker = MonitorWorker(adc, level)
+        self.monitor_worker.moveToThread(self.monitor_thread)
+        self.monitor_worker.reading.connect(self.on_monitor_reading)
+        self.monitor_worker.finished.connect(self.on_monitor_finished)
+        self.monitor_requested.connect(self.monitor_worker.run)
+        self.monitor_thread.start()
+
+        self.monitor_requested.emit()
+
+        self.config.run.setEnabled(False)
+
+    def on_monitor_reading(self, reading: tuple):
+        self.plot.plots["Monitor"].update(*reading)
+        self.monitor_worker.pending = False
+
+    def on_monitor_finished(self):
+        self.monitor_requested.disconnect(self.monitor_worker.run)
+        self.monitor_thread.quit()
+        self.config.monitor.setChecked(False)
+        self.config.run.setEnabled(True)
 
     def nidaqmx_available(self) -> bool:
         try:
+            # The driver is only imported when the NI-DAQ is selected
+            import nidaqmx
+
             with nidaqmx.Task() as task:
                 task.ai_channels.add_ai_voltage_chan(
                     "Dev1/ai0", min_val=-10.0, max_val=10.0
@@ -761,11 +836,16 @@ class ApplicationWindow(QMainWindow):
 
     def on_task_finished(self):
         self.config.run.setEnabled(True)
+        self.config.monitor.setEnabled(True)
         self.worker_thread.quit()
 
     def closeEvent(self, event):
         if hasattr(self, "worker_thread"):
             self.worker_thread.quit()
+        if hasattr(self, "monitor_worker"):
+            self.monitor_worker.stop()
+            self.monitor_thread.quit()
+            self.monitor_thread.wait()
         event.accept()  # Accept the close event
 
 
@@ -783,7 +863,58 @@ class Worker(QObject):
         self.finished.emit()
 
 
+class MonitorWorker(QObject):
+    """
+    Streams the ADC in its own thread and sends the live levels to the interface.
+
+    A new reading is only sent once the interface has shown the previous one (`pending` is cleared by the interface), so the readings never pile up if the interface is slower than the acquisition.
+    """
+
+    # The maximum number of points of the spectrum sent to the plot
+    POINTS = 512
+
+    reading = Signal(tuple)
+    finished = Signal()
+
+    def __init__(self, adc, level: LevelMonitor, rate: float = 20):
+        super(MonitorWorker, self).__init__()
+        self.adc = adc
+        self.level = level
+        self.rate = rate
+        self.pending = False
+        self._stop = False
+
+    def stop(self):
+        self._stop = True
+
+    @Slot()
+    def run(self):
+        try:
+            create_adc(self.adc).stream(self.on_block, 1 / self.rate)
+        finally:
+            self.finished.emit()
+
+    def on_block(self, block) -> bool:
+        self.level.add(block)
+        if self.level.ready and not self.pending:
+            self.pending = True
+            _, band_db = self.level.band_levels()
+            self.reading.emit(
+                (
+                    self.level.db_spl("Z"),
+                    self.level.db_spl("A"),
+                    band_db,
+                    *self.level.spectrum(self.POINTS),
+                )
+            )
+        return self._stop
+
+
 def main():
+    # Show the icon of the app in the Windows taskbar
+    if sys.platform == "win32":
+        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
+
     qapp = QApplication.instance()
     if not qapp:
         qapp = QApplication(sys.argv)
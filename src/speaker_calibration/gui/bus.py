@@ -0,0 +1,209 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PySide6.QtCore import QObject, Qt, Signal
+from scipy.signal import freqz
+
+from speaker_calibration.gui.utils import EnvelopePyramid
+from speaker_calibration.utils import REFERENCE_PRESSURE
+
+# The events whose payload carries traces or spectra, which are dropped when the interface falls behind
+TRACE_EVENTS = (
+    "Noise Calibration",
+    "Noise Test",
+    "Pure Tone Calibration",
+    "Pure Tone Test",
+    "Multisine Calibration",
+)
+
+
+class CallbackBus(QObject):
+    """
+    The bridge between the calibration, which runs in a worker thread, and the plots of the interface.
+
+    The protocols call `publish` as their callback. The sounds are reduced to lightweight payloads in the worker thread (levels and envelopes of the traces) and delivered to the GUI thread through a queued signal, so the figures are only changed in the GUI thread and the protocol never waits for them to be drawn. The spectra of the noise recordings are computed by a pool of threads and sent as "<code> Spectrum" events, and they are cached per recording.
+
+    If more than `max_pending` payloads with traces are waiting to be handled by the interface, the traces of the following events are dropped (and not even computed) until it catches up. The levels are always delivered.
+
+    Attributes
+    ----------
+    max_pending : int
+        The maximum number of payloads with traces waiting to be handled by the interface.
+    max_bins : int
+        The number of bins of the finest level of the envelopes of the traces.
+    spectrum_points : int
+        The maximum number of frequencies of the spectra.
+    max_cached : int
+        The maximum number of spectra kept in the cache.
+    """
+
+    max_pending: int
+    max_bins: int
+    spectrum_points: int
+    max_cached: int
+
+    # The event code and its reduced payload
+    event = Signal(str, tuple)
+
+    def __init__(
+        self,
+        handler,
+        max_pending: int = 8,
+        max_bins: int = 4096,
+        spectrum_points: int = 1024,
+        max_cached: int = 256,
+        workers: int = 2,
+    ):
+        """
+        Parameters
+        ----------
+        handler : Callable
+            The function called in the GUI thread with the event code and the reduced payload.
+        workers : int, optional
+            The number of threads that compute the spectra.
+        """
+        super().__init__()
+        self.max_pending = max_pending
+        self.max_bins = max_bins
+        self.spectrum_points = spectrum_points
+        self.max_cached = max_cached
+        self._spectra = OrderedDict()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="spectra")
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._handler = handler
+
+        self.event.connect(self._deliver, Qt.ConnectionType.QueuedConnection)
+
+    def publish(self, code: str, *args):
+        """
+        Reduces an event of the protocol and sends it to the GUI thread. It is the callback given to the protocol.
+
+        Parameters
+        ----------
+        code : str
+            The event code, e.g. "Noise Calibration".
+        *args
+            The arguments of the event, as sent by the protocol.
+        """
+        with_traces = False
+        if code in TRACE_EVENTS:
+            with self._lock:
+                with_traces = self._pending < self.max_pending
+                self._pending += with_traces
+
+        match code:
+            case "EQ Filter":
+                freq, response = freqz(args[0], 1, 4096)
+                payload = (freq, 20 * np.log10(np.abs(response)))
+            case "Pre-calibration" | "Pre-test":
+                payload = tuple(np.array(arg, copy=True) for arg in args)
+            case "Noise Calibration" | "Noise Test":
+                # The level is sent at once and the spectrum once it is computed by the pool
+                index, sound = args
+                db_spl = sound.calculate_db_spl()
+                if with_traces:
+                    self._executor.submit(
+                        self._send_spectrum, code, (code, index), sound, db_spl
+                    )
+                payload = (index, db_spl)
+                with_traces = False
+            case "Pure Tone Calibration" | "Pure Tone Test":
+                i, j, signal, recording = args
+                traces = None
+                if with_traces:
+                    traces = (self.envelope(signal), self.envelope(recording))
+                payload = (i, j, recording.calculate_db_spl(), traces)
+            case "Multisine Calibration":
+                # The recording is shared by every tone of the multisine, so its traces are reduced once and the level of each tone is sent instead of the broadband level
+                row_offset, j, signal, recording, levels = args
+                traces = None
+                if with_traces:
+                    traces = (self.envelope(signal), self.envelope(recording))
+                payload = (row_offset, j, np.array(levels, copy=True), traces)
+            case _:
+                # The remaining events are not shown by the interface
+                return
+
+        self.event.emit(code, (with_traces, payload))
+
+    def spectrum(
+        self, sound, reference_pressure: float = REFERENCE_PRESSURE
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Calculates the spectrum of a recording shown in the interface, decimated to at most `spectrum_points` frequencies.
+
+        Parameters
+        ----------
+        sound : RecordedSound
+            The recording.
+        reference_pressure : float, optional
+            The reference pressure (Pa).
+
+        Returns
+        -------
+        freq : numpy.ndarray
+            The frequencies of the spectrum (Hz).
+        db : numpy.ndarray
+            The spectrum (dB SPL).
+        """
+        freq, fft = sound.fft_welch(0.005)
+        spectrum = 20 * np.log10(fft / reference_pressure)
+
+        # Interpolate the spectrum to the display grid if it has more frequencies than the plot can show
+        if freq.size > self.spectrum_points:
+            grid = np.linspace(freq[0], freq[-1], self.spectrum_points)
+            spectrum = np.interp(grid, freq, spectrum)
+            freq = grid
+
+        return freq, spectrum
+
+    def envelope(self, sound) -> EnvelopePyramid:
+        """
+        Reduces a sound to its min/max envelope pyramid, so that its size depends on the width of the plot instead of on its number of samples.
+
+        Parameters
+        ----------
+        sound : Sound
+            The sound.
+
+        Returns
+        -------
+        envelope : EnvelopePyramid
+            The envelope of the sound.
+        """
+        start = 0 if sound.time is None else float(sound.time[0])
+        return EnvelopePyramid(sound.signal, sound.fs, start, self.max_bins)
+
+    def _send_spectrum(self, code: str, recording_id: tuple, sound, db_spl: float):
+        # A recording sent again (e.g. the same point published twice) reuses its spectrum
+        key = (recording_id, sound.signal.size, db_spl)
+        try:
+            with self._lock:
+                spectrum = self._spectra.get(key)
+                if spectrum is not None:
+                    self._spectra.move_to_end(key)
+
+            if spectrum is None:
+                spectrum = self.spectrum(sound)
+                with self._lock:
+                    self._spectra[key] = spectrum
+                    if len(self._spectra) > self.max_cached:
+                        self._spectra.popitem(last=False)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+        self.event.emit(code + " Spectrum", (True, (recording_id, *spectrum)))
+
+    def _deliver(self, code: str, event: tuple):
+        with_traces, payload = event
+        try:
+            self._handler(code, *payload)
+        finally:
+            if with_traces:
+                with self._lock:
+                    self._pending -= 1
@@ -7,11 +7,8 @@ from PySide6.QtWidgets import (
     QFormLayout,
     QMessageBox,
 )
-from harp.devices.soundcard import SoundCard as HSC
-from harp.protocol.exceptions import HarpTimeoutError
 from speaker_calibration.gui.utils import get_ports
 from speaker_calibration.utils import Speaker
-from serial import SerialException
 
 
 class SoundCardLayout(QGroupBox):
@@ -91,6 +88,11 @@ class SoundCardLayout(QGroupBox):
             self.serial_port.addItems(get_ports())
             return
 
+        # The driver is only imported when a Harp SoundCard is connected
+        from harp.devices.soundcard import SoundCard as HSC
+        from harp.protocol.exceptions import HarpTimeoutError
+        from serial import SerialException
+
         try:
             soundcard = HSC(self.serial_port.currentText())
             soundcard.disconnect()
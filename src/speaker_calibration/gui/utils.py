@@ -1,12 +1,14 @@
+import time
+from collections import OrderedDict
+
 import numpy as np
 import serial.tools.list_ports
+from matplotlib.artist import Artist
 from matplotlib.backends.backend_qtagg import FigureCanvas
 from matplotlib.backends.backend_qtagg import NavigationToolbar2QT as NavigationToolbar
 from matplotlib.figure import Figure
+from PySide6.QtCore import QTimer, Signal
 from PySide6.QtWidgets import QVBoxLayout, QWidget
-from scipy.signal import freqz
-
-from speaker_calibration.sound import RecordedSound, Sound
 
 
 def get_ports():
@@ -22,6 +24,17 @@ def get_ports():
 
 
 class MatplotlibWidget(QWidget):
+    """
+    The widget with a matplotlib figure, which redraws it at most `MAX_FPS` times per second.
+
+    The plots request a redraw after every update instead of drawing the figure themselves, so that the updates that arrive between two frames are drawn at once. If the limits of the axes do not change, only the animated artists are drawn over the saved background (blitting); otherwise, the whole figure is drawn.
+    """
+
+    MAX_FPS = 20
+
+    # Emitted by the redraw requests, so that the redraw is scheduled in the GUI thread whichever thread requests it
+    draw_requested = Signal()
+
     def __init__(self):
         super().__init__()
         self.fig = Figure(figsize=(5, 3))
@@ -32,6 +45,188 @@ class MatplotlibWidget(QWidget):
         self.vlayout.addWidget(self.canvas)
         self.setLayout(self.vlayout)
 
+        self._animated = []
+        self._background = None
+        self._rescale = False
+        self._last_draw = 0.0
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._draw)
+        self.draw_requested.connect(self._schedule)
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def clear(self):
+        """
+        Clears the axes and forgets their animated artists.
+        """
+        self.ax.clear()
+        self._animated = []
+        self._background = None
+
+    def add_artist(self, artist: Artist) -> Artist:
+        """
+        Registers an artist that is updated often. It is drawn over the background of the figure when the figure is redrawn with blitting.
+
+        Parameters
+        ----------
+        artist : Artist
+            The artist, which must already belong to the axes.
+
+        Returns
+        -------
+        artist : Artist
+            The same artist.
+        """
+        artist.set_animated(True)
+        self._animated.append(artist)
+        return artist
+
+    def request_draw(self, rescale: bool = False):
+        """
+        Requests a redraw of the figure, which happens once the minimum time between frames has passed.
+
+        Parameters
+        ----------
+        rescale : bool, optional
+            Whether the limits of the axes are recalculated from the data before the redraw.
+        """
+        self._rescale |= rescale
+        self.draw_requested.emit()
+
+    def _schedule(self):
+        if self._timer.isActive():
+            return
+        delay = 1 / self.MAX_FPS - (time.perf_counter() - self._last_draw)
+        self._timer.start(max(0, int(delay * 1000)))
+
+    def _draw(self):
+        self._last_draw = time.perf_counter()
+
+        limits_changed = False
+        if self._rescale:
+            self._rescale = False
+            limits = (self.ax.get_xlim(), self.ax.get_ylim())
+            self.ax.relim()
+            self.ax.autoscale_view()
+            limits_changed = limits != (self.ax.get_xlim(), self.ax.get_ylim())
+
+        # The background only has to be drawn again if it changed
+        if limits_changed or self._background is None or len(self._animated) == 0:
+            self.canvas.draw_idle()
+            return
+
+        self.canvas.restore_region(self._background)
+        for artist in self._animated:
+            self.ax.draw_artist(artist)
+        self.canvas.blit(self.fig.bbox)
+
+    def _on_draw(self, event):
+        # The figures being saved already include the animated artists and are not drawn on the screen
+        if event.canvas is not self.canvas or self.canvas.is_saving():
+            self._background = None
+            return
+
+        # Save the background after every full draw (including the ones caused by zooming or resizing) and draw the animated artists over it
+        self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+        for artist in self._animated:
+            self.ax.draw_artist(artist)
+
+
+class EnvelopePyramid:
+    """
+    The min/max envelope of a trace at several resolutions, so that a waveform is drawn with a number of points proportional to the width of the plot instead of to its number of samples.
+
+    The finest level has at most `max_bins` bins (or the samples themselves, for short traces) and every following level merges pairs of bins of the previous one. Only the levels are kept, not the trace.
+
+    Attributes
+    ----------
+    start : float
+        The time of the first sample (s).
+    levels : list[numpy.ndarray]
+        The minimum and maximum of each bin of every level, from the finest to the coarsest, with shape (bins, 2).
+    bin_durations : list[float]
+        The duration of the bins of every level (s).
+    """
+
+    start: float
+    levels: list[np.ndarray]
+    bin_durations: list[float]
+
+    def __init__(
+        self,
+        signal: np.ndarray,
+        fs: float,
+        start: float = 0,
+        max_bins: int = 4096,
+        min_bins: int = 256,
+    ):
+        self.start = start
+
+        # The finest level, padded with the last sample so that every bin has the same number of samples
+        size = max(1, int(np.ceil(signal.size / max_bins)))
+        bins = int(np.ceil(signal.size / size))
+        padded = np.pad(signal, (0, bins * size - signal.size), mode="edge")
+        blocks = padded.reshape(bins, size)
+        level = np.stack((blocks.min(axis=1), blocks.max(axis=1)), axis=1)
+
+        self.levels = [level.astype(np.float32)]
+        self.bin_durations = [size / fs]
+        while self.levels[-1].shape[0] > min_bins:
+            level = self.levels[-1]
+            if level.shape[0] % 2 == 1:
+                level = np.concatenate((level, level[-1:]))
+            pairs = level.reshape(-1, 2, 2)
+            self.levels.append(
+                np.stack(
+                    (pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)), axis=1
+                )
+            )
+            self.bin_durations.append(2 * self.bin_durations[-1])
+
+    @property
+    def end(self) -> float:
+        return self.start + self.levels[0].shape[0] * self.bin_durations[0]
+
+    def view(
+        self, xmin: float, xmax: float, pixels: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the envelope of the part of the trace shown in the plot, from the coarsest level with at least one bin per pixel.
+
+        Parameters
+        ----------
+        xmin : float
+            The start of the view (s).
+        xmax : float
+            The end of the view (s).
+        pixels : int
+            The width of the plot (pixels).
+
+        Returns
+        -------
+        time : numpy.ndarray
+            The time of the points (s).
+        signal : numpy.ndarray
+            The minimum and the maximum of each bin, alternated.
+        """
+        index = 0
+        for index in range(len(self.levels) - 1, -1, -1):
+            if (xmax - xmin) / self.bin_durations[index] >= pixels:
+                break
+
+        level = self.levels[index]
+        bin_duration = self.bin_durations[index]
+        first = int(
+            np.clip(np.floor((xmin - self.start) / bin_duration), 0, level.shape[0])
+        )
+        last = int(
+            np.clip(np.ceil((xmax - self.start) / bin_duration) + 1, 0, level.shape[0])
+        )
+
+        time = self.start + np.arange(first, last) * bin_duration
+        return np.repeat(time, 2), level[first:last].ravel()
+
 
 class EQFilterPlot:
     def __init__(self):
@@ -39,32 +234,30 @@ class EQFilterPlot:
         self.init_plot()
 
     def init_plot(self):
-        self.figure.ax.clear()
+        self.figure.clear()
         (self.plot,) = self.figure.ax.plot([], [])
+        self.figure.add_artist(self.plot)
 
-    def add_data(self, filter):
-        freq, response = freqz(filter, 1, 192000)
-        self.plot.set_data(freq, 20 * np.log10(response))
-        self.figure.ax.relim()
-        self.figure.ax.autoscale_view()
-        self.figure.canvas.draw()
+    def add_data(self, freq: np.ndarray, response: np.ndarray):
+        self.plot.set_data(freq, response)
+        self.figure.request_draw(rescale=True)
 
 
 class NoiseDataPlot:
     def __init__(self, num_amp: int):
         self.figure = MatplotlibWidget()
-        self.data = np.zeros((num_amp, 3))
+        self.data = np.full((num_amp, 3), np.nan)
         self.init_plot()
 
     def init_plot(self):
-        self.figure.ax.clear()
+        self.figure.clear()
         self.plot = []
 
         (plot,) = self.figure.ax.plot([], [], "o", color="blue")
-        self.plot.append(plot)
+        self.plot.append(self.figure.add_artist(plot))
 
         (plot,) = self.figure.ax.plot([], [], "--", color="blue")
-        self.plot.append(plot)
+        self.plot.append(self.figure.add_artist(plot))
 
     def add_xx(self, xx, is_test=False):
         self.data[:, 0] = xx
@@ -73,40 +266,49 @@ class NoiseDataPlot:
         if is_test:
             self.plot[1].set_data(self.data[:, 0], self.data[:, 0])
 
-        self.figure.ax.relim()
-        self.figure.ax.autoscale_view()
-        self.figure.canvas.draw()
+        self.figure.request_draw(rescale=True)
 
     def add_point(self, index, data):
         self.data[index, 1] = data
         self.plot[0].set_data(self.data[:, 0], self.data[:, 1])
-        self.figure.ax.relim()
-        self.figure.ax.autoscale_view()
-        self.figure.canvas.draw()
+        self.figure.request_draw(rescale=True)
 
     def add_linear_regression(self, slope, intercept):
         self.data[:, 2] = slope * self.data[:, 0] + intercept
         self.plot[1].set_data(self.data[:, 0], self.data[:, 2])
-        self.figure.ax.relim()
-        self.figure.ax.autoscale_view()
-        self.figure.canvas.draw()
+        self.figure.request_draw(rescale=True)
 
 
 class NoiseSignalsPlot:
+    # The number of spectra shown at once. The oldest one is replaced by the newest one
+    MAX_LINES = 12
+
     def __init__(self, min_freq, max_freq):
         self.figure = MatplotlibWidget()
         self.init_plot(min_freq, max_freq)
 
     def init_plot(self, min_freq, max_freq):
-        self.figure.ax.clear()
+        self.figure.clear()
         self.figure.ax.set_xlim(max(0, min_freq - 10000), max_freq + 10000)
 
-    def plot_signal(self, signal: RecordedSound, reference_pressure: float = 0.00002):
-        freq, fft = signal.fft_welch(0.005)
-        self.figure.ax.plot(freq, 20 * np.log10(fft / reference_pressure))
-        self.figure.ax.relim()
-        self.figure.ax.autoscale_view()
-        self.figure.canvas.draw()
+        # A fixed pool of lines is reused, so the number of artists does not grow with the sweep
+        self.lines = []
+        for i in range(self.MAX_LINES):
+            (line,) = self.figure.ax.plot([], [])
+            self.lines.append(self.figure.add_artist(line))
+        self._shown = OrderedDict()
+
+    def plot_spectrum(self, recording_id, freq: np.ndarray, spectrum: np.ndarray):
+        # The spectrum of a recording shown before replaces its previous one
+        line = self._shown.pop(recording_id, None)
+        if line is None and len(self._shown) < len(self.lines):
+            line = self.lines[len(self._shown)]
+        elif line is None:
+            _, line = self._shown.popitem(last=False)
+        self._shown[recording_id] = line
+
+        line.set_data(freq, spectrum)
+        self.figure.request_draw(rescale=True)
 
 
 class PureTonesDataPlot:
@@ -126,45 +328,58 @@ class PureTonesDataPlot:
     def add_point(self, amp, freq, data):
         self.data[amp, freq, 2] = data
         self.plot.set_data(self.data[:, :, 2])
-        self.figure.ax.relim()
-        self.figure.ax.autoscale_view()
-        self.figure.canvas.draw()
+        self.figure.request_draw(rescale=True)
 
 
 class PureTonesSignalsPlot:
     def __init__(self, num_amp: int, num_freqs: int):
         self.figure = MatplotlibWidget()
-        self.data = np.zeros((num_freqs, num_amp, 2), dtype=RecordedSound)
+        self.data = np.full((num_freqs, num_amp, 2), None, dtype=object)
         self._amp_index = 0
         self._freq_index = 0
         self.init_plot()
 
     def init_plot(self):
-        self.figure.ax.clear()
+        self.figure.clear()
         self.plot = []
         for i in range(2):
             (plot,) = self.figure.ax.plot([], [])
-            self.plot.append(plot)
-
-    def add_signal(self, amp: int, freq: int, signal: Sound, recording: RecordedSound):
+            self.plot.append(self.figure.add_artist(plot))
+
+        # The resolution of the envelopes follows the zoom and the pan of the plot
+        self.figure.ax.callbacks.connect("xlim_changed", self._on_xlim_changed)
+
+    def add_signal(
+        self,
+        amp: int,
+        freq: int,
+        signal: EnvelopePyramid,
+        recording: EnvelopePyramid,
+    ):
+        # Only the envelopes are kept, not the sounds
         self.data[amp, freq, 0] = signal
         self.data[amp, freq, 1] = recording
 
-    def plot_signal(self, reference_pressure: float = 0.00002):
-        if isinstance(
-            self.data[self.amp_index, self.freq_index, 0], Sound
-        ) and isinstance(self.data[self.amp_index, self.freq_index, 1], RecordedSound):
-            self.plot[0].set_data(
-                self.data[self.amp_index, self.freq_index, 0].time,
-                self.data[self.amp_index, self.freq_index, 0].signal,
-            )
-            self.plot[1].set_data(
-                self.data[self.amp_index, self.freq_index, 1].time,
-                self.data[self.amp_index, self.freq_index, 1].signal,
-            )
-        self.figure.ax.relim()
-        self.figure.ax.autoscale_view()
-        self.figure.canvas.draw()
+    def plot_signal(self):
+        pyramids = self.data[self.amp_index, self.freq_index]
+        if pyramids[1] is not None:
+            # The x limits are set explicitly (which also shows the envelopes), so that autoscaling only changes the y limits
+            xmin = min(pyramid.start for pyramid in pyramids)
+            xmax = max(pyramid.end for pyramid in pyramids)
+            self.figure.ax.set_xlim(xmin, xmax)
+            self._show(xmin, xmax)
+        self.figure.request_draw(rescale=True)
+
+    def _show(self, xmin: float, xmax: float):
+        pixels = max(1, int(self.figure.ax.bbox.width))
+        for plot, pyramid in zip(self.plot, self.data[self.amp_index, self.freq_index]):
+            plot.set_data(*pyramid.view(xmin, xmax, pixels))
+
+    def _on_xlim_changed(self, ax):
+        if self.data[self.amp_index, self.freq_index, 1] is None:
+            return
+        self._show(*ax.get_xlim())
+        self.figure.request_draw()
 
     @property
     def amp_index(self):
@@ -183,3 +398,57 @@ class PureTonesSignalsPlot:
     def freq_index(self, value: int):
         self._freq_index = value
         self.plot_signal()
+
+
+class MonitorPlot:
+    # The range of levels shown (dB SPL), fixed so that the updates are blitted
+    MIN_DB = 0
+    MAX_DB = 130
+
+    def __init__(self, fs: float, band_centers: np.ndarray, bands_per_octave: int = 1):
+        self.figure = MatplotlibWidget()
+        self.init_plot(fs, band_centers, bands_per_octave)
+
+    def init_plot(self, fs: float, band_centers: np.ndarray, bands_per_octave: int):
+        self.figure.clear()
+        ax = self.figure.ax
+        ax.set_xscale("log")
+        ax.set_xlim(band_centers[0] / 2 ** (0.5 / bands_per_octave), fs / 2)
+        ax.set_ylim(self.MIN_DB, self.MAX_DB)
+        ax.set_xlabel("Frequency (Hz)")
+        ax.set_ylabel("dB SPL")
+
+        # The band levels as bars under the spectrum
+        widths = band_centers * (
+            2 ** (0.5 / bands_per_octave) - 2 ** (-0.5 / bands_per_octave)
+        )
+        self.bars = ax.bar(
+            band_centers / 2 ** (0.5 / bands_per_octave),
+            np.zeros(band_centers.size),
+            widths,
+            align="edge",
+            alpha=0.4,
+            color="tab:gray",
+        )
+        for bar in self.bars:
+            self.figure.add_artist(bar)
+
+        (self.spectrum,) = ax.plot([], [], color="tab:blue", linewidth=1)
+        self.figure.add_artist(self.spectrum)
+        self.level = self.figure.add_artist(
+            ax.text(0.02, 0.95, "", transform=ax.transAxes, va="top", fontsize=14)
+        )
+
+    def update(
+        self,
+        db_z: float,
+        db_a: float,
+        band_db: np.ndarray,
+        freq: np.ndarray,
+        spectrum: np.ndarray,
+    ):
+        for bar, db in zip(self.bars, band_db):
+            bar.set_height(np.clip(db, self.MIN_DB, self.MAX_DB))
+        self.spectrum.set_data(freq, spectrum)
+        self.level.set_text(f"{db_z:.1f} dB SPL (Z)\n{db_a:.1f} dB SPL (A)")
+        self.figure.request_draw()
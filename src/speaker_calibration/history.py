@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+import speaker_calibration.config as settings
+from speaker_calibration.config import Config, Paths
+
+
+class StoredResult(BaseModel):
+    key: str = Field(
+        description="The key of the hardware, ADC, microphone and frequency band with which the result was measured."
+    )
+    time: datetime = Field(
+        description="The time at which the result was measured or last verified."
+    )
+    path: str = Field(description="The output directory of the run.")
+    eq_filter: Optional[str] = Field(
+        description="The path to the EQ filter. Only the noise calibration has one.",
+        default=None,
+    )
+    calibration: str = Field(
+        description="The path to the calibration parameters (noise) or to the calibration array (pure tones)."
+    )
+
+
+class ResultIndex:
+    """
+    The index of the results of past calibrations, keyed by the hardware with which they were measured, so that the newest one can be reused without pasting its paths into the configuration.
+
+    Each result is a JSON line appended to the index file, which is kept in the output directory of the calibrations.
+
+    Attributes
+    ----------
+    path : Path
+        The path to the index file.
+    """
+
+    path: Path
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def add(self, result: StoredResult):
+        """
+        Adds a result to the index.
+
+        Parameters
+        ----------
+        result : StoredResult
+            The result to be added.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as file:
+            file.write(result.model_dump_json() + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def latest(
+        self, key: str, max_age: Optional[float] = None
+    ) -> Optional[StoredResult]:
+        """
+        Finds the newest valid result with a key, i.e. the newest one whose files still exist.
+
+        Parameters
+        ----------
+        key : str
+            The key of the result, calculated with `result_key`.
+        max_age : float, optional
+            The maximum age of the result (days). If not provided, results of any age are accepted.
+
+        Returns
+        -------
+        result : StoredResult, optional
+            The newest valid result, or None if there is none.
+        """
+        if not self.path.exists():
+            return None
+
+        results = []
+        with open(self.path, "r") as file:
+            for line in file:
+                # A line left incomplete by a crash is ignored
+                try:
+                    result = StoredResult.model_validate_json(line)
+                except ValueError:
+                    continue
+                if result.key == key:
+                    results.append(result)
+
+        for result in sorted(results, key=lambda result: result.time, reverse=True):
+            if max_age is not None and datetime.now() - result.time > timedelta(
+                days=max_age
+            ):
+                break
+            files = [result.calibration]
+            if result.eq_filter is not None:
+                files.append(result.eq_filter)
+            if all(Path(file).exists() for file in files):
+                return result
+
+        return None
+
+
+def result_key(config: Config) -> Optional[str]:
+    """
+    Calculates the key under which the results of a calibration are indexed: the soundcard and audio amplifier, the ADC, the microphone and the frequency band of the protocol.
+
+    Parameters
+    ----------
+    config : Config
+        The configuration of the calibration.
+
+    Returns
+    -------
+    key : str, optional
+        The SHA-256 hash of the description of the calibration, or None if the hardware cannot be identified (a Harp SoundCard without its IDs).
+    """
+    soundcard = config.soundcard.model_dump(mode="json")
+    if isinstance(config.soundcard, settings.HarpSoundCard):
+        if (
+            config.soundcard.soundcard_id is None
+            or config.soundcard.audio_amp_id is None
+        ):
+            return None
+        # The serial port may change between runs, unlike the IDs of the devices
+        del soundcard["serial_port"]
+    else:
+        # The streaming settings do not change the sound
+        del soundcard["block_size"], soundcard["latency"]
+
+    protocol = config.protocol
+    if isinstance(protocol, settings.NoiseProtocolSettings):
+        band = {
+            "min_freq": protocol.min_freq,
+            "max_freq": protocol.max_freq,
+            "filter": protocol.filter.model_dump(mode="json"),
+        }
+    else:
+        band = {
+            "min_freq": protocol.calibration.min_freq,
+            "max_freq": protocol.calibration.max_freq,
+        }
+
+    description = {
+        "soundcard": [type(config.soundcard).__name__, soundcard],
+        "adc": [type(config.adc).__name__, config.adc.model_dump(mode="json")],
+        "mic_factor": protocol.mic_factor,
+        "reference_pressure": protocol.reference_pressure,
+        "protocol": [type(protocol).__name__, band],
+    }
+    encoded = json.dumps(description, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def stored_result(key: str, path: Path, paths: Paths) -> Optional[StoredResult]:
+    """
+    Builds the result of a finished calibration, either measured in the run or reused from the paths of the configuration.
+
+    Parameters
+    ----------
+    key : str
+        The key of the calibration, calculated with `result_key`.
+    path : Path
+        The output directory of the run.
+    paths : Paths
+        The paths used by the protocol, which point to the reused results.
+
+    Returns
+    -------
+    result : StoredResult, optional
+        The result, or None if the run has no calibration.
+    """
+    eq_filter = path / "eq_filter.npy"
+    eq_filter = eq_filter if eq_filter.exists() else paths.eq_filter
+
+    calibration = paths.calibration
+    for name in ("calibration_parameters.npy", "calibration.npy"):
+        if (path / name).exists():
+            calibration = path / name
+    if calibration is None:
+        return None
+
+    return StoredResult(
+        key=key,
+        time=datetime.now(),
+        path=str(path.resolve()),
+        eq_filter=None if eq_filter is None else str(Path(eq_filter).resolve()),
+        calibration=str(Path(calibration).resolve()),
+    )
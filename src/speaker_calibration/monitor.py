@@ -0,0 +1,304 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Literal, Optional
+
+import numpy as np
+import yaml
+
+from speaker_calibration.backends import create_adc
+from speaker_calibration.config import Config
+from speaker_calibration.utils import REFERENCE_PRESSURE
+
+
+def a_weighting(freq: np.ndarray) -> np.ndarray:
+    """
+    Calculates the A-weighting of IEC 61672-1.
+
+    Parameters
+    ----------
+    freq : numpy.ndarray
+        The frequencies (Hz).
+
+    Returns
+    -------
+    weighting : numpy.ndarray
+        The gain of the A-weighting at each frequency (dB).
+    """
+    f2 = np.asarray(freq, dtype=float) ** 2
+    response = (12194**2 * f2**2) / (
+        (f2 + 20.6**2) * np.sqrt((f2 + 107.7**2) * (f2 + 737.9**2)) * (f2 + 12194**2)
+    )
+    with np.errstate(divide="ignore"):
+        return 20 * np.log10(response) + 2.0
+
+
+class LevelMonitor:
+    """
+    Calculates the live level and spectrum of a signal that is fed block by block, e.g. by `RecordingDevice.stream`.
+
+    The last `nfft` samples are kept in a sliding buffer. Only the frames completed by each new block are transformed (Hann window, 50% overlap), and their power spectra are averaged with an exponential time weighting, so the cost of an update depends on the size of the block and not on the averaging time. The Z- and A-weighted levels and the band levels are calculated from the averaged spectrum.
+
+    Attributes
+    ----------
+    fs : float
+        The sampling frequency of the signal (Hz).
+    nfft : int
+        The number of samples of each frame.
+    time_constant : float
+        The time constant of the exponential averaging (s). 0.125 s is the "fast" time weighting of sound level meters.
+    mic_factor : float
+        The conversion factor of the microphone (V/Pa).
+    reference_pressure : float
+        The reference pressure (Pa).
+    freq : numpy.ndarray
+        The frequencies of the spectrum (Hz).
+    band_centers : numpy.ndarray
+        The center frequencies of the bands (Hz).
+    """
+
+    fs: float
+    nfft: int
+    time_constant: float
+    mic_factor: float
+    reference_pressure: float
+    freq: np.ndarray
+    band_centers: np.ndarray
+
+    def __init__(
+        self,
+        fs: float,
+        nfft: int = 4096,
+        time_constant: float = 0.125,
+        mic_factor: float = 1,
+        reference_pressure: float = REFERENCE_PRESSURE,
+        bands_per_octave: int = 1,
+        min_freq: float = 20,
+    ):
+        """
+        Parameters
+        ----------
+        bands_per_octave : int, optional
+            The number of bands per octave, e.g. 1 for octave bands and 3 for third-octave bands.
+        min_freq : float, optional
+            The lowest frequency of the bands (Hz).
+        """
+        self.fs = fs
+        self.nfft = nfft
+        self.time_constant = time_constant
+        self.mic_factor = mic_factor
+        self.reference_pressure = reference_pressure
+
+        self._hop = nfft // 2
+        self._window = np.hanning(nfft)
+        self._buffer = np.zeros(nfft)
+        self._new = 0
+        self._filled = 0
+        self._alpha = 1 - np.exp(-self._hop / (fs * time_constant))
+
+        # The power of each bin, scaled so that the sum over the bins is the mean square of the signal
+        self.freq = np.fft.rfftfreq(nfft, 1 / fs)
+        self._scale = np.full(self.freq.size, 2 / (nfft * np.sum(self._window**2)))
+        self._scale[0] /= 2
+        if nfft % 2 == 0:
+            self._scale[-1] /= 2
+        self._power = None
+
+        self._a_weights = 10 ** (a_weighting(self.freq) / 10)
+
+        # The nominal band centers are referred to 1 kHz, and every bin is assigned to the band that contains it. The lowest bands are left out if the resolution of the spectrum is too coarse for them
+        min_freq = max(min_freq, 2 * fs / nfft)
+        step = 2 ** (1 / bands_per_octave)
+        first = np.ceil(np.log(min_freq / 1000) / np.log(step))
+        last = np.floor(np.log(fs / 2 / np.sqrt(step) / 1000) / np.log(step))
+        self.band_centers = 1000 * step ** np.arange(first, last + 1)
+        edges = np.append(
+            self.band_centers / np.sqrt(step), self.band_centers[-1] * np.sqrt(step)
+        )
+        self._band_index = np.searchsorted(edges, self.freq, side="right") - 1
+        self._in_band = (self._band_index >= 0) & (
+            self._band_index < self.band_centers.size
+        )
+
+    def add(self, block: np.ndarray):
+        """
+        Adds a block of samples, transforming the frames it completes.
+
+        Parameters
+        ----------
+        block : numpy.ndarray
+            The samples to be added.
+        """
+        start = 0
+        while start < block.size:
+            # Slide the buffer by the samples missing to complete the next frame
+            size = min(self._hop - self._new, block.size - start)
+            self._buffer[:-size] = self._buffer[size:]
+            self._buffer[-size:] = block[start : start + size]
+            self._new += size
+            self._filled = min(self._filled + size, self.nfft)
+            start += size
+
+            if self._new == self._hop and self._filled == self.nfft:
+                self._add_frame()
+            self._new %= self._hop
+
+    def _add_frame(self):
+        spectrum = np.fft.rfft(self._buffer * self._window)
+        power = (spectrum.real**2 + spectrum.imag**2) * self._scale
+
+        if self._power is None:
+            self._power = power
+        else:
+            self._power += self._alpha * (power - self._power)
+
+    @property
+    def ready(self) -> bool:
+        """
+        Whether a frame was already transformed, i.e. whether the levels can be calculated.
+        """
+        return self._power is not None
+
+    def db_spl(self, weighting: Literal["Z", "A"] = "Z") -> float:
+        """
+        Returns the time-weighted level (dB SPL).
+
+        Parameters
+        ----------
+        weighting : Literal["Z", "A"], optional
+            The frequency weighting: "Z" (none) or "A".
+        """
+        power = self._power if weighting == "Z" else self._power * self._a_weights
+        return self._to_db(np.sum(power))
+
+    def band_levels(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the time-weighted level of every band.
+
+        Returns
+        -------
+        centers : numpy.ndarray
+            The center frequencies of the bands (Hz).
+        db : numpy.ndarray
+            The level of every band (dB SPL).
+        """
+        power = np.bincount(
+            self._band_index[self._in_band],
+            weights=self._power[self._in_band],
+            minlength=self.band_centers.size,
+        )
+        return self.band_centers, self._to_db(power)
+
+    def spectrum(self, points: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the time-weighted spectrum.
+
+        Parameters
+        ----------
+        points : int, optional
+            The maximum number of points of the spectrum, e.g. to be plotted. The bins are merged in groups evenly spaced in a logarithmic scale, keeping the highest level of each group, so that the peaks are not lost. If not provided, every bin is returned.
+
+        Returns
+        -------
+        freq : numpy.ndarray
+            The frequencies of the spectrum (Hz).
+        db : numpy.ndarray
+            The level of every bin (dB SPL).
+        """
+        db = self._to_db(self._power)
+        if points is None or points >= self.freq.size:
+            return self.freq, db
+
+        # The DC bin is left out, as it cannot be shown in a logarithmic scale
+        starts = np.unique(np.geomspace(1, self.freq.size - 1, points).astype(int))
+        return self.freq[starts], np.maximum.reduceat(db, starts)
+
+    def _to_db(self, power):
+        reference = (self.mic_factor * self.reference_pressure) ** 2
+        return 10 * np.log10(np.maximum(power, 1e-30) / reference)
+
+
+def monitor(
+    config: Config,
+    rate: float = 20,
+    duration: Optional[float] = None,
+    bands_per_octave: int = 1,
+):
+    """
+    Shows the live level of the microphone in the terminal, with a bar per band, until it is interrupted (Ctrl+C) or `duration` passes.
+
+    Parameters
+    ----------
+    config : Config
+        The configuration, from which the ADC, the conversion factor of the microphone and the reference pressure are used.
+    rate : float, optional
+        The number of updates per second.
+    duration : float, optional
+        The duration of the monitoring (s). If not provided, it runs until it is interrupted.
+    bands_per_octave : int, optional
+        The number of bands per octave.
+    """
+    adc = create_adc(config.adc)
+    level = LevelMonitor(
+        adc.fs,
+        mic_factor=config.protocol.mic_factor,
+        reference_pressure=config.protocol.reference_pressure,
+        bands_per_octave=bands_per_octave,
+    )
+    end = None if duration is None else time.perf_counter() + duration
+
+    def on_block(block: np.ndarray) -> bool:
+        level.add(block)
+        if level.ready:
+            _, bands = level.band_levels()
+            # The bars go from 0 to 120 dB SPL
+            bars = " ".join(
+                " ▁▂▃▄▅▆▇█"[int(np.clip(db / 120 * 8, 0, 8))] for db in bands
+            )
+            sys.stdout.write(
+                f"\rZ {level.db_spl('Z'):6.1f} dB SPL  A {level.db_spl('A'):6.1f} dB(A)  {bars}"
+            )
+            sys.stdout.flush()
+        return end is not None and time.perf_counter() >= end
+
+    try:
+        adc.stream(on_block, 1 / rate)
+    except KeyboardInterrupt:
+        pass
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Shows the live level of the microphone, e.g. to place it before a calibration."
+    )
+    parser.add_argument(
+        "--config",
+        type=Path,
+        default=Path("./config/config.yml"),
+        help="The configuration with the ADC and the microphone.",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=20, help="The number of updates per second."
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        help="The duration of the monitoring (s). It runs until it is interrupted by default.",
+    )
+    parser.add_argument(
+        "--third-octaves",
+        action="store_true",
+        help="Show third-octave bands instead of octave bands.",
+    )
+    args = parser.parse_args()
+
+    with open(args.config, "r") as file:
+        config = Config(**yaml.safe_load(file))
+
+    monitor(config, args.rate, args.duration, 3 if args.third_octaves else 1)
+
+
+if __name__ == "__main__":
+    main()
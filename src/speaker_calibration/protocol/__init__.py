@@ -1,4 +1,5 @@
+from speaker_calibration.protocol.multisine import MultisineProtocol
 from speaker_calibration.protocol.noise import NoiseProtocol
 from speaker_calibration.protocol.pure_tone import PureToneProtocol
 
-__all__ = [NoiseProtocol, PureToneProtocol]
+__all__ = [MultisineProtocol, NoiseProtocol, PureToneProtocol]
@@ -0,0 +1,80 @@
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+
+class Journal:
+    """
+    The journal of a calibration run, to which every completed sweep point is committed, so that an interrupted run can be resumed.
+
+    Each entry is a JSON line appended and flushed to the disk at once. A line left incomplete by a crash is removed when the journal is loaded.
+
+    Attributes
+    ----------
+    path : Path
+        The path to the journal file.
+    """
+
+    path: Path
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._entries = {}
+
+        if self.path.exists():
+            # Truncate the file to its last complete line, otherwise the next commit would be appended to the incomplete line left by a crash and be lost with it
+            with open(self.path, "rb+") as file:
+                content = file.read()
+                end = content.rfind(b"\n") + 1
+                if end < len(content):
+                    file.truncate(end)
+
+            for line in content[:end].decode().splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._entries[entry["key"]] = entry
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> dict:
+        """
+        Returns the values committed with a key.
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry, usually the name of the file saved by the sweep point.
+
+        Returns
+        -------
+        values : dict
+            The values committed with the key.
+        """
+        return self._entries[key]["values"]
+
+    def commit(self, key: str, **values):
+        """
+        Commits a completed sweep point to the journal.
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry, usually the name of the file saved by the sweep point. The file must be saved before the point is committed. A key committed again has its values replaced.
+        **values
+            The JSON serializable values saved with the entry.
+        """
+        entry = {"key": key, "time": datetime.now().isoformat(), "values": values}
+
+        with open(self.path, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+        self._entries[key] = entry
@@ -0,0 +1,154 @@
+import numpy as np
+
+from speaker_calibration.protocol.pipeline import Pipeline, Stage
+from speaker_calibration.protocol.pure_tone import SOUND_INDICES, PureToneProtocol
+from speaker_calibration.sound import Multisine, RecordedSound, Sound
+from speaker_calibration.soundcards import (
+    ComputerSoundCard,
+    HarpSoundCard,
+)
+from speaker_calibration.utils import SweepType
+
+
+class MultisineProtocol(PureToneProtocol):
+    """
+    Pure tone calibration in which all frequencies of the grid are played at once, as a multisine, and their levels are extracted from the FFT of a single recording per amplitude.
+
+    The calibration array has the same layout as the one of the pure tone protocol. Its amplitudes are the amplitudes of each tone inside the multisine. The calibration test is still performed with pure tones.
+    """
+
+    def sound_sweep(
+        self,
+        calib_array: np.ndarray,
+        duration: float,
+        type: SweepType = SweepType.CALIBRATION,
+        row_offset: int = 0,
+    ):
+        """
+        Plays multisines with different amplitudes and calculates the correspondent intensities in dB SPL of each tone.
+
+        Parameters
+        ----------
+        calib_array : np.ndarray
+            The array containing the frequency and amplitude values to be used. Every row (frequency) must use the same amplitude values.
+        duration : float
+            The duration of the sounds (s).
+        type : SweepType, optional
+            Indicates whether this function is being run in the calibration or in the test of a calibration. The test is performed with pure tones.
+        row_offset : int, optional
+            The offset added to the frequency indices sent to the interface, used when a grid is measured in several sweeps.
+
+        Returns
+        -------
+        calib_array : numpy.ndarray
+            The array containing the measured dB SPL values for each frequency and amplification values.
+        sounds : numpy.ndarray
+            The array containing the acquired signals for each frequency and amplification values.
+        """
+        if type != SweepType.CALIBRATION:
+            return super().sound_sweep(calib_array, duration, type, row_offset)
+
+        settings = self.settings.calibration
+        sounds = np.zeros((calib_array.shape[0], calib_array.shape[1]), dtype=Sound)
+        amp_array = calib_array[0, :, 1].copy()
+
+        # Generate a single multisine with every frequency of the grid
+        signal = Multisine(
+            duration,
+            self.soundcard.fs,
+            calib_array[:, 0, 0],
+            settings.frequency_resolution,
+            ramp_time=self.settings.ramp_time,
+            phase_method=settings.phase_method,
+        )
+        calib_array[:, :, 0] = signal.freqs[:, np.newaxis]
+
+        def rec_file(j: int):
+            return "calibration_multisine_rec_" + str(j) + ".npy"
+
+        # Upload the sound to the soundcard (unless every recording will be reused from an interrupted run)
+        columns = np.flatnonzero(~np.isnan(amp_array))
+        if not all(rec_file(j) in self.journal for j in columns):
+            key = self.stimulus_key(
+                "multisine",
+                duration=duration,
+                freqs=signal.freqs,
+                resolution=settings.frequency_resolution,
+                ramp_time=self.settings.ramp_time,
+                phase_method=settings.phase_method,
+            )
+            if isinstance(self.soundcard, HarpSoundCard):
+                filename = self.sound_file(
+                    key,
+                    signal,
+                    self.output_path / "sounds" / "calibration_multisine.bin",
+                )
+                self.soundcard.load_sound(filename, SOUND_INDICES[0])
+                self.soundcard.attenuation.precompute(amp_array)
+            elif isinstance(self.soundcard, ComputerSoundCard):
+                self.soundcard.load_sound(signal, SOUND_INDICES[0])
+
+        def acquire(j: int):
+            # Reuse the recording of an interrupted run
+            sound = self.load_recording(rec_file(j))
+            if sound is not None:
+                return j, sound
+
+            # Play the sound from the soundcard and record it with the microphone + DAQ system
+            sound = self.acquire_sound(duration, amp_array[j], SOUND_INDICES[0])
+            return j, sound
+
+        def save(item: tuple[int, RecordedSound]):
+            j, sound = item
+            if rec_file(j) not in self.journal:
+                self.save_recording(
+                    rec_file(j), sound, sweep="calibration", step=int(j)
+                )
+                # Commit the point to the journal as soon as its recording is saved, so that it is not measured again if the run is resumed
+                self.journal.commit(rec_file(j))
+            return item
+
+        def apply_filter(item: tuple[int, RecordedSound]):
+            if self.settings.filter.filter_acquisition:
+                self.filter_sound(item[1])
+            return item
+
+        def analyse(item: tuple[int, RecordedSound]):
+            # Calculate the intensity in dB SPL of every tone
+            j, sound = item
+            levels = sound.tone_levels(
+                signal.freqs, signal.resolution, self.settings.mic_factor
+            )
+            return j, sound, levels
+
+        def send(item: tuple[int, RecordedSound, np.ndarray]):
+            j, sound, levels = item
+            sounds[:, j] = sound
+            calib_array[:, j, 1] = amp_array[j] * signal.tone_amplitude
+            calib_array[:, j, 2] = levels
+
+            # Add the levels to the entry of the point (the levels of the recordings reused from an interrupted run are calculated again)
+            if "db_spl" not in self.journal.get(rec_file(j)):
+                self.journal.commit(rec_file(j), db_spl=levels.tolist())
+
+            # Send information regarding the current multisine to the interface, with the level of each tone
+            if self.callback is not None:
+                self.callback(
+                    "Multisine Calibration", row_offset, j, signal, sound, levels
+                )
+
+        # The acquisition is the only serial stage, the remaining ones overlap with the recordings
+        workers = self.settings.pipeline.workers
+        pipeline = Pipeline(
+            [
+                Stage("acquisition", acquire),
+                Stage("saving", save),
+                Stage("filtering", apply_filter, workers),
+                Stage("analysis", analyse, workers),
+            ],
+            self.settings.pipeline.queue_size,
+        )
+        pipeline.run(columns, send)
+        self.report_pipeline(pipeline)
+
+        return calib_array, sounds
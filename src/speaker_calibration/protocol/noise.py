@@ -2,13 +2,22 @@ from pathlib import Path
 from typing import Callable, Optional, cast
 
 import numpy as np
+from scipy import stats
 from scipy.signal import butter, firwin2, freqz_sos
 
-from speaker_calibration.config import NoiseProtocolSettings, Paths
-from speaker_calibration.protocol.utils import Protocol
+from speaker_calibration.calibration import CalibrationModel
+from speaker_calibration.config import EQFilter, NoiseProtocolSettings, Paths, Reuse
+from speaker_calibration.eq import design_eq
+from speaker_calibration.history import StoredResult
+from speaker_calibration.protocol.pipeline import Pipeline, Stage
+from speaker_calibration.protocol.utils import Protocol, settle_time
 from speaker_calibration.recording import RecordingDevice
-from speaker_calibration.sound import RecordedSound, WhiteNoise
-from speaker_calibration.soundcards import HarpSoundCard, SoundCard, create_sound_file
+from speaker_calibration.sound import RecordedSound, Sound, SteppedSound, WhiteNoise
+from speaker_calibration.soundcards import (
+    ComputerSoundCard,
+    HarpSoundCard,
+    SoundCard,
+)
 from speaker_calibration.utils import SweepType
 
 
@@ -21,15 +30,22 @@ class NoiseProtocol(Protocol):
         output_path: Path,
         paths: Paths,
         callback: Optional[Callable] = None,
+        previous: Optional[StoredResult] = None,
     ):
         super().__init__(settings, soundcard, adc, output_path, paths, callback)
 
-        # Calculate the EQ filter
-        if self.paths.eq_filter is None:
+        # Reuse the EQ filter and the calibration of a previous run if they are still valid
+        self.reuse_previous(previous)
+
+        # Calculate the EQ filter (unless it was calculated before the run was interrupted)
+        if self.paths.eq_filter is None and "eq_filter.npy" in self.journal:
+            self.eq_filter = np.load(self.output_path / "eq_filter.npy")
+        elif self.paths.eq_filter is None:
             self.eq_filter = self.calculate_eq_filter()
 
             # Save EQ filter
-            np.save(self.output_path / "eq_filter.npy", self.eq_filter)
+            self.save_result("eq_filter.npy", self.eq_filter)
+            self.journal.commit("eq_filter.npy")
 
             # Send EQ filter and signals to the interface
             if self.callback is not None:
@@ -37,6 +53,17 @@ class NoiseProtocol(Protocol):
         else:
             self.eq_filter = np.load(self.paths.eq_filter)
 
+        # Choose the implementation of the EQ filter used to generate the noises
+        self.eq_design = design_eq(
+            self.eq_filter,
+            self.soundcard.fs,
+            self.settings.eq_filter.design,
+            self.settings.eq_filter.max_error_db,
+            self.settings.min_freq,
+            self.settings.max_freq,
+        )
+        print(self.eq_design.report())
+
         # Perform the calibration
         if self.paths.eq_filter is None or self.paths.calibration is None:
             # Generate the amplitude values to be used in the calibration
@@ -50,24 +77,32 @@ class NoiseProtocol(Protocol):
             if self.callback is not None:
                 self.callback("Pre-calibration", log_amp)
 
-            # Generate and play the sounds for every amplitude value
-            self.sounds = self.sound_sweep(
-                log_amp, cast(float, self.settings.calibration.sound_duration)
+            # Generate and play the sounds for every amplitude value (or only for the ones needed to fit the calibration curve)
+            if self.settings.calibration.adaptive:
+                self.sounds = self.adaptive_sweep(
+                    log_amp, cast(float, self.settings.calibration.sound_duration)
+                )
+            else:
+                self.sounds = self.sound_sweep(
+                    log_amp, cast(float, self.settings.calibration.sound_duration)
+                )
+
+            measured = np.array(
+                [isinstance(sound, RecordedSound) for sound in self.sounds]
             )
-
-            db_spl = [sound.db_spl for sound in self.sounds]
+            db_spl = [sound.db_spl for sound in self.sounds[measured]]
 
             # Calculate the calibration parameters
-            self.calibration_parameters = np.polyfit(log_amp, db_spl, 1)
+            self.calibration_parameters = np.polyfit(log_amp[measured], db_spl, 1)
 
             # Save the calibration parameters
-            np.save(
-                self.output_path / "calibration_parameters.npy",
-                self.calibration_parameters,
-            )
+            self.save_result("calibration_parameters.npy", self.calibration_parameters)
         else:
             self.calibration_parameters = np.load(self.paths.calibration)
 
+        self.model = CalibrationModel.from_parameters(self.calibration_parameters)
+        self.model.save(self.output_path / "calibration_model.npz")
+
         # Test the calibration
         if self.settings.test is not None:
             # Generate the dB values to be used in the calibration test
@@ -81,10 +116,8 @@ class NoiseProtocol(Protocol):
             if self.callback is not None:
                 self.callback("Pre-test", db_test)
 
-            # Use the calibration parameters and the dB array to generate the correspondent amplitude values that will be used in the calibration test
-            att_test = (
-                db_test - self.calibration_parameters[1]
-            ) / self.calibration_parameters[0]
+            # Use the calibration curve and the dB array to generate the correspondent amplitude values (logarithmic) that will be used in the calibration test
+            att_test = np.log10(self.model.amplitude(db_test))
 
             # Test the calibration curve with the test amplitude factors
             self.test_sounds = self.sound_sweep(
@@ -93,22 +126,99 @@ class NoiseProtocol(Protocol):
                 type=SweepType.TEST,
             )
 
-    def calculate_eq_filter(self):
-        signal = WhiteNoise(
-            cast(float, self.settings.eq_filter.sound_duration),
+    def settle_time(self) -> float:
+        """
+        Estimates the duration of the transient at the beginning of the recordings, while the filters applied to the sounds settle (s): the EQ filter and the band-pass filters of the noise and of the acquisition.
+        """
+        settle = super().settle_time() + settle_time(
+            self.eq_design.fs, self.eq_design.sos, self.eq_design.taps
+        )
+        if self.settings.filter.filter_input:
+            sos = butter(
+                64,
+                [self.settings.filter.min_freq, self.settings.filter.max_freq],
+                btype="bandpass",
+                output="sos",
+                fs=self.soundcard.fs,
+            )
+            settle += settle_time(self.soundcard.fs, sos=sos)
+        return settle
+
+    def verify(self, previous: StoredResult) -> np.ndarray:
+        """
+        Plays the noise filtered with the EQ filter of a previous run with a few amplitudes and compares their levels with the ones predicted by its calibration.
+
+        Parameters
+        ----------
+        previous : StoredResult
+            The result of the previous run.
+
+        Returns
+        -------
+        errors : numpy.ndarray
+            The differences between the measured and the predicted levels (dB).
+        """
+        reuse = cast(Reuse, self.settings.reuse)
+        self.eq_design = design_eq(
+            np.load(cast(str, previous.eq_filter)),
             self.soundcard.fs,
-            self.settings.eq_filter.amplitude,
-            self.settings.ramp_time,
-            filter=True,
-            freq_min=self.settings.min_freq,
-            freq_max=self.settings.max_freq,
+            self.settings.eq_filter.design,
+            self.settings.eq_filter.max_error_db,
+            self.settings.min_freq,
+            self.settings.max_freq,
+        )
+        model = CalibrationModel.from_parameters(np.load(previous.calibration))
+
+        # The amplitudes are spread across the range of the calibration
+        log_amp = np.linspace(
+            self.settings.calibration.min_amp,
+            self.settings.calibration.max_amp,
+            reuse.points,
+        )
+        sounds = self.sound_sweep(
+            log_amp, reuse.sound_duration, type=SweepType.VERIFICATION
+        )
+        db_spl = np.array([sound.db_spl for sound in sounds])
+
+        return db_spl - model.db_spl(10**log_amp)
+
+    def calculate_eq_filter(self):
+        # The noise can only be reused from the stimulus cache if it is reproducible
+        key = None
+        if self.settings.seed is not None:
+            key = self.stimulus_key(
+                "white_noise",
+                seed=self.settings.seed,
+                duration=self.settings.eq_filter.sound_duration,
+                amplitude=self.settings.eq_filter.amplitude,
+                ramp_time=self.settings.ramp_time,
+                filter=True,
+                freq_min=self.settings.min_freq,
+                freq_max=self.settings.max_freq,
+                noise_type="gaussian",
+            )
+        signal = self.render(
+            key,
+            lambda: WhiteNoise(
+                cast(float, self.settings.eq_filter.sound_duration),
+                self.soundcard.fs,
+                self.settings.eq_filter.amplitude,
+                self.settings.ramp_time,
+                filter=True,
+                freq_min=self.settings.min_freq,
+                freq_max=self.settings.max_freq,
+                seed=self.settings.seed,
+            ),
         )
 
         # Upload the sound to the Harp SoundCard in case one is used
         if isinstance(self.soundcard, HarpSoundCard):
-            sound_path = self.output_path / "sounds" / "eq_filter_sound.bin"
-            create_sound_file(signal, sound_path)
+            sound_path = self.sound_file(
+                key, signal, self.output_path / "sounds" / "eq_filter_sound.bin"
+            )
             self.soundcard.load_sound(filename=sound_path)
+        elif isinstance(self.soundcard, ComputerSoundCard):
+            self.soundcard.load_sound(signal)
 
         # Play the sound from the soundcard and record it with the microphone + DAQ system
         rec_path = self.output_path / "sounds" / "eq_filter_rec.npy"
@@ -116,112 +226,494 @@ class NoiseProtocol(Protocol):
             rec_path, cast(float, self.settings.eq_filter.sound_duration)
         )
 
-        resampled_sound = RecordedSound.resample(recorded_sound, self.soundcard.fs)
+        return eq_filter_from_recording(
+            recorded_sound,
+            self.soundcard.fs,
+            self.settings.eq_filter,
+            self.settings.min_freq,
+            self.settings.max_freq,
+        )
 
-        freq, fft = resampled_sound.fft_welch(self.settings.eq_filter.time_constant)
-        transfer_function = 1 / (fft + 1e-10)
+    def sound_sweep(
+        self,
+        amp_array: np.ndarray,
+        duration: float,
+        type: SweepType = SweepType.CALIBRATION,
+    ):
+        """
+        Plays sounds with different amplitudes and calculates the correspondent intensities in dB SPL.
 
-        mean_gain = np.mean(
-            transfer_function[
-                (freq >= self.settings.min_freq) & (freq <= self.settings.max_freq)
-            ]
+        Parameters
+        ----------
+        amp_array : np.ndarray
+            The array containing the amplitude levels to be used in the different sounds.
+        duration : float
+            The duration of the sounds (s).
+        type : SweepType, optional
+            Indicates whether this function is being run in the calibration or in the test of a calibration
+
+        Returns
+        -------
+        sounds : numpy.ndarray
+            The array containing the acquired signals for each amplification value.
+        """
+        # Play every amplitude in a single staircase if desired
+        if self.settings.staircase is not None:
+            return self.staircase_sweep(amp_array, duration, type)
+
+        # Initialization of the output arrays
+        sounds = np.zeros(amp_array.size, dtype=RecordedSound)
+
+        self.upload_noise(amp_array, duration, type)
+        self.measure_points(
+            amp_array, np.arange(amp_array.size), sounds, duration, type
         )
 
-        transfer_function /= mean_gain
+        return sounds
 
-        min_boost_linear = 10 ** (self.settings.eq_filter.min_boost_db / 20)
-        max_boost_linear = 10 ** (self.settings.eq_filter.max_boost_db / 20)
+    def adaptive_sweep(self, amp_array: np.ndarray, duration: float):
+        """
+        Plays sounds with only some of the amplitudes, the ones needed to fit the calibration curve within the tolerance.
 
-        transfer_function[transfer_function < min_boost_linear] = min_boost_linear
-        transfer_function[transfer_function > max_boost_linear] = max_boost_linear
+        A few anchor amplitudes are measured first. Afterwards, one amplitude is added at a time, close to the point with the largest residual or where the confidence interval of the fit is the widest, until the fit converges.
 
-        sos = butter(
-            32,
-            [self.settings.min_freq, self.settings.max_freq],
-            btype="bandpass",
-            output="sos",
-            fs=self.soundcard.fs,
-        )
+        Parameters
+        ----------
+        amp_array : np.ndarray
+            The array containing the candidate amplitude levels (logarithmic).
+        duration : float
+            The duration of the sounds (s).
 
-        w, h = freqz_sos(sos, fs=self.soundcard.fs)
-        new_h = np.interp(freq, w, np.abs(h))
-        response = np.multiply(transfer_function, abs(new_h))
-        final_filter = firwin2(4097, freq, response, fs=self.soundcard.fs)
+        Returns
+        -------
+        sounds : numpy.ndarray
+            The array containing the acquired signals for each amplification value. The amplitudes that were not measured are left as 0.
+        """
+        settings = self.settings.calibration
+        sounds = np.zeros(amp_array.size, dtype=RecordedSound)
+        measured = np.zeros(amp_array.size, dtype=bool)
+
+        self.upload_noise(amp_array, duration, SweepType.CALIBRATION)
+
+        # Measure the anchor points, evenly spread across the amplitude range
+        anchors = np.unique(
+            np.round(np.linspace(0, amp_array.size - 1, settings.anchor_points))
+        ).astype(int)
+        self.measure_points(amp_array, anchors, sounds, duration)
+        measured[anchors] = True
+
+        previous_fit = None
+        while not measured.all():
+            x = amp_array[measured]
+            y = np.array([sound.db_spl for sound in sounds[measured]])
+            fit, residuals, half_width = _linear_fit(
+                x, y, amp_array, settings.confidence
+            )
 
-        return final_filter
+            # Stop once the fit is within the tolerance and the parameters no longer change
+            converged = (
+                previous_fit is not None
+                and np.max(np.abs(residuals)) <= settings.tolerance_db
+                and np.max(half_width) <= settings.tolerance_db
+                and np.max(
+                    np.abs(
+                        np.polyval(fit, amp_array) - np.polyval(previous_fit, amp_array)
+                    )
+                )
+                <= settings.tolerance_db / 2
+            )
+            if converged:
+                break
+            previous_fit = fit
+
+            # Choose the next amplitude, either next to the worst fitted point or where the fit is the least certain
+            candidates = np.flatnonzero(~measured)
+            if np.max(np.abs(residuals)) > settings.tolerance_db:
+                worst = x[np.argmax(np.abs(residuals))]
+                next_point = candidates[
+                    np.argmin(np.abs(amp_array[candidates] - worst))
+                ]
+            else:
+                next_point = candidates[np.argmax(half_width[candidates])]
+
+            self.measure_points(amp_array, np.array([next_point]), sounds, duration)
+            measured[next_point] = True
+
+        print(
+            f"Adaptive calibration: {measured.sum()} of {amp_array.size} amplitudes measured"
+        )
 
-    def sound_sweep(
+        return sounds
+
+    def staircase_sweep(
         self,
         amp_array: np.ndarray,
         duration: float,
         type: SweepType = SweepType.CALIBRATION,
     ):
         """
-        Plays sounds with different amplitudes and calculates the correspondent intensities in dB SPL.
+        Plays every amplitude of a sweep in a single staircase and calculates the correspondent intensities in dB SPL from a single recording.
 
         Parameters
         ----------
         amp_array : np.ndarray
-            The array containing the amplitude levels to be used in the different sounds.
+            The array containing the amplitude levels to be used in the different steps (logarithmic).
         duration : float
-            The duration of the sounds (s).
+            The duration of each step (s).
         type : SweepType, optional
             Indicates whether this function is being run in the calibration or in the test of a calibration
 
         Returns
         -------
-        db_spl : numpy.ndarray
-            The array containing the measured dB SPL values for each amplification value.
         sounds : numpy.ndarray
-            The array containing both the original and acquired signals for each amplification value.
+            The array containing the acquired signal of each step.
         """
-        # Initialization of the output arrays
+        match type:
+            case SweepType.CALIBRATION:
+                prefix = "calibration"
+                code = "Noise Calibration"
+            case SweepType.TEST:
+                prefix = "test"
+                code = "Noise Test"
+            case SweepType.VERIFICATION:
+                prefix = "verification"
+                code = "Noise Verification"
+
+        # The amplitudes are applied to the signal itself, so the ones above full scale are clipped as the attenuation of the Harp SoundCard would be
+        amplitudes = np.minimum(10**amp_array, 1)
+        signal = SteppedSound(
+            self.generate_noise(duration),
+            amplitudes,
+            self.settings.staircase.gap_duration,
+        )
+        noise_key = self.noise_key(duration)
+        key = None
+        if noise_key is not None:
+            key = self.stimulus_key(
+                "staircase",
+                sound=noise_key,
+                amplitudes=amplitudes,
+                gap_duration=self.settings.staircase.gap_duration,
+            )
+
+        # Reuse the recording of an interrupted run
+        rec_file = prefix + "_staircase.npy"
+        recording = self.load_recording(rec_file)
+        if recording is None:
+            # Upload the sound to the Harp SoundCard in case one is used
+            if isinstance(self.soundcard, HarpSoundCard):
+                filename = self.sound_file(
+                    key,
+                    signal,
+                    self.output_path / "sounds" / (prefix + "_staircase.bin"),
+                )
+                self.soundcard.load_sound(filename)
+            elif isinstance(self.soundcard, ComputerSoundCard):
+                self.soundcard.load_sound(signal)
+
+            # Play the whole staircase and record it with the microphone + DAQ system
+            recording = self.acquire_sound(signal.duration)
+            self.save_recording(rec_file, recording, sweep=prefix, staircase=True)
+            self.journal.commit(rec_file)
+
+        if self.settings.filter.filter_acquisition:
+            self.filter_sound(recording)
+
+        # Calculate the intensity in dB SPL of every step and split the recording into the steps
+        levels = recording.step_levels(signal.boundaries, self.settings.mic_factor)
         sounds = np.zeros(amp_array.size, dtype=RecordedSound)
 
-        # Generate the noise
-        signal = WhiteNoise(
-            duration,
-            self.soundcard.fs,
-            1,  # FIXME
-            self.settings.ramp_time,
-            self.settings.filter.filter_input,
-            cast(float, self.settings.filter.min_freq),
-            cast(float, self.settings.filter.max_freq),
-            self.eq_filter,
-            noise_type="gaussian",  # FIXME
+        # Add the levels of the steps to the entry of the staircase (the levels of a recording reused from an interrupted run are calculated again)
+        if "db_spl" not in self.journal.get(rec_file):
+            self.journal.commit(rec_file, db_spl=levels.tolist())
+        sounds[:] = recording.split(signal.boundaries)
+
+        # Send information regarding every step to the interface
+        if self.callback is not None:
+            for i, sound in enumerate(sounds):
+                self.callback(code, i, sound)
+
+        print(
+            f"Staircase: {amp_array.size} amplitudes measured in a single {signal.duration:.1f} s recording, "
+            f"levels from {np.min(levels):.1f} to {np.max(levels):.1f} dB SPL"
+        )
+
+        return sounds
+
+    def generate_noise(self, duration: float) -> Sound:
+        """
+        Generates the noise used in the calibration sweeps, or loads it from the stimulus cache.
+
+        Parameters
+        ----------
+        duration : float
+            The duration of the sound (s).
+
+        Returns
+        -------
+        signal : Sound
+            The generated noise, at full scale.
+        """
+        return self.render(
+            self.noise_key(duration),
+            lambda: WhiteNoise(
+                duration,
+                self.soundcard.fs,
+                1,  # FIXME
+                self.settings.ramp_time,
+                self.settings.filter.filter_input,
+                cast(float, self.settings.filter.min_freq),
+                cast(float, self.settings.filter.max_freq),
+                self.eq_design,
+                noise_type="gaussian",  # FIXME
+                seed=self.settings.seed,
+            ),
         )
 
+    def noise_key(self, duration: float) -> Optional[str]:
+        """
+        Calculates the key of the noise used in the calibration sweeps in the stimulus cache.
+
+        Parameters
+        ----------
+        duration : float
+            The duration of the sound (s).
+
+        Returns
+        -------
+        key : str, optional
+            The key of the noise, or None if there is no cache or the noise is not reproducible (i.e. there is no seed).
+        """
+        if self.settings.seed is None:
+            return None
+
+        return self.stimulus_key(
+            "white_noise",
+            eq_filter=self.eq_design,
+            seed=self.settings.seed,
+            duration=duration,
+            amplitude=1,
+            ramp_time=self.settings.ramp_time,
+            filter=self.settings.filter.filter_input,
+            freq_min=self.settings.filter.min_freq,
+            freq_max=self.settings.filter.max_freq,
+            noise_type="gaussian",
+        )
+
+    def upload_noise(
+        self,
+        amp_array: np.ndarray,
+        duration: float,
+        type: SweepType = SweepType.CALIBRATION,
+    ):
+        """
+        Generates the noise used in a sweep and uploads it to the soundcard.
+
+        Parameters
+        ----------
+        amp_array : np.ndarray
+            The array containing the amplitude levels that will be used in the sweep.
+        duration : float
+            The duration of the sound (s).
+        type : SweepType, optional
+            Indicates whether this function is being run in the calibration or in the test of a calibration
+        """
+        # Generate the noise
+        key = self.noise_key(duration)
+        signal = self.generate_noise(duration)
+
         # Save the generated noise
         match type:
             case SweepType.CALIBRATION:
                 filename = self.output_path / "sounds" / "calibration_sound.bin"
-                rec_file = "calibration"
-                code = "Noise Calibration"
             case SweepType.TEST:
                 filename = self.output_path / "sounds" / "test_sound.bin"
-                rec_file = "test"
-                code = "Noise Test"
+            case SweepType.VERIFICATION:
+                filename = self.output_path / "sounds" / "verification_sound.bin"
 
         # Upload the sound to the Harp SoundCard in case one is used
         if isinstance(self.soundcard, HarpSoundCard):
-            create_sound_file(signal, filename)
+            filename = self.sound_file(key, signal, filename)
             self.soundcard.load_sound(filename)
+            self.soundcard.attenuation.precompute(10**amp_array)
+        elif isinstance(self.soundcard, ComputerSoundCard):
+            self.soundcard.load_sound(signal)
+
+    def measure_points(
+        self,
+        amp_array: np.ndarray,
+        indices: np.ndarray,
+        sounds: np.ndarray,
+        duration: float,
+        type: SweepType = SweepType.CALIBRATION,
+    ):
+        """
+        Plays the uploaded noise with some of the amplitudes of a sweep and calculates the correspondent intensities in dB SPL.
+
+        Parameters
+        ----------
+        amp_array : np.ndarray
+            The array containing the amplitude levels of the sweep.
+        indices : np.ndarray
+            The indices of the amplitude levels to be played.
+        sounds : np.ndarray
+            The array to which the acquired signals are written, at the same indices as the amplitude levels.
+        duration : float
+            The duration of the sounds (s).
+        type : SweepType, optional
+            Indicates whether this function is being run in the calibration or in the test of a calibration
+        """
+        match type:
+            case SweepType.CALIBRATION:
+                rec_file = "calibration"
+                code = "Noise Calibration"
+            case SweepType.TEST:
+                rec_file = "test"
+                code = "Noise Test"
+            case SweepType.VERIFICATION:
+                rec_file = "verification"
+                code = "Noise Verification"
+
+        def acquire(i: int):
+            # Reuse the recording of an interrupted run
+            sound = self.load_recording(rec_file + "_" + str(i) + ".npy")
+            if sound is not None:
+                return i, sound
 
-        for i in range(amp_array.size):
             # Play the sound from the soundcard and record it with the microphone + DAQ system
-            rec_path = self.output_path / "sounds" / (rec_file + "_" + str(i) + ".npy")
-            sounds[i] = self.record_sound(
-                rec_path,
-                duration,
-                10 ** (amp_array[i]),
-                self.settings.filter.filter_acquisition,
+            return i, self.acquire_sound(
+                duration, 10 ** (amp_array[i]), early_stop=True
             )
 
+        def save(item: tuple[int, RecordedSound]):
+            i, sound = item
+            filename = rec_file + "_" + str(i) + ".npy"
+            if filename not in self.journal:
+                self.save_recording(
+                    filename,
+                    sound,
+                    sweep=rec_file,
+                    index=int(i),
+                    log_amp=float(amp_array[i]),
+                )
+                # Commit the point to the journal as soon as its recording is saved, so that it is not measured again if the run is resumed
+                self.journal.commit(filename)
+            return item
+
+        def apply_filter(item: tuple[int, RecordedSound]):
+            if self.settings.filter.filter_acquisition:
+                self.filter_sound(item[1])
+            return item
+
+        def analyse(item: tuple[int, RecordedSound]):
             # Calculate the intensity in dB SPL
-            sounds[i].calculate_db_spl(self.settings.mic_factor)
+            item[1].calculate_db_spl(self.settings.mic_factor)
+            return item
+
+        def send(item: tuple[int, RecordedSound]):
+            i, sound = item
+            sounds[i] = sound
+
+            # Add the level to the entry of the point (the levels of the recordings reused from an interrupted run are calculated again)
+            filename = rec_file + "_" + str(i) + ".npy"
+            if "db_spl" not in self.journal.get(filename):
+                self.journal.commit(filename, db_spl=float(sound.db_spl))
 
             # Send information regarding the current noise to the interface
             if self.callback is not None:
-                self.callback(code, i, sounds[i])
-
-        return sounds
+                self.callback(code, i, sound)
+
+        # The acquisition is the only serial stage, the remaining ones overlap with the next recordings
+        workers = self.settings.pipeline.workers
+        pipeline = Pipeline(
+            [
+                Stage("acquisition", acquire),
+                Stage("saving", save),
+                Stage("filtering", apply_filter, workers),
+                Stage("analysis", analyse, workers),
+            ],
+            self.settings.pipeline.queue_size,
+        )
+        pipeline.run(indices, send)
+        self.report_pipeline(pipeline)
+
+
+def eq_filter_from_recording(
+    recorded_sound: RecordedSound,
+    fs: float,
+    settings: EQFilter,
+    min_freq: float,
+    max_freq: float,
+) -> np.ndarray:
+    """
+    Calculates the EQ filter from the recording of a white noise played without it.
+
+    Parameters
+    ----------
+    recorded_sound : RecordedSound
+        The recorded noise.
+    fs : float
+        The sampling frequency of the soundcard (Hz), to which the recording is resampled.
+    settings : EQFilter
+        The EQ filter settings.
+    min_freq : float
+        The minimum frequency of the noise spectrum (Hz).
+    max_freq : float
+        The maximum frequency of the noise spectrum (Hz).
+
+    Returns
+    -------
+    eq_filter : numpy.ndarray
+        The coefficients of the EQ filter.
+    """
+    resampled_sound = RecordedSound.resample(recorded_sound, fs)
+
+    freq, fft = resampled_sound.fft_welch(settings.time_constant)
+    transfer_function = 1 / (fft + 1e-10)
+
+    mean_gain = np.mean(transfer_function[(freq >= min_freq) & (freq <= max_freq)])
+
+    transfer_function /= mean_gain
+
+    min_boost_linear = 10 ** (settings.min_boost_db / 20)
+    max_boost_linear = 10 ** (settings.max_boost_db / 20)
+
+    transfer_function[transfer_function < min_boost_linear] = min_boost_linear
+    transfer_function[transfer_function > max_boost_linear] = max_boost_linear
+
+    sos = butter(
+        32,
+        [min_freq, max_freq],
+        btype="bandpass",
+        output="sos",
+        fs=fs,
+    )
+
+    w, h = freqz_sos(sos, fs=fs)
+    new_h = np.interp(freq, w, np.abs(h))
+    response = np.multiply(transfer_function, abs(new_h))
+    final_filter = firwin2(4097, freq, response, fs=fs)
+
+    return final_filter
+
+
+def _linear_fit(x: np.ndarray, y: np.ndarray, x_eval: np.ndarray, confidence: float):
+    """
+    Fits a line to the points and calculates the half-width of the confidence interval of the fitted line.
+
+    Returns the fit parameters, the residuals of the points and the half-width of the confidence interval at `x_eval`.
+    """
+    fit = np.polyfit(x, y, 1)
+    residuals = y - np.polyval(fit, x)
+
+    # The confidence interval can only be estimated with more points than parameters
+    dof = x.size - 2
+    if dof < 1:
+        return fit, residuals, np.full(x_eval.size, np.inf)
+
+    design = np.stack((x, np.ones(x.size)), axis=1)
+    covariance = np.sum(residuals**2) / dof * np.linalg.inv(design.T @ design)
+    design_eval = np.stack((x_eval, np.ones(x_eval.size)), axis=1)
+    std = np.sqrt(np.einsum("ij,jk,ik->i", design_eval, covariance, design_eval))
+
+    return fit, residuals, stats.t.ppf((1 + confidence) / 2, dof) * std
@@ -0,0 +1,245 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional
+
+# Marks the end of the items flowing through a queue
+_END = object()
+
+
+class Stage:
+    """
+    The class representing a step of a pipeline.
+
+    Attributes
+    ----------
+    name : str
+        The name of the stage, used in the utilisation report.
+    function : Callable
+        The function applied to each item. Its return value is passed on to the next stage.
+    workers : int
+        The number of threads running the stage. A stage with a single worker processes the items serially and in order.
+    fan_out : bool
+        Indicates whether `function` returns an iterable, whose items are passed on to the next stage one by one as they are produced.
+    busy_time : float
+        The total time the workers of the stage spent processing items (s).
+    """
+
+    name: str
+    function: Callable
+    workers: int
+    fan_out: bool
+    busy_time: float
+
+    def __init__(
+        self,
+        name: str,
+        function: Callable,
+        workers: int = 1,
+        fan_out: bool = False,
+    ):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.fan_out = fan_out
+        self.busy_time = 0
+        self._lock = threading.Lock()
+        self._running = 0
+
+    def _add_busy_time(self, value: float):
+        with self._lock:
+            self.busy_time += value
+
+    def _finish_worker(self) -> bool:
+        # Returns True for the last worker of the stage to finish
+        with self._lock:
+            self._running -= 1
+            return self._running == 0
+
+
+class Pipeline:
+    """
+    Runs items through a sequence of stages, each one in its own worker threads and connected to the next one by a bounded queue.
+
+    The serial resources of a protocol (e.g. the acquisition) should be stages with a single worker, so that the remaining stages overlap with them.
+
+    Attributes
+    ----------
+    stages : list[Stage]
+        The stages of the pipeline, in the order they are applied.
+    queue_size : int
+        The maximum number of items waiting between two consecutive stages.
+    wall_time : float
+        The duration of the last run of the pipeline (s).
+    """
+
+    stages: list[Stage]
+    queue_size: int
+    wall_time: float
+
+    def __init__(self, stages: list[Stage], queue_size: int = 2):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.wall_time = 0
+        self.aborted = threading.Event()
+        self._error = None
+
+    def run(
+        self, items: Iterable, on_result: Optional[Callable[[Any], None]] = None
+    ) -> list:
+        """
+        Runs the items through the pipeline.
+
+        Parameters
+        ----------
+        items : Iterable
+            The items to be processed.
+        on_result : Callable, optional
+            A function called, from the calling thread, with each item that leaves the last stage.
+
+        Returns
+        -------
+        results : list
+            The items that left the last stage, in the order they finished.
+        """
+        self.aborted.clear()
+        self._error = None
+        for stage in self.stages:
+            stage.busy_time = 0
+            stage._running = stage.workers
+
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [
+            threading.Thread(
+                target=self._feed, args=[items, queues[0], self.stages[0].workers]
+            )
+        ]
+        for i, stage in enumerate(self.stages):
+            next_workers = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            for _ in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._work,
+                        args=[stage, queues[i], queues[i + 1], next_workers],
+                    )
+                )
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        # Collect the results in the calling thread
+        results = []
+        while True:
+            item = self._get(queues[-1])
+            if item is _END or self.aborted.is_set():
+                break
+            results.append(item)
+            if on_result is not None:
+                # Any error of the callback aborts the pipeline and is raised again by `run`, once the workers have stopped
+                try:
+                    on_result(item)
+                except Exception as e:  # noqa: BLE001
+                    self._abort(e)
+                    break
+
+        for thread in threads:
+            thread.join()
+        self.wall_time = time.perf_counter() - start
+
+        if self._error is not None:
+            raise self._error
+
+        return results
+
+    def utilisation(self) -> dict[str, float]:
+        """
+        Returns the fraction of the last run during which the workers of each stage were busy.
+
+        Returns
+        -------
+        utilisation : dict[str, float]
+            The utilisation of each stage, between 0 and 1.
+        """
+        if self.wall_time == 0:
+            return {stage.name: 0 for stage in self.stages}
+
+        return {
+            stage.name: stage.busy_time / (self.wall_time * stage.workers)
+            for stage in self.stages
+        }
+
+    def report(self) -> str:
+        """
+        Returns a one-line summary of the utilisation of the stages in the last run.
+        """
+        stages = ", ".join(
+            f"{name} {100 * value:.0f}%" for name, value in self.utilisation().items()
+        )
+        return f"Pipeline utilisation ({self.wall_time:.1f} s): {stages}"
+
+    def _feed(self, items: Iterable, output: queue.Queue, workers: int):
+        # Any error of the items iterator (e.g. a generator) aborts the pipeline and is raised again by `run`
+        try:
+            for item in items:
+                if not self._put(output, item):
+                    return
+        except Exception as e:  # noqa: BLE001
+            self._abort(e)
+            return
+
+        for _ in range(workers):
+            self._put(output, _END)
+
+    def _work(
+        self, stage: Stage, input: queue.Queue, output: queue.Queue, next_workers: int
+    ):
+        # The stages run arbitrary functions (drivers, I/O, analysis), so any error aborts the pipeline and is raised again by `run` instead of killing the worker silently
+        try:
+            while not self.aborted.is_set():
+                item = self._get(input)
+                if item is _END:
+                    break
+
+                start = time.perf_counter()
+                results = stage.function(item)
+                if not stage.fan_out:
+                    results = (results,)
+
+                # Busy time only counts the processing, not the time waiting for space in the next queue
+                for result in results:
+                    stage._add_busy_time(time.perf_counter() - start)
+                    if not self._put(output, result):
+                        return
+                    start = time.perf_counter()
+                stage._add_busy_time(time.perf_counter() - start)
+        except Exception as e:  # noqa: BLE001
+            self._abort(e)
+            return
+
+        # The last worker of the stage signals the end to every worker of the next one
+        if stage._finish_worker():
+            for _ in range(next_workers):
+                self._put(output, _END)
+
+    def _put(self, output: queue.Queue, item) -> bool:
+        while not self.aborted.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, input: queue.Queue):
+        while not self.aborted.is_set():
+            try:
+                return input.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _abort(self, error: Exception):
+        if self._error is None:
+            self._error = error
+        self.aborted.set()
@@ -1,16 +1,27 @@
+import queue
+from itertools import pairwise
 from pathlib import Path
-from typing import Callable, Optional
+from typing import Callable, Optional, cast
 
 import numpy as np
-from scipy.interpolate import RBFInterpolator, griddata
 
-from speaker_calibration.config import Paths, PureToneProtocolSettings
+from speaker_calibration.calibration import CalibrationModel
+from speaker_calibration.config import Paths, PureToneProtocolSettings, Reuse
+from speaker_calibration.history import StoredResult
+from speaker_calibration.protocol.pipeline import Pipeline, Stage
 from speaker_calibration.protocol.utils import Protocol
 from speaker_calibration.recording import RecordingDevice
-from speaker_calibration.sound import PureTone, Sound
-from speaker_calibration.soundcards import HarpSoundCard, SoundCard, create_sound_file
+from speaker_calibration.sound import PureTone, RecordedSound, Sound, SteppedSound
+from speaker_calibration.soundcards import (
+    ComputerSoundCard,
+    HarpSoundCard,
+    SoundCard,
+)
 from speaker_calibration.utils import SweepType
 
+# The soundcard indices used to store the pure tones. A 192 kHz sound may take two consecutive indices of the Harp SoundCard
+SOUND_INDICES = (2, 4)
+
 
 class PureToneProtocol(Protocol):
     def __init__(
@@ -21,12 +32,16 @@ class PureToneProtocol(Protocol):
         output_path: Path,
         paths: Paths,
         callback: Optional[Callable] = None,
+        previous: Optional[StoredResult] = None,
     ):
         super().__init__(settings, soundcard, adc, output_path, paths, callback)
 
         """
         Performs the pure tone speaker calibration.
         """
+        # Reuse the calibration of a previous run if it is still valid
+        self.reuse_previous(previous)
+
         # Perform the calibration
         if self.paths.calibration is None:
             # Generate the array of frequencies to be used in the calibration
@@ -53,20 +68,26 @@ class PureToneProtocol(Protocol):
             if self.callback is not None:
                 self.callback("Pre-calibration", calib_array[:, :, 0:2])
 
-            # Generate and play the sounds for every frequency and amplitude values
-            calib_array, _ = self.sound_sweep(
-                calib_array,
-                self.settings.calibration.sound_duration,
-            )
+            # Generate and play the sounds for every frequency and amplitude values (or only for the frequencies needed to describe the speaker response)
+            if self.settings.calibration.adaptive:
+                calib_array = self.adaptive_sweep(
+                    amp[0], self.settings.calibration.sound_duration
+                )
+            else:
+                calib_array, _ = self.sound_sweep(
+                    calib_array,
+                    self.settings.calibration.sound_duration,
+                )
 
             # Convert calibration array to 2D array and save it as a CSV file
             calib = calib_array.reshape(calib_array.shape[0] * calib_array.shape[1], 3)
-            np.save(self.output_path / "calibration.npy", calib)
-
-            amp = amp.reshape(-1)
+            self.save_result("calibration.npy", calib)
         else:
             calib = np.load(self.paths.calibration)
-            amp = calib[:, 1]
+
+        # Fit the calibration curve of every frequency
+        self.model = CalibrationModel.from_pure_tones(calib)
+        self.model.save(self.output_path / "calibration_model.npz")
 
         # Test the calibration
         if self.settings.test is not None:
@@ -86,30 +107,23 @@ class PureToneProtocol(Protocol):
 
             test_freq, test_db = np.meshgrid(test_freq, test_db, indexing="ij")
 
-            # Generate the x arrays for the calibration and test to be used in the interpolation
-            x_calib = np.stack((freq, db), axis=2).reshape(
-                freq.shape[0] * freq.shape[1], 2
-            )
             x_test = np.stack((test_freq, test_db), axis=2).reshape(
                 test_freq.shape[0] * test_freq.shape[1], 2
             )
 
-            # Perform the interpolation
-            # TODO: check whether it's best to use RBFInterpolator
-            y = griddata(x_calib, amp, x_test, method="linear")
+            # Use the calibration curves to calculate the amplitudes of the test sounds
+            y = self.model.amplitude(test_db, test_freq)
 
             # Send the test frequency and dB information to the interface
             if self.callback is not None:
                 self.callback("Pre-test", x_test)
 
             # Generate the test array with the frequencies and amplitudes to be used
-            test_array = np.stack(
-                (test_freq, y.reshape(freq.shape[0], freq.shape[1]), test_db), axis=2
-            )
+            test_array = np.stack((test_freq, y, test_db), axis=2)
 
             # Generate and play the sounds for every frequency and amplitude values
             test_array2, _ = self.sound_sweep(
-                test_array,
+                test_array.copy(),
                 self.settings.test.sound_duration,
                 SweepType.TEST,
             )
@@ -126,17 +140,125 @@ class PureToneProtocol(Protocol):
             )
 
             # Save the calibration test results
-            np.save(self.output_path / "test.npy", test)
+            self.save_result("test.npy", test)
+
+    def adaptive_sweep(self, amp_array: np.ndarray, duration: float) -> np.ndarray:
+        """
+        Plays the pure tones of an adaptive frequency grid, which starts coarse and is refined where the speaker response is not smooth.
+
+        Every interval between measured frequencies whose midpoint deviates from the linear interpolation of its ends by more than the tolerance is bisected again, until the maximum number of frequencies is reached or the intervals become narrower than the minimum spacing.
+
+        Parameters
+        ----------
+        amp_array : np.ndarray
+            The array containing the amplitude values to be used for every frequency.
+        duration : float
+            The duration of the sounds (s).
+
+        Returns
+        -------
+        calib_array : numpy.ndarray
+            The array containing the measured dB SPL values for each frequency and amplification values, sorted by frequency.
+        """
+        settings = self.settings.calibration
+        rows = {}
+
+        def measure(freqs: np.ndarray):
+            freq, amp = np.meshgrid(freqs, amp_array, indexing="ij")
+            calib_array = np.stack((freq, amp, np.zeros(freq.shape)), axis=2)
+            calib_array, _ = self.sound_sweep(
+                calib_array, duration, row_offset=len(rows)
+            )
+            for i, f in enumerate(freqs):
+                rows[f] = calib_array[i]
+
+        # Start with a coarse grid
+        freqs = np.linspace(
+            settings.min_freq,
+            settings.max_freq,
+            min(settings.initial_freq_steps, settings.freq_steps),
+        )
+        measure(freqs)
+        intervals = list(pairwise(freqs))
+
+        while intervals and len(rows) < settings.freq_steps:
+            # Bisect the intervals that are still wide enough, as long as there are frequency steps left
+            intervals = [
+                (low, high)
+                for low, high in intervals
+                if (high - low) / 2 >= settings.min_freq_spacing
+            ][: settings.freq_steps - len(rows)]
+            if not intervals:
+                break
+
+            midpoints = np.array([(low + high) / 2 for low, high in intervals])
+            measure(midpoints)
+
+            # Keep refining the intervals in which the response deviates from the interpolation
+            refined = []
+            for (low, high), mid in zip(intervals, midpoints):
+                expected = (rows[low][:, 2] + rows[high][:, 2]) / 2
+                deviation = np.nanmax(np.abs(rows[mid][:, 2] - expected))
+                if deviation > settings.tolerance_db:
+                    refined += [(deviation, low, mid), (deviation, mid, high)]
+
+            # The intervals with the largest deviations come first, so they are the ones refined if there are not enough frequency steps left for all of them
+            refined.sort(key=lambda interval: interval[0], reverse=True)
+            intervals = [(low, high) for _, low, high in refined]
+
+        print(
+            f"Adaptive calibration: {len(rows)} of {settings.freq_steps} frequencies measured"
+        )
+
+        return np.stack([rows[f] for f in sorted(rows)])
+
+    def verify(self, previous: StoredResult) -> np.ndarray:
+        """
+        Plays pure tones with a few frequencies, at the middle of the amplitude range, and compares their levels with the ones predicted by the calibration of a previous run.
+
+        Parameters
+        ----------
+        previous : StoredResult
+            The result of the previous run.
+
+        Returns
+        -------
+        errors : numpy.ndarray
+            The differences between the measured and the predicted levels (dB).
+        """
+        reuse = cast(Reuse, self.settings.reuse)
+        model = CalibrationModel.from_pure_tones(np.load(previous.calibration))
+
+        freq = np.linspace(
+            self.settings.calibration.min_freq,
+            self.settings.calibration.max_freq,
+            reuse.points,
+        )
+        amp = (
+            self.settings.calibration.min_amp + self.settings.calibration.max_amp
+        ) / 2
+        verification_array = np.stack(
+            (freq, np.full(freq.size, amp), np.zeros(freq.size)), axis=1
+        )[:, np.newaxis, :]
+
+        verification_array, _ = self.sound_sweep(
+            verification_array, reuse.sound_duration, SweepType.VERIFICATION
+        )
+
+        return verification_array[:, 0, 2] - model.db_spl(amp, freq)
 
     def sound_sweep(
         self,
         calib_array: np.ndarray,
         duration: float,
         type: SweepType = SweepType.CALIBRATION,
+        row_offset: int = 0,
     ):
         """
         Plays sounds with different amplitudes and calculates the correspondent intensities in dB SPL.
 
+        If the staircase is enabled, the amplitudes of each frequency are played in a single staircase, so that every frequency takes one upload and one acquisition.
+
         Parameters
         ----------
         calib_array : np.ndarray
@@ -145,6 +267,8 @@ class PureToneProtocol(Protocol):
             The duration of the sounds (s).
         type : SweepType, optional
             Indicates whether this function is being run in the calibration or in the test of a calibration
+        row_offset : int, optional
+            The offset added to the frequency indices sent to the interface, used when a grid is measured in several sweeps.
 
         Returns
         -------
@@ -155,77 +279,219 @@ class PureToneProtocol(Protocol):
         """
         # Initialization of the output arrays
         sounds = np.zeros((calib_array.shape[0], calib_array.shape[1]), dtype=Sound)
+        staircase = self.settings.staircase
+
+        # Precompute the attenuation values of the whole sweep
+        if isinstance(self.soundcard, HarpSoundCard) and staircase is None:
+            self.soundcard.attenuation.precompute(calib_array[:, :, 1])
+
+        match type:
+            case SweepType.CALIBRATION:
+                prefix = "calibration"
+                code = "Pure Tone Calibration"
+            case SweepType.TEST:
+                prefix = "test"
+                code = "Pure Tone Test"
+            case SweepType.VERIFICATION:
+                prefix = "verification"
+                code = "Pure Tone Verification"
+
+        # The sounds are uploaded to alternating indices, so that the next sound can be uploaded while the current one is being played
+        free_indices = queue.Queue()
+        if self.settings.pipeline.concurrent_upload:
+            indices = SOUND_INDICES
+        else:
+            indices = SOUND_INDICES[:1]
+        for index in indices:
+            free_indices.put(index)
+
+        def rec_file(i: int, j: Optional[int] = None):
+            # The staircase of a frequency is saved to a single file
+            return (
+                prefix
+                + "_rec_"
+                + str(round(calib_array[i, 0, 0]))
+                + "hz_"
+                + ("staircase" if j is None else str(j))
+                + ".npy"
+            )
 
-        for i in range(calib_array.shape[0]):
+        def completed(i: int):
+            # Whether every point of the frequency was measured before the run was interrupted
+            if staircase is not None:
+                return rec_file(i) in self.journal
+            return all(
+                rec_file(i, j) in self.journal
+                for j in np.flatnonzero(~np.isnan(calib_array[i, :, 1]))
+            )
+
+        def generate(i: int):
             # Generate the pure tone
+            # The amplitude of each recording is set by the soundcard, so the tone is generated at full scale
             signal = PureTone(
                 duration,
                 self.soundcard.fs,
                 calib_array[i, 0, 0],
-                amplitude=calib_array[i, -1, 1],
                 ramp_time=self.settings.ramp_time,
             )
 
-            # Save the generated pure tone
-            match type:
-                case SweepType.CALIBRATION:
-                    filename = (
-                        self.output_path
-                        / "sounds"
-                        / ("calibration_" + str(round(calib_array[i, 0, 0])) + "hz.bin")
-                    )
-                    code = "Pure Tone Calibration"
-                case SweepType.TEST:
-                    filename = (
-                        self.output_path
-                        / "sounds"
-                        / ("test_" + str(round(calib_array[i, 0, 0])) + "hz.bin")
-                    )
-                    code = "Pure Tone Test"
+            # The staircase applies the amplitudes to the signal itself, clipped to full scale as the attenuation of the Harp SoundCard would be
+            if staircase is not None:
+                steps = np.flatnonzero(~np.isnan(calib_array[i, :, 1]))
+                signal = SteppedSound(
+                    signal,
+                    np.minimum(calib_array[i, steps, 1], 1),
+                    staircase.gap_duration,
+                )
+            return i, signal
+
+        def upload(item: tuple[int, PureTone | SteppedSound]):
+            i, signal = item
+
+            # There is no need to upload the sound if every recording of the frequency will be reused
+            if completed(i):
+                return i, signal, None
+
+            # Wait until the sound stored in one of the indices is no longer needed
+            while True:
+                try:
+                    index = free_indices.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    if pipeline.aborted.is_set():
+                        raise RuntimeError("The pipeline was aborted.")
+
+            # Pure tones are deterministic, so their files can always be reused from the stimulus cache
+            parameters = {}
+            if isinstance(signal, SteppedSound):
+                parameters["amplitudes"] = signal.amplitudes
+                parameters["gap_duration"] = signal.gap_duration
+            key = self.stimulus_key(
+                "pure_tone",
+                duration=duration,
+                freq=calib_array[i, 0, 0],
+                ramp_time=self.settings.ramp_time,
+                **parameters,
+            )
 
             # Upload the sound to the Harp SoundCard in case one is used
             if isinstance(self.soundcard, HarpSoundCard):
-                create_sound_file(signal, filename)
-                self.soundcard.load_sound(filename)
-
-            for j in range(calib_array.shape[1]):
-                # If amplitude value is NaN skip this sound
-                if np.isnan(calib_array[i, j, 1]):
-                    calib_array[i, j, 2] = np.nan
-                    continue
-
-                # Play the sound from the soundcard and record it with the microphone + DAQ system
-                if type == "Calibration":
-                    rec_file = (
-                        "calibration_rec_"
-                        + str(round(calib_array[i, j, 0]))
-                        + "hz_"
-                        + str(j)
-                        + ".npy"
-                    )
-                else:
-                    rec_file = (
-                        "test_rec_"
-                        + str(round(calib_array[i, j, 0]))
-                        + "hz_"
-                        + str(j)
-                        + ".npy"
-                    )
-
-                sounds[i, j] = self.record_sound(
-                    self.output_path / "sounds" / rec_file,
-                    duration,
-                    calib_array[i, j, 1],
-                    self.settings.filter.filter_acquisition,
+                filename = self.sound_file(
+                    key,
+                    signal,
+                    self.output_path
+                    / "sounds"
+                    / (prefix + "_" + str(round(calib_array[i, 0, 0])) + "hz.bin"),
                 )
-
-                # Calculate the intensity in dB SPL
-                calib_array[i, j, 2] = sounds[i, j].calculate_db_spl(
-                    self.settings.mic_factor
+                self.soundcard.load_sound(filename, index)
+            elif isinstance(self.soundcard, ComputerSoundCard):
+                self.soundcard.load_sound(signal, index)
+
+            return i, signal, index
+
+        def acquire(item: tuple[int, PureTone | SteppedSound, int]):
+            i, signal, index = item
+
+            try:
+                if staircase is not None:
+                    # Play every amplitude of the frequency at once (or reuse the recording of an interrupted run)
+                    calib_array[i, np.isnan(calib_array[i, :, 1]), 2] = np.nan
+                    steps = np.flatnonzero(~np.isnan(calib_array[i, :, 1]))
+                    sound = self.load_recording(rec_file(i))
+                    if sound is None:
+                        sound = self.acquire_sound(signal.duration, 1, index)
+                    yield i, steps, signal, sound
+                    return
+
+                for j in range(calib_array.shape[1]):
+                    # If amplitude value is NaN skip this sound
+                    if np.isnan(calib_array[i, j, 1]):
+                        calib_array[i, j, 2] = np.nan
+                        continue
+
+                    # Reuse the recording of an interrupted run
+                    sound = self.load_recording(rec_file(i, j))
+                    if sound is not None:
+                        yield i, j, signal, sound
+                        continue
+
+                    # Play the sound from the soundcard and record it with the microphone + DAQ system
+                    sound = self.acquire_sound(
+                        duration, calib_array[i, j, 1], index, early_stop=True
+                    )
+                    yield i, j, signal, sound
+            finally:
+                # The index can be reused once every sound of the frequency was played
+                if index is not None:
+                    free_indices.put(index)
+
+        def save(item: tuple[int, int | np.ndarray, PureTone, RecordedSound]):
+            i, j, _, sound = item
+            filename = rec_file(i, None if staircase is not None else j)
+            if filename not in self.journal:
+                # The staircase of a frequency has every step, so it has no step of its own
+                self.save_recording(
+                    filename,
+                    sound,
+                    sweep=prefix,
+                    freq=float(calib_array[i, 0, 0]),
+                    step=None if staircase is not None else int(j),
                 )
+                # Commit the point to the journal as soon as its recording is saved, so that it is not measured again if the run is resumed
+                self.journal.commit(filename)
+            return item
+
+        def apply_filter(item: tuple[int, int | np.ndarray, PureTone, RecordedSound]):
+            if self.settings.filter.filter_acquisition:
+                self.filter_sound(item[3])
+            return item
+
+        def analyse(item: tuple[int, int | np.ndarray, PureTone, RecordedSound]):
+            # Calculate the intensity in dB SPL (of every step of the staircase)
+            i, j, signal, sound = item
+            if staircase is not None:
+                db_spl = sound.step_levels(signal.boundaries, self.settings.mic_factor)
+            else:
+                db_spl = sound.calculate_db_spl(self.settings.mic_factor)
+            return i, j, signal, sound, db_spl
+
+        def send(item: tuple[int, int | np.ndarray, PureTone, RecordedSound, float]):
+            i, j, signal, sound, db_spl = item
+            calib_array[i, j, 2] = db_spl
+
+            # Add the level to the entry of the point (the levels of the recordings reused from an interrupted run are calculated again)
+            filename = rec_file(i, None if staircase is not None else j)
+            if "db_spl" not in self.journal.get(filename):
+                self.journal.commit(filename, db_spl=np.asarray(db_spl).tolist())
+
+            # Split the staircase into the recordings of each amplitude
+            if staircase is not None:
+                steps = zip(j, sound.split(signal.boundaries))
+                signal = signal.sound
+            else:
+                steps = [(j, sound)]
+
+            for j, sound in steps:
+                sounds[i, j] = sound
 
                 # Send information regarding the current pure tone to the interface
                 if self.callback is not None:
-                    self.callback(code, i, j, signal, sounds[i, j])
+                    self.callback(code, row_offset + i, j, signal, sound)
+
+        # The acquisition is the only serial stage, the remaining ones overlap with the recordings
+        workers = self.settings.pipeline.workers
+        pipeline = Pipeline(
+            [
+                Stage("generation", generate, workers),
+                Stage("upload", upload),
+                Stage("acquisition", acquire, fan_out=True),
+                Stage("saving", save),
+                Stage("filtering", apply_filter, workers),
+                Stage("analysis", analyse, workers),
+            ],
+            self.settings.pipeline.queue_size,
+        )
+        pipeline.run(range(calib_array.shape[0]), send)
+        self.report_pipeline(pipeline)
 
         return calib_array, sounds
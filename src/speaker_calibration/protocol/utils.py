@@ -4,16 +4,24 @@ from abc import ABC, abstractmethod
 from pathlib import Path
 from typing import Callable, Optional
 
+import numpy as np
+from scipy import stats
 from scipy.signal import butter, sosfilt
 
+from speaker_calibration.archive import RunArchive
+from speaker_calibration.cache import StimulusCache
 from speaker_calibration.config import (
+    EarlyStop,
     NoiseProtocolSettings,
     Paths,
     PureToneProtocolSettings,
 )
+from speaker_calibration.history import StoredResult
+from speaker_calibration.protocol.journal import Journal
+from speaker_calibration.protocol.pipeline import Pipeline
 from speaker_calibration.recording import RecordingDevice
-from speaker_calibration.sound import RecordedSound
-from speaker_calibration.soundcards import SoundCard
+from speaker_calibration.sound import LevelAccumulator, RecordedSound, Sound
+from speaker_calibration.soundcards import SoundCard, create_sound_file
 
 
 class Protocol(ABC):
@@ -33,16 +41,178 @@ class Protocol(ABC):
         self.paths = paths
         self.callback = callback
 
+        # The generated sounds are reused across runs if a stimulus cache is configured
+        self.cache = (
+            StimulusCache(Path(paths.cache), paths.cache_max_size)
+            if paths.cache is not None
+            else None
+        )
+
+        # Every recording, result and stimulus description of the run is appended to its archive, if it is enabled
+        self.archive = (
+            RunArchive(
+                output_path / "run.archive",
+                settings.archive.compression,
+                settings.archive.level,
+                settings.archive.dtype,
+            )
+            if settings.archive is not None
+            else None
+        )
+
+        # The journal of a resumed run already contains the points measured before it was interrupted
+        self.journal = Journal(output_path / "journal.jsonl")
+        if len(self.journal) > 0:
+            print(f"Resuming run: {len(self.journal)} completed points in the journal")
+
     @abstractmethod
     def sound_sweep(self):
         pass
 
+    @abstractmethod
+    def verify(self, previous: StoredResult) -> np.ndarray:
+        """
+        Measures a few points with the results of a previous run and compares their levels with the ones predicted by its calibration.
+
+        Parameters
+        ----------
+        previous : StoredResult
+            The result of the previous run.
+
+        Returns
+        -------
+        errors : numpy.ndarray
+            The differences between the measured and the predicted levels (dB).
+        """
+
+    def reuse_previous(self, previous: Optional[StoredResult]) -> bool:
+        """
+        Reuses the results of a previous run with the same hardware if a quick verification confirms they are still within the tolerance. The paths of the protocol are then pointed to its EQ filter and calibration, so that they are not measured again.
+
+        Parameters
+        ----------
+        previous : StoredResult, optional
+            The newest result of a previous run with the same hardware, if there is one.
+
+        Returns
+        -------
+        reused : bool
+            Whether the results of the previous run are reused.
+        """
+        reuse = self.settings.reuse
+        if reuse is None:
+            return False
+
+        # A resumed run keeps the decision taken before it was interrupted
+        if "verification.npy" in self.journal:
+            values = self.journal.get("verification.npy")
+        elif previous is None:
+            return False
+        else:
+            errors = self.verify(previous)
+            self.save_result("verification.npy", errors)
+
+            values = {
+                "passed": bool(np.max(np.abs(errors)) <= reuse.tolerance_db),
+                "max_error": float(np.max(np.abs(errors))),
+                "eq_filter": previous.eq_filter,
+                "calibration": previous.calibration,
+            }
+            self.journal.commit("verification.npy", **values)
+
+            print(
+                f"Verification of the calibration of {Path(previous.calibration).parent}: maximum error {values['max_error']:.2f} dB "
+                f"({'reused' if values['passed'] else 'calibrating again'})"
+            )
+
+        if values["passed"]:
+            self.paths = self.paths.model_copy(
+                update={
+                    "eq_filter": values["eq_filter"],
+                    "calibration": values["calibration"],
+                }
+            )
+        return values["passed"]
+
+    def stimulus_key(self, kind: str, **parameters) -> Optional[str]:
+        """
+        Calculates the key of a stimulus in the stimulus cache.
+
+        Parameters
+        ----------
+        kind : str
+            The type of the stimulus.
+        **parameters
+            The parameters of the stimulus, as accepted by `StimulusCache.key`. Random stimuli must include their seed.
+
+        Returns
+        -------
+        key : str, optional
+            The key of the stimulus, or None if there is neither a cache nor an archive.
+        """
+        if self.cache is None and self.archive is None:
+            return None
+        key = StimulusCache.key(kind, self.soundcard.fs, **parameters)
+
+        # Describe the stimulus in the archive, so that the sounds played in the run are known without keeping them
+        name = "stimulus_" + key
+        if self.archive is not None and name not in self.archive:
+            self.archive.write(
+                name, **StimulusCache.describe(kind, self.soundcard.fs, **parameters)
+            )
+
+        return key
+
+    def render(self, key: Optional[str], render: Callable[[], Sound]) -> Sound:
+        """
+        Renders a stimulus, or loads it from the stimulus cache.
+
+        Parameters
+        ----------
+        key : str, optional
+            The key of the stimulus. If None, the stimulus is always rendered.
+        render : Callable[[], Sound]
+            The function that renders the stimulus.
+
+        Returns
+        -------
+        sound : Sound
+            The stimulus.
+        """
+        if key is None or self.cache is None:
+            return render()
+        return self.cache.sound(key, self.soundcard.fs, render)
+
+    def sound_file(self, key: Optional[str], signal: Sound, filename: Path) -> Path:
+        """
+        Writes the file of a stimulus to be uploaded to the Harp SoundCard, or finds it in the stimulus cache.
+
+        Parameters
+        ----------
+        key : str, optional
+            The key of the stimulus. If None, the file is always written.
+        signal : Sound
+            The stimulus.
+        filename : Path
+            The path to which the file is written if there is no cache.
+
+        Returns
+        -------
+        filename : Path
+            The path to the file.
+        """
+        if key is None or self.cache is None:
+            create_sound_file(signal, filename)
+            return filename
+        return self.cache.sound_file(key, lambda path: create_sound_file(signal, path))
+
     def record_sound(
         self,
         filename: Path,
         duration: float,
         amplitude: float = 1,
         filter: bool = False,
+        early_stop: bool = False,
     ) -> RecordedSound:
         """
         Records the sounds.
@@ -55,49 +225,329 @@ class Protocol(ABC):
             The duration of the sound (s).
         filter : bool, optional
             Indicates whether the acquired signal should be filtered or not.
+        early_stop : bool, optional
+            Indicates whether the recording stops once its level has converged, according to the early stop settings of the protocol.
 
         Returns
         -------
         sound : Sound
             The recorded sound.
         """
+        sound = self.acquire_sound(
+            duration, amplitude, filename=filename, early_stop=early_stop
+        )
+
+        # Filter the acquired signal if desired
+        if filter:
+            self.filter_sound(sound)
+
+        return sound
+
+    def acquire_sound(
+        self,
+        duration: float,
+        amplitude: float = 1,
+        index: Optional[int] = None,
+        filename: Optional[Path] = None,
+        early_stop: bool = False,
+    ) -> RecordedSound:
+        """
+        Plays a sound from the soundcard and records it with the ADC.
+
+        Parameters
+        ----------
+        duration : float
+            The duration of the sound (s).
+        amplitude : float, optional
+            The amplitude factor of the sound.
+        index : int, optional
+            The index of the soundcard in which the sound is stored. If not provided, the default index of the soundcard is used.
+        filename : Path, optional
+            The path to the file to which the recorded sound will be saved. Only its name is used if the run has an archive.
+        early_stop : bool, optional
+            Indicates whether the recording stops once its level has converged, according to the early stop settings of the protocol. The recording never lasts longer than `duration`.
+
+        Returns
+        -------
+        sound : RecordedSound
+            The recorded sound, not filtered.
+        """
         # Create the result list to pass to the recording thread
         result = []
 
+        play_kwargs = {"amplitude": amplitude}
+        if index is not None:
+            play_kwargs["index"] = index
+
         # Create the start event and the threads that will play and record the sound
         start_event = threading.Event()
+        record_kwargs = {"start_event": start_event, "result": result}
+
+        # Follow the level of the recording while it is acquired and stop both devices once it has converged
+        if early_stop and self.settings.early_stop is not None:
+            monitor = ConvergenceMonitor(
+                self.settings.early_stop,
+                self.adc.fs,
+                self.soundcard.stop,
+                self.settle_time(),
+            )
+            record_kwargs["on_block"] = monitor
+            record_kwargs["block_duration"] = self.settings.early_stop.block_duration
+            record_kwargs["accumulator"] = monitor.accumulator
+
         play_thread = threading.Thread(
             target=self.soundcard.play,
-            kwargs={"amplitude": amplitude, "start_event": start_event},
-        )
-        record_thread = threading.Thread(
-            target=self.adc.record_signal,
-            args=[duration],
-            kwargs={
-                "start_event": start_event,
-                "result": result,
-                "filename": filename,
-            },
+            kwargs=play_kwargs | {"start_event": start_event},
         )
+        errors = []
 
-        # Start both threads
-        record_thread.start()
-        play_thread.start()
+        def record():
+            # A failed recording stops the sound and is raised again in the calling thread. Any error is caught, since the drivers raise their own exception types and an uncaught one would leave the sound playing
+            try:
+                self.adc.record_signal(duration, **record_kwargs)
+            except Exception as e:  # noqa: BLE001
+                errors.append(e)
+                self.soundcard.stop()
 
-        # Activates the event in order to synchronize the sound being played with the acquisition
-        time.sleep(0.1)
-        start_event.set()
-        record_thread.join()
+        record_thread = threading.Thread(target=record)
 
-        # Filter the acquired signal if desired
-        if filter:
-            sos = butter(
-                32,
-                [self.settings.filter.min_freq, self.settings.filter.max_freq],
-                btype="bandpass",
-                output="sos",
-                fs=self.adc.fs,
-            )
-            result[0].signal = sosfilt(sos, result[0].signal)
+        # Wait for a free acquisition session in case the ADC is shared with other rigs
+        with self.adc.session_lock:
+            # Start both threads
+            record_thread.start()
+            play_thread.start()
+
+            # Activates the event in order to synchronize the sound being played with the acquisition
+            time.sleep(0.1)
+            start_event.set()
+            record_thread.join()
+            play_thread.join()
+
+        if errors:
+            raise errors[0]
+
+        if filename is not None:
+            self.save_recording(Path(filename).name, result[0])
 
         return result[0]
+
+    def save_recording(self, rec_file: str, sound: RecordedSound, **coordinates):
+        """
+        Saves a recording to the archive of the run, or to its own file in the sounds directory if there is no archive. It must be saved before its point is committed to the journal.
+
+        Parameters
+        ----------
+        rec_file : str
+            The name of the file of the recording, also the key of its point in the journal. It is stored in the archive without its extension.
+        sound : RecordedSound
+            The recording, not filtered.
+        **coordinates
+            The sweep coordinates of the recording, stored with it in the archive.
+        """
+        if self.archive is None:
+            sound.save(self.output_path / "sounds" / rec_file)
+        else:
+            self.archive.write_recording(Path(rec_file).stem, sound, **coordinates)
+
+    def save_result(self, filename: str, array: np.ndarray):
+        """
+        Saves a result of the run (e.g. the EQ filter or the calibration) to its own file in the output directory, from which it is used by the following runs, and to the archive of the run.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file.
+        array : numpy.ndarray
+            The result.
+        """
+        np.save(self.output_path / filename, array)
+        if self.archive is not None:
+            self.archive.write(Path(filename).stem, array, result=True)
+
+    def load_recording(self, rec_file: str) -> Optional[RecordedSound]:
+        """
+        Loads the recording of a sweep point committed to the journal by an interrupted run.
+
+        Parameters
+        ----------
+        rec_file : str
+            The name of the file, inside the sounds directory, to which the recording was saved.
+
+        Returns
+        -------
+        sound : RecordedSound, optional
+            The recorded sound, not filtered, or None if the point was not completed yet.
+        """
+        if rec_file not in self.journal:
+            return None
+
+        # The recordings of runs without an archive (or interrupted before it was enabled) are in the sounds directory
+        name = Path(rec_file).stem
+        if self.archive is not None and name in self.archive:
+            return self.archive.read_recording(name)
+
+        data = np.load(self.output_path / "sounds" / rec_file)
+        if data.ndim == 1:
+            return RecordedSound(data, self.adc.fs)
+        return RecordedSound(data[:, 1], self.adc.fs, data[:, 0])
+
+    def filter_sound(self, sound: RecordedSound):
+        """
+        Applies the band-pass filter of the protocol to a recorded sound.
+
+        Parameters
+        ----------
+        sound : RecordedSound
+            The recorded sound to be filtered.
+        """
+        sound.signal = sosfilt(self._acquisition_sos(), sound.signal)
+
+    def settle_time(self) -> float:
+        """
+        Estimates the duration of the transient at the beginning of the recordings, while the filters applied to the sounds settle (s). The protocols that filter the sounds before playing them add the settle time of those filters.
+        """
+        if not self.settings.filter.filter_acquisition:
+            return 0.0
+        return settle_time(self.adc.fs, sos=self._acquisition_sos())
+
+    def _acquisition_sos(self) -> np.ndarray:
+        return butter(
+            32,
+            [self.settings.filter.min_freq, self.settings.filter.max_freq],
+            btype="bandpass",
+            output="sos",
+            fs=self.adc.fs,
+        )
+
+    def report_pipeline(self, pipeline: Pipeline):
+        """
+        Reports the utilisation of the stages of a pipeline that has finished.
+
+        Parameters
+        ----------
+        pipeline : Pipeline
+            The pipeline that has finished.
+        """
+        print(pipeline.report())
+
+        if self.callback is not None:
+            self.callback("Pipeline", pipeline.utilisation())
+
+
+class ConvergenceMonitor:
+    """
+    Follows the level of a recording while its blocks arrive and tells when the estimate is known within the tolerance.
+
+    The blocks are accumulated in windows of the block duration, whose mean square values are observations of the level of the sound. The recording has converged once the confidence interval of their mean is narrower than the tolerance and the minimum duration has elapsed. The windows of the first 10% of the minimum duration are ignored, as the sound may not have started yet.
+
+    The level of a recording is calculated without its first 10%, so the minimum duration is raised to 10 times the settle time of the filters of the sound if it is shorter. Otherwise the transient of the filters would be part of the level of a recording stopped early.
+
+    Attributes
+    ----------
+    settings : EarlyStop
+        The early stop settings.
+    accumulator : LevelAccumulator
+        The accumulator of the recording. The recording device must add each block to it before calling the monitor.
+    on_converged : Callable, optional
+        A function called once the level has converged, used to stop the sound.
+    min_duration : float
+        The minimum duration of the recording (s).
+    """
+
+    settings: EarlyStop
+    accumulator: LevelAccumulator
+    on_converged: Optional[Callable[[], None]]
+    min_duration: float
+
+    def __init__(
+        self,
+        settings: EarlyStop,
+        fs: float,
+        on_converged: Optional[Callable[[], None]] = None,
+        settle_time: float = 0,
+    ):
+        """
+        Parameters
+        ----------
+        settle_time : float, optional
+            The settle time of the filters applied to the sound (s), estimated with `Protocol.settle_time`.
+        """
+        self.settings = settings
+        self.accumulator = LevelAccumulator(fs, settings.block_duration)
+        self.on_converged = on_converged
+        self.min_duration = max(settings.min_duration, 10 * settle_time)
+        self._skipped = int(np.ceil(0.1 * self.min_duration / settings.block_duration))
+
+    def __call__(self, block: np.ndarray) -> bool:
+        """
+        Checks whether the recording can stop, after a block was added to the accumulator.
+
+        Parameters
+        ----------
+        block : numpy.ndarray
+            The samples of the last block.
+
+        Returns
+        -------
+        converged : bool
+            Whether the recording can stop.
+        """
+        elapsed = self.accumulator.count / self.accumulator.fs
+        if elapsed < self.min_duration or self.half_width() > (
+            self.settings.tolerance_db
+        ):
+            return False
+
+        if self.on_converged is not None:
+            self.on_converged()
+        return True
+
+    def half_width(self) -> float:
+        """
+        Returns the half-width of the confidence interval of the level (dB).
+        """
+        mean_squares = self.accumulator.window_mean_squares()[self._skipped :]
+        n = mean_squares.size
+        mean = np.mean(mean_squares) if n > 0 else 0
+        if n < 2 or mean == 0:
+            return np.inf
+
+        std = np.std(mean_squares, ddof=1)
+        half_width = (
+            stats.t.ppf((1 + self.settings.confidence) / 2, n - 1) * std / np.sqrt(n)
+        )
+
+        return 10 * np.log10(1 + half_width / mean)
+
+
+def settle_time(
+    fs: float,
+    sos: Optional[np.ndarray] = None,
+    taps: Optional[np.ndarray] = None,
+    tolerance: float = 1e-3,
+) -> float:
+    """
+    Estimates the settle time of a filter, i.e. the time after which the energy left in its impulse response is below the tolerance.
+
+    Parameters
+    ----------
+    fs : float
+        The sampling frequency of the filter (Hz).
+    sos : numpy.ndarray, optional
+        The second-order sections of an IIR filter. Its impulse response is assumed to decay as its slowest pole.
+    taps : numpy.ndarray, optional
+        The coefficients of a FIR filter. They are used instead of `sos` if both are provided.
+    tolerance : float, optional
+        The fraction of the energy of the impulse response left.
+
+    Returns
+    -------
+    settle_time : float
+        The settle time (s).
+    """
+    if taps is not None:
+        energy = np.cumsum(np.asarray(taps) ** 2)
+        return np.searchsorted(energy, (1 - tolerance) * energy[-1]) / fs
+
+    radius = max(np.max(np.abs(np.roots(section[3:]))) for section in sos)
+    return np.log(tolerance) / (2 * np.log(radius)) / fs
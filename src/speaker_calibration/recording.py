@@ -1,16 +1,21 @@
 import os
+import tempfile
 import threading
 import time
 from abc import ABC, abstractmethod
+from contextlib import AbstractContextManager, nullcontext
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Callable, Optional
 
-import nidaqmx
 import numpy as np
-from moku.instruments import Datalogger
-from nidaqmx.constants import READ_ALL_AVAILABLE, AcquisitionType, TerminalConfiguration
 
-from speaker_calibration.sound import RecordedSound
+from speaker_calibration.sound import LevelAccumulator, RecordedSound
+
+if TYPE_CHECKING:
+    import speaker_calibration.config as settings
+
+# The duration of each stream of the Moku device (s), after which a new one is started
+STREAM_DURATION = 600
 
 
 class RecordingDevice(ABC):
@@ -21,19 +26,46 @@ class RecordingDevice(ABC):
     ----------
     fs : float | int
         The sampling frequency of the recording device.
+    session_lock : AbstractContextManager
+        The lock held during every acquisition, used to limit the number of acquisitions running at the same time in different processes (e.g. a semaphore shared by several rigs). By default it does not limit anything.
     """
 
     fs: float | int
+    session_lock: AbstractContextManager
 
     def __init__(self, fs: float | int):
         self.fs = fs
+        self.session_lock = nullcontext()
+
+    @classmethod
+    @abstractmethod
+    def from_config(cls, config):
+        """
+        Creates the recording device from its settings. _This is the method used by the backend registry, to be implemented by the recording devices that can be selected in the configuration._
+        """
 
     @abstractmethod
     def record_signal(self, duration: float) -> Optional[RecordedSound]:
         """
         Records the desired signal. _This is the abstract method to be implemented for the specific recording devices that derive from this abstract class._
         """
-        pass
+
+    @abstractmethod
+    def stream(
+        self,
+        on_block: Callable[[np.ndarray], bool],
+        block_duration: float = 0.05,
+    ):
+        """
+        Acquires continuously, passing each block of samples to a function until it asks to stop, e.g. to monitor the level of the microphone. _This is the abstract method to be implemented for the specific recording devices that derive from this abstract class._
+
+        Parameters
+        ----------
+        on_block : Callable[[numpy.ndarray], bool]
+            A function called with each block of samples as soon as it is read. The acquisition stops when it returns True.
+        block_duration : float, optional
+            The duration of the blocks (s).
+        """
 
 
 class NiDaq(RecordingDevice):
@@ -52,6 +84,18 @@ class NiDaq(RecordingDevice):
         super().__init__(fs)
         self.device_id = device_id
 
+    @classmethod
+    def from_config(cls, config: "settings.NiDaq"):
+        """
+        Creates the NI-DAQ from its settings.
+
+        Parameters
+        ----------
+        config : speaker_calibration.config.NiDaq
+            The ADC settings.
+        """
+        return cls(config.device_id, config.fs)
+
     def record_signal(
         self,
         duration: float,
@@ -59,6 +103,9 @@ class NiDaq(RecordingDevice):
         start_event: Optional[threading.Event] = None,
         result: Optional[list] = None,
         filename: Optional[Path] = None,
+        on_block: Optional[Callable[[np.ndarray], bool]] = None,
+        block_duration: float = 0.1,
+        accumulator: Optional[LevelAccumulator] = None,
     ) -> Optional[RecordedSound]:
         """
         Records the signal with the NI-DAQ.
@@ -75,7 +122,25 @@ class NiDaq(RecordingDevice):
             A list to which the acquired signal will be appended.
         filename : Path, optional
             The path to the file that will be saved with the acquired signal.
+        on_block : Callable[[numpy.ndarray], bool], optional
+            A function called with each block of samples as soon as it is read. The acquisition stops early if it returns True. If not provided, the whole signal is read at once.
+        block_duration : float, optional
+            The duration of the blocks passed to `on_block` (s).
+        accumulator : LevelAccumulator, optional
+            The accumulator to which the blocks are added as soon as they are read, before being passed to `on_block`. If not provided, a new one is used.
         """
+        # The driver is only imported when the NI-DAQ is used
+        import nidaqmx
+        from nidaqmx.constants import (
+            READ_ALL_AVAILABLE,
+            AcquisitionType,
+            TerminalConfiguration,
+        )
+
+        samples = int(self.fs * duration)
+        if accumulator is None:
+            accumulator = LevelAccumulator(self.fs)
+
         with nidaqmx.Task() as ai_task:
             # Configure the analog input responsible for the sound acquisition
             ai_task.ai_channels.add_ai_voltage_chan(
@@ -86,7 +151,7 @@ class NiDaq(RecordingDevice):
             ai_task.timing.cfg_samp_clk_timing(
                 self.fs,
                 sample_mode=AcquisitionType.FINITE,
-                samps_per_chan=int(self.fs * duration),
+                samps_per_chan=samples,
             )
 
             # Wait for the event if it exists
@@ -95,15 +160,40 @@ class NiDaq(RecordingDevice):
 
             # Start the analog acquisition
             ai_task.start()
-            time.sleep(duration)
 
-            recorded_signal = ai_task.read(READ_ALL_AVAILABLE)
+            if on_block is None:
+                time.sleep(duration)
+                recorded_signal = np.array(ai_task.read(READ_ALL_AVAILABLE))
+                accumulator.add(recorded_signal)
+            else:
+                # Read the signal block by block, until it ends or the callback asks to stop
+                blocks = []
+                read = 0
+                block_samples = max(1, int(self.fs * block_duration))
+                while read < samples:
+                    block = np.array(
+                        ai_task.read(
+                            number_of_samples_per_channel=min(
+                                block_samples, samples - read
+                            )
+                        )
+                    )
+                    blocks.append(block)
+                    accumulator.add(block)
+                    read += block.size
+                    if on_block(block):
+                        break
+                recorded_signal = np.concatenate(blocks)
+
             ai_task.stop()
 
             acquired_signal = RecordedSound(
-                signal=np.array(recorded_signal),
+                signal=recorded_signal,
                 fs=self.fs,
-                time=np.linspace(0, duration, int(self.fs * duration)),
+                time=np.linspace(
+                    0, recorded_signal.size / self.fs, recorded_signal.size
+                ),
+                accumulator=accumulator,
             )
 
             # Append the acquired signal if a result list was passed to the function
@@ -116,6 +206,51 @@ class NiDaq(RecordingDevice):
 
         return acquired_signal
 
+    def stream(
+        self,
+        on_block: Callable[[np.ndarray], bool],
+        block_duration: float = 0.05,
+        ai_pin: int = 1,
+    ):
+        """
+        Acquires continuously with the NI-DAQ, without gaps between the blocks, until `on_block` asks to stop.
+
+        Parameters
+        ----------
+        on_block : Callable[[numpy.ndarray], bool]
+            A function called with each block of samples as soon as it is read. The acquisition stops when it returns True.
+        block_duration : float, optional
+            The duration of the blocks (s).
+        ai_pin : int, optional
+            The analog input pin to acquire from.
+        """
+        import nidaqmx
+        from nidaqmx.constants import AcquisitionType, TerminalConfiguration
+
+        block_samples = max(1, int(self.fs * block_duration))
+
+        with nidaqmx.Task() as ai_task:
+            ai_task.ai_channels.add_ai_voltage_chan(
+                "Dev" + str(self.device_id) + "/ai" + str(ai_pin),
+                terminal_config=TerminalConfiguration.RSE,
+            )
+
+            # The buffer of the driver holds several blocks, so that a slow block does not overflow it
+            ai_task.timing.cfg_samp_clk_timing(
+                self.fs,
+                sample_mode=AcquisitionType.CONTINUOUS,
+                samps_per_chan=10 * block_samples,
+            )
+
+            ai_task.start()
+            while True:
+                block = np.array(
+                    ai_task.read(number_of_samples_per_channel=block_samples)
+                )
+                if on_block(block):
+                    break
+            ai_task.stop()
+
 
 class Moku(RecordingDevice):
     """
@@ -133,13 +268,28 @@ class Moku(RecordingDevice):
         super().__init__(fs)
         self.address = "[" + address + "]"
 
+    @classmethod
+    def from_config(cls, config: "settings.Moku"):
+        """
+        Creates the Moku device from its settings.
+
+        Parameters
+        ----------
+        config : speaker_calibration.config.Moku
+            The ADC settings.
+        """
+        return cls(config.address, config.fs)
+
     def record_signal(
         self,
         duration: float,
         channel: int = 1,
         start_event: Optional[threading.Event] = None,
         result: Optional[list] = None,
-        filename: str = "file",
+        filename: Optional[Path] = None,
+        on_block: Optional[Callable[[np.ndarray], bool]] = None,
+        block_duration: float = 0.1,
+        accumulator: Optional[LevelAccumulator] = None,
     ) -> Optional[RecordedSound]:
         """
         Records the signal with a Moku device.
@@ -154,12 +304,28 @@ class Moku(RecordingDevice):
             A thread event used to synchronize the start of the sound with the start of the recording. If `start_event` is not provided, the sound will play as soon as possible.
         result : list, optional
             A list to which the acquired signal will be appended.
-        filename : str, optional
+        filename : Path, optional
             The path to the file that will be saved with the acquired signal.
+        on_block : Callable[[numpy.ndarray], bool], optional
+            Not supported by the Moku device, whose log is only downloaded once it ends. The recording always lasts `duration`.
+        block_duration : float, optional
+            Not supported by the Moku device.
+        accumulator : LevelAccumulator, optional
+            The accumulator to which the whole signal is added once it is downloaded. If not provided, a new one is used.
         """
+        # The driver is only imported when the Moku device is used
+        from moku.instruments import Datalogger
+
+        if accumulator is None:
+            accumulator = LevelAccumulator(self.fs)
+
         # Connect to Moku:Go
         adc = Datalogger(self.address, force_connect=True)
 
+        # Temporary files used to transfer the log from the Moku device. They are kept in a directory of their own, so that the rigs calibrated at the same time do not overwrite each other's logs
+        log_directory = tempfile.TemporaryDirectory(prefix="moku_")
+        log_file = Path(log_directory.name) / "log"
+
         try:
             # Configure the frontend
             adc.set_frontend(
@@ -190,16 +356,22 @@ class Moku(RecordingDevice):
                 print(f"Remaining time {remaining_time} seconds")
 
             # Download log from Moku
-            adc.download("persist", logFile["file_name"], filename + ".li")
+            adc.download("persist", logFile["file_name"], str(log_file) + ".li")
 
             # Use mokucli to convert this .li file to .csv
-            os.system("mokucli convert " + filename + ".li --format=csv")
-            signal_array = np.loadtxt(filename + ".csv", comments="%", delimiter=",")
+            os.system(f'mokucli convert "{log_file}.li" --format=csv')
+            signal_array = np.loadtxt(
+                str(log_file) + ".csv", comments="%", delimiter=","
+            )
+
+            recorded_signal = signal_array[:, 1]
+            accumulator.add(recorded_signal)
 
             acquired_signal = RecordedSound(
-                signal=np.array([x[1] for x in signal_array]),
+                signal=recorded_signal,
                 fs=self.fs,
-                time=np.array([x[0] for x in signal_array]),
+                time=signal_array[:, 0],
+                accumulator=accumulator,
             )
 
             # Append the acquired signal if a result list was passed to the function
@@ -207,10 +379,71 @@ class Moku(RecordingDevice):
                 result.append(acquired_signal)
 
         except Exception as e:
+            # The exception is raised again, so that the interrupted run can be resumed
             print(f"Exception occurred: {e}")
+            raise
         finally:
             # Close the connection to the Moku device
             # This ensures network resources and released correctly
             adc.relinquish_ownership()
+            log_directory.cleanup()
+
+        # Save the acquired signal to a binary file
+        if filename is not None:
+            acquired_signal.save(filename)
 
         return acquired_signal
+
+    def stream(
+        self,
+        on_block: Callable[[np.ndarray], bool],
+        block_duration: float = 0.05,
+        channel: int = 1,
+    ):
+        """
+        Acquires continuously with the Moku device, streaming the samples from its data logger instead of downloading logs, until `on_block` asks to stop.
+
+        Parameters
+        ----------
+        on_block : Callable[[numpy.ndarray], bool]
+            A function called with each block of samples as soon as it is read. The acquisition stops when it returns True.
+        block_duration : float, optional
+            The duration of the blocks (s).
+        channel : int, optional
+            The channel to acquire from.
+        """
+        # The driver is only imported when the Moku device is used
+        from moku.exceptions import StreamException
+        from moku.instruments import Datalogger
+
+        block_samples = max(1, int(self.fs * block_duration))
+
+        adc = Datalogger(self.address, force_connect=True)
+        try:
+            adc.set_frontend(
+                channel=channel, impedance="1MOhm", coupling="AC", range="10Vpp"
+            )
+            adc.set_samplerate(self.fs)
+            adc.set_acquisition_mode(mode="Precision")
+
+            # The stream sends the samples in chunks of any size, which are regrouped into blocks of the requested duration
+            samples = np.zeros(0)
+            stop = False
+            while not stop:
+                # A stream has a limited duration, so a new one is started whenever the previous one ends
+                adc.start_streaming(duration=STREAM_DURATION)
+                try:
+                    while not stop:
+                        data = adc.get_stream_data()
+                        samples = np.concatenate(
+                            (samples, np.asarray(data["ch" + str(channel)]))
+                        )
+                        while not stop and samples.size >= block_samples:
+                            stop = on_block(samples[:block_samples])
+                            samples = samples[block_samples:]
+                except StreamException:
+                    # The end of the stream is signalled by an exception
+                    continue
+            adc.stop_streaming()
+        finally:
+            adc.relinquish_ownership()
@@ -0,0 +1,500 @@
+import argparse
+import json
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import yaml
+from pydantic import BaseModel, Field
+from scipy.signal import butter, sosfilt
+
+from speaker_calibration.archive import RunArchive
+from speaker_calibration.calibration import CalibrationModel
+from speaker_calibration.config import (
+    Config,
+    NoiseProtocolSettings,
+    PureToneProtocolSettings,
+    load_config,
+)
+from speaker_calibration.protocol.noise import eq_filter_from_recording
+from speaker_calibration.sound import RecordedSound
+
+# The recordings saved by the protocols, inside the sounds directory (.npy files) or in the archive of the run (without extension)
+_NOISE_FILE = re.compile(r"(calibration|test)_(\d+|staircase)(?:\.npy)?")
+_PURE_TONE_FILE = re.compile(
+    r"(calibration|test)_rec_(\d+)hz_(\d+|staircase)(?:\.npy)?"
+)
+_MULTISINE_FILE = re.compile(r"calibration_multisine_rec_(\d+)(?:\.npy)?")
+
+
+class Analysis(BaseModel):
+    min_freq: Optional[float] = Field(
+        description="The low cutoff frequency of the band-pass filter applied to the recordings (Hz). If not provided, the one of the run is used.",
+        ge=0,
+        default=None,
+    )
+    max_freq: Optional[float] = Field(
+        description="The high cutoff frequency of the band-pass filter applied to the recordings (Hz). If not provided, the one of the run is used.",
+        gt=0,
+        default=None,
+    )
+    filter: Optional[bool] = Field(
+        description="Indicates whether the band-pass filter is applied to the recordings. If not provided, the setting of the run is used.",
+        default=None,
+    )
+    crop: float = Field(
+        description="The fraction of each recording (or staircase step) removed both from its beginning and from its end.",
+        ge=0,
+        lt=0.5,
+        default=0.1,
+    )
+    window: Optional[float] = Field(
+        description="The duration of the window of the spectra and of the EQ filter calculation (s). If not provided, the time constant of the EQ filter of the run is used.",
+        gt=0,
+        default=None,
+    )
+    mic_factor: Optional[float] = Field(
+        description="The conversion factor of the microphone (V/Pa). If not provided, the one of the run is used.",
+        gt=0,
+        default=None,
+    )
+    spectra: bool = Field(
+        description="Indicates whether the spectrum of every recording is calculated.",
+        default=True,
+    )
+
+
+# The analysis parameters, set once in every worker process
+_shared = {}
+
+
+def reprocess(
+    run: Path,
+    analysis: Analysis,
+    workers: Optional[int] = None,
+    output: Optional[Path] = None,
+) -> Path:
+    """
+    Recomputes the results of a saved calibration run from its recordings, without the hardware.
+
+    The recordings are analysed in parallel and loaded as memory-mapped arrays. The intensity in dB SPL of every recording (or staircase step, or multisine tone) and its spectrum are recomputed, as well as the EQ filter of a noise calibration and the calibration fit.
+
+    Parameters
+    ----------
+    run : Path
+        The output directory of the calibration run.
+    analysis : Analysis
+        The analysis parameters.
+    workers : int, optional
+        The number of worker processes. If not provided, every core is used.
+    output : Path, optional
+        The directory to which the results are written. If not provided, a timestamped directory is created inside the reprocess directory of the run.
+
+    Returns
+    -------
+    path : Path
+        The directory of the results.
+    """
+    start_time = time.perf_counter()
+
+    config = load_config(run / "config.yml")
+    settings = config.protocol
+    is_noise = isinstance(settings, NoiseProtocolSettings)
+
+    # The parameters that are not provided are the ones of the run
+    defaults = {
+        "min_freq": settings.filter.min_freq,
+        "max_freq": settings.filter.max_freq,
+        "filter": settings.filter.filter_acquisition,
+        "window": settings.eq_filter.time_constant if is_noise else 0.005,
+        "mic_factor": settings.mic_factor,
+    }
+    analysis = analysis.model_copy(
+        update={
+            key: value
+            for key, value in defaults.items()
+            if getattr(analysis, key) is None
+        }
+    )
+
+    path = output or run / "reprocess" / datetime.now().strftime("%y%m%d_%H%M%S")
+    path.mkdir(parents=True, exist_ok=True)
+
+    recordings = _recordings(run)
+
+    # The calibration array of a pure tone calibration gives the frequency and amplitude of every recording
+    grid = None
+    if not is_noise:
+        grid = _pure_tone_grid(run, settings, recordings)
+
+    tasks = _collect(recordings, config, grid)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(
+            analysis,
+            config.adc.fs,
+            settings.reference_pressure,
+            getattr(settings.calibration, "frequency_resolution", None),
+        ),
+    ) as executor:
+        results = list(executor.map(_analyse, *zip(*tasks))) if tasks else []
+
+    levels = {name: level for name, level, _, _ in results}
+    with open(path / "levels.json", "w") as file:
+        json.dump({name: level.tolist() for name, level in levels.items()}, file)
+
+    if analysis.spectra and results:
+        spectra = {Path(name).stem: spectrum for name, _, _, spectrum in results}
+        np.savez(path / "spectra.npz", freq=results[0][2], **spectra)
+
+    # Fit the calibration again with the new intensities
+    if is_noise:
+        log_amp = np.linspace(
+            settings.calibration.min_amp,
+            settings.calibration.max_amp,
+            settings.calibration.amp_steps,
+        )
+        points = _noise_points(levels, log_amp)
+        if points:
+            x, y = np.array(points).T
+            parameters = np.polyfit(x, y, 1)
+            np.save(path / "calibration_parameters.npy", parameters)
+            model = CalibrationModel.from_parameters(parameters)
+            model.save(path / "calibration_model.npz")
+            print(
+                f"Calibration: {parameters[0]:.3f} dB/decade, {parameters[1]:.2f} dB SPL at full scale"
+            )
+
+        # Calculate the EQ filter again with the new window
+        eq_recording = _eq_recording(run, config.adc.fs)
+        if eq_recording is not None:
+            eq_filter = eq_filter_from_recording(
+                eq_recording,
+                config.soundcard.fs,
+                settings.eq_filter.model_copy(
+                    update={"time_constant": analysis.window}
+                ),
+                settings.min_freq,
+                settings.max_freq,
+            )
+            np.save(path / "eq_filter.npy", eq_filter)
+    elif grid is not None:
+        calib = _pure_tone_calibration(levels, grid)
+        np.save(path / "calibration.npy", calib.reshape(-1, 3))
+        model = CalibrationModel.from_pure_tones(calib.reshape(-1, 3))
+        model.save(path / "calibration_model.npz")
+        print(f"Calibration: {model.freqs.size} frequencies fitted")
+    else:
+        print("Calibration: the run has no calibration recordings to fit")
+
+    with open(path / "analysis.yml", "w") as file:
+        yaml.dump(
+            {"run": str(run)} | analysis.model_dump(), file, default_flow_style=False
+        )
+
+    print(
+        f"Reprocessed {len(tasks)} recordings in {time.perf_counter() - start_time:.1f} s"
+    )
+
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recomputes the results of a saved calibration run with different analysis parameters."
+    )
+    parser.add_argument("run", type=Path, help="The output directory of the run.")
+    parser.add_argument(
+        "--min-freq", type=float, help="The low cutoff frequency of the filter (Hz)."
+    )
+    parser.add_argument(
+        "--max-freq", type=float, help="The high cutoff frequency of the filter (Hz)."
+    )
+    parser.add_argument(
+        "--no-filter",
+        dest="filter",
+        action="store_const",
+        const=False,
+        help="Do not apply the band-pass filter to the recordings.",
+    )
+    parser.add_argument(
+        "--crop",
+        type=float,
+        default=0.1,
+        help="The fraction removed from both ends of the recordings.",
+    )
+    parser.add_argument(
+        "--window", type=float, help="The window of the spectra and EQ filter (s)."
+    )
+    parser.add_argument(
+        "--mic-factor", type=float, help="The conversion factor of the microphone."
+    )
+    parser.add_argument(
+        "--no-spectra",
+        dest="spectra",
+        action="store_false",
+        help="Do not calculate the spectra of the recordings.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="The number of worker processes. Every core is used by default.",
+    )
+    parser.add_argument(
+        "--output", type=Path, help="The directory to which the results are written."
+    )
+    args = parser.parse_args()
+
+    analysis = Analysis(
+        min_freq=args.min_freq,
+        max_freq=args.max_freq,
+        filter=args.filter,
+        crop=args.crop,
+        window=args.window,
+        mic_factor=args.mic_factor,
+        spectra=args.spectra,
+    )
+
+    path = reprocess(args.run, analysis, args.workers, args.output)
+    print(f"Results written to {path}")
+
+
+def _recordings(run: Path) -> list[tuple[Path, str]]:
+    # The recordings of the archive and the ones saved to their own files by runs without an archive
+    recordings = [
+        (filename, filename.name) for filename in sorted(run.glob("sounds/*.npy"))
+    ]
+    if (run / "run.archive").exists():
+        archive = RunArchive(run / "run.archive")
+        recordings += [(archive.path, name) for name in sorted(archive.names())]
+    return recordings
+
+
+def _pure_tone_grid(
+    run: Path, settings: PureToneProtocolSettings, recordings: list[tuple[Path, str]]
+) -> Optional[np.ndarray]:
+    if (run / "calibration.npy").exists():
+        return np.load(run / "calibration.npy").reshape(
+            -1, settings.calibration.amp_steps, 3
+        )
+
+    # A run interrupted before the end of its calibration has no calibration array, so it is rebuilt from the frequencies of the calibration recordings (which are rounded in the names of the files, but not in the coordinates of the archive)
+    archive = None
+    if (run / "run.archive").exists():
+        archive = RunArchive(run / "run.archive")
+
+    freqs = set()
+    for source, name in recordings:
+        if _MULTISINE_FILE.fullmatch(name) is not None:
+            raise ValueError(
+                f"The run {run} has no calibration array, so the frequencies of its multisine recordings are unknown."
+            )
+        match = _PURE_TONE_FILE.fullmatch(name)
+        if match is None or match[1] != "calibration":
+            continue
+        if source.suffix == ".archive":
+            freqs.add(archive.metadata(name)["freq"])
+        else:
+            freqs.add(float(match[2]))
+
+    # A run that reused the calibration of a previous run has no calibration recordings
+    if not freqs:
+        return None
+
+    amp = np.linspace(
+        settings.calibration.min_amp,
+        settings.calibration.max_amp,
+        settings.calibration.amp_steps,
+    )
+    freq, amp = np.meshgrid(sorted(freqs), amp, indexing="ij")
+    return np.stack((freq, amp, np.full(freq.shape, np.nan)), axis=2)
+
+
+def _collect(
+    recordings: list[tuple[Path, str]], config: Config, grid: Optional[np.ndarray]
+) -> list[tuple[Path, str, Optional[np.ndarray], Optional[np.ndarray]]]:
+    # Every task is a recording (the file that holds it and its name) with the boundaries of its steps (staircase) or the frequencies of its tones (multisine)
+    settings = config.protocol
+    tasks = []
+
+    for source, name in recordings:
+        boundaries = None
+        freqs = None
+
+        if isinstance(settings, NoiseProtocolSettings):
+            match = _NOISE_FILE.fullmatch(name)
+            if match is None:
+                continue
+            if match[2] == "staircase":
+                sweep = getattr(settings, match[1])
+                num_steps = (
+                    sweep.amp_steps if match[1] == "calibration" else sweep.db_steps
+                )
+                boundaries = _staircase_boundaries(
+                    num_steps,
+                    sweep.sound_duration,
+                    config.soundcard.fs,
+                    settings.staircase.gap_duration,
+                )
+        elif (match := _MULTISINE_FILE.fullmatch(name)) is not None:
+            freqs = grid[:, 0, 0]
+        elif (match := _PURE_TONE_FILE.fullmatch(name)) is not None:
+            if match[3] == "staircase":
+                # Only the amplitudes of the calibration grid that were measured are steps of the staircase
+                sweep = getattr(settings, match[1])
+                if match[1] == "calibration":
+                    row = np.flatnonzero(np.round(grid[:, 0, 0]) == int(match[2]))[0]
+                    num_steps = np.count_nonzero(~np.isnan(grid[row, :, 1]))
+                else:
+                    num_steps = sweep.db_steps
+                boundaries = _staircase_boundaries(
+                    num_steps,
+                    sweep.sound_duration,
+                    config.soundcard.fs,
+                    settings.staircase.gap_duration,
+                )
+        else:
+            continue
+
+        tasks.append((source, name, boundaries, freqs))
+
+    return tasks
+
+
+def _eq_recording(run: Path, fs: float) -> Optional[RecordedSound]:
+    if (run / "run.archive").exists():
+        archive = RunArchive(run / "run.archive")
+        if "eq_filter_rec" in archive:
+            return archive.read_recording("eq_filter_rec")
+    if (run / "sounds" / "eq_filter_rec.npy").exists():
+        return _load(run / "sounds" / "eq_filter_rec.npy", fs)
+    return None
+
+
+def _staircase_boundaries(
+    num_steps: int, duration: float, fs: float, gap_duration: float
+) -> np.ndarray:
+    # The same steps as the ones of the SteppedSound played by the protocol
+    step_samples = int(fs * duration)
+    gap_samples = int(fs * gap_duration)
+    starts = np.arange(num_steps) * (step_samples + gap_samples)
+    return np.stack((starts, starts + step_samples), axis=1) / fs
+
+
+def _load(filename: Path, fs: float, mmap_mode: Optional[str] = None):
+    data = np.load(filename, mmap_mode=mmap_mode)
+    if data.ndim == 1:
+        return RecordedSound(data, fs)
+    return RecordedSound(data[:, 1], fs, data[:, 0])
+
+
+def _init_worker(
+    analysis: Analysis,
+    fs: float,
+    reference_pressure: float,
+    resolution: Optional[float],
+):
+    _shared["analysis"] = analysis
+    _shared["fs"] = fs
+    _shared["reference_pressure"] = reference_pressure
+    _shared["resolution"] = resolution
+    _shared["archives"] = {}
+    _shared["sos"] = butter(
+        32,
+        [analysis.min_freq, analysis.max_freq],
+        btype="bandpass",
+        output="sos",
+        fs=fs,
+    )
+
+
+def _analyse(
+    source: Path,
+    name: str,
+    boundaries: Optional[np.ndarray],
+    freqs: Optional[np.ndarray],
+) -> tuple[str, np.ndarray, Optional[np.ndarray], Optional[np.ndarray]]:
+    analysis = _shared["analysis"]
+
+    # The recording is only read from the disk when it is used, so that the unfiltered one is never copied
+    if source.suffix == ".archive":
+        # The index of the archive is read once by every worker process
+        if source not in _shared["archives"]:
+            _shared["archives"][source] = RunArchive(source)
+        sound = _shared["archives"][source].read_recording(name)
+    else:
+        sound = _load(source, _shared["fs"], mmap_mode="r")
+    sound.mic_factor = analysis.mic_factor
+    if analysis.filter:
+        sound.signal = sosfilt(_shared["sos"], sound.signal)
+
+    if freqs is not None:
+        level = sound.tone_levels(
+            freqs,
+            _shared["resolution"],
+            reference_pressure=_shared["reference_pressure"],
+            crop=analysis.crop,
+        )
+    elif boundaries is not None:
+        level = sound.step_levels(
+            boundaries,
+            reference_pressure=_shared["reference_pressure"],
+            crop=analysis.crop,
+        )
+    else:
+        level = np.array(
+            sound.calculate_db_spl(
+                reference_pressure=_shared["reference_pressure"], crop=analysis.crop
+            )
+        )
+
+    freq = spectrum = None
+    if analysis.spectra:
+        freq, spectrum = sound.fft_welch(analysis.window)
+
+    return name, level, freq, spectrum
+
+
+def _noise_points(
+    levels: dict[str, np.ndarray], log_amp: np.ndarray
+) -> list[tuple[float, float]]:
+    points = []
+    for name, level in levels.items():
+        match = _NOISE_FILE.fullmatch(name)
+        if match[1] != "calibration":
+            continue
+        if match[2] == "staircase":
+            points.extend(zip(log_amp, level))
+        else:
+            points.append((log_amp[int(match[2])], float(level)))
+    return points
+
+
+def _pure_tone_calibration(
+    levels: dict[str, np.ndarray], grid: np.ndarray
+) -> np.ndarray:
+    calib = grid.copy()
+    rows = {round(freq): i for i, freq in enumerate(grid[:, 0, 0])}
+
+    for name, level in levels.items():
+        if (match := _MULTISINE_FILE.fullmatch(name)) is not None:
+            calib[:, int(match[1]), 2] = level
+            continue
+
+        match = _PURE_TONE_FILE.fullmatch(name)
+        if match[1] != "calibration":
+            continue
+        i = rows[int(match[2])]
+        if match[3] == "staircase":
+            steps = np.flatnonzero(~np.isnan(grid[i, :, 1]))
+            calib[i, steps, 2] = level
+        else:
+            calib[i, int(match[3]), 2] = level
+
+    return calib
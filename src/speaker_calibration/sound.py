@@ -1,12 +1,13 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Literal, Optional, cast
+from typing import Literal, Optional, Sequence, cast
 
 import numpy as np
 from scipy.signal import butter, chirp, lfilter, resample, sosfilt, welch
 from scipy.signal.windows import flattop
 
+from speaker_calibration.eq import EQDesign
 from speaker_calibration.utils import REFERENCE_PRESSURE
 
 
@@ -77,12 +78,14 @@ class WhiteNoise(Sound):
         filter: bool = False,
         freq_min: float = 5000,
         freq_max: float = 20000,
-        eq_filter: Optional[np.ndarray] = None,
+        eq_filter: Optional[np.ndarray | EQDesign] = None,
         noise_type: Literal["gaussian", "uniform"] = "gaussian",
+        seed: Optional[int | Sequence[int]] = None,
     ):
         self._amplitude = amplitude
         self._ramp_time = ramp_time
         self._type = noise_type
+        self._seed = seed
 
         noise = self._generate_noise(
             duration,
@@ -107,6 +110,10 @@ class WhiteNoise(Sound):
     def type(self):
         return self._type
 
+    @property
+    def seed(self):
+        return self._seed
+
     def _generate_noise(
         self,
         duration,
@@ -114,23 +121,26 @@ class WhiteNoise(Sound):
         filter: bool = False,
         freq_min: float = 5000,
         freq_max: float = 20000,
-        eq_filter: Optional[np.ndarray] = None,
+        eq_filter: Optional[np.ndarray | EQDesign] = None,
     ):
         # Calculate the number of samples of the signal
         num_samples = int(fs * duration)
 
-        # Generate the base white noise (either gaussian or uniform)
+        # Generate the base white noise (either gaussian or uniform), which is reproducible if a seed is provided
+        rng = np.random.default_rng(self.seed)
         if self.type == "gaussian":
             # The gaussian samples are rescaled so that 99% of the samples are between -1 and 1
-            signal = 1 / 3 * np.random.randn(num_samples)
+            signal = 1 / 3 * rng.standard_normal(num_samples)
         else:
-            signal = np.random.uniform(low=-1.0, high=1.0, size=num_samples)
+            signal = rng.uniform(low=-1.0, high=1.0, size=num_samples)
 
         # Calculate the RMS of the original signal to be used in a future normalization
         rms_original_signal = np.sqrt(np.mean(signal**2))
 
         # Use the calibration factor to flatten the power spectral density of the signal according to the electronics characteristics
-        if eq_filter is not None:
+        if isinstance(eq_filter, EQDesign):
+            signal = eq_filter.apply(signal)
+        elif eq_filter is not None:
             signal = lfilter(eq_filter, 1, signal)
 
         # Applies a 16th-order butterworth band-pass filter to the signal
@@ -196,6 +206,155 @@ class PureTone(Sound):
         return self._ramp_time
 
 
+class Multisine(Sound):
+    """
+    A sum of pure tones placed at the centre of the frequency bins of a given resolution, so that the level of each tone can be read from the FFT of a single recording.
+
+    The phases of the tones are chosen to reduce the crest factor of the signal, either with Schroeder's formula or by iteratively clipping the signal.
+    """
+
+    def __init__(
+        self,
+        duration: float,
+        fs: float,
+        freqs: np.ndarray,
+        resolution: float = 10,
+        amplitude: float = 1,
+        ramp_time: float = 0.005,
+        phase_method: Literal["schroeder", "clipping"] = "schroeder",
+        iterations: int = 50,
+    ):
+        # Place every tone at the centre of a frequency bin
+        bins = np.round(np.asarray(freqs) / resolution).astype(int)
+        if np.unique(bins).size != bins.size:
+            raise ValueError(
+                "The frequencies are closer than the resolution of the multisine."
+            )
+
+        period_samples = fs / resolution
+        if not np.isclose(period_samples, round(period_samples)):
+            raise ValueError(
+                "The sampling frequency must be a multiple of the resolution of the multisine."
+            )
+        period_samples = round(period_samples)
+
+        self._freqs = bins * resolution
+        self._resolution = resolution
+        self._amplitude = amplitude
+        self._ramp_time = ramp_time
+        self._phase_method = phase_method
+
+        # Generate a single period of the signal with unit amplitude tones
+        phases = _schroeder_phases(bins.size)
+        if phase_method == "clipping":
+            phases = _clipping_phases(bins, phases, period_samples, iterations)
+        period = _multisine_period(bins, phases, period_samples)
+        peak = np.max(np.abs(period))
+
+        self._phases = phases
+        self._crest_factor = peak / np.sqrt(np.mean(period**2))
+        self._tone_amplitude = amplitude / peak
+
+        # Repeat the period for the whole duration and normalize it to the desired peak amplitude
+        num_samples = int(fs * duration)
+        signal = np.resize(period, num_samples) * self._tone_amplitude
+        signal = _apply_ramp(signal, fs, self.ramp_time)
+
+        super().__init__(signal, fs, np.linspace(0, duration, num_samples))
+
+    @property
+    def freqs(self):
+        return self._freqs
+
+    @property
+    def resolution(self):
+        return self._resolution
+
+    @property
+    def phases(self):
+        return self._phases
+
+    @property
+    def amplitude(self):
+        return self._amplitude
+
+    @property
+    def tone_amplitude(self):
+        return self._tone_amplitude
+
+    @property
+    def crest_factor(self):
+        return self._crest_factor
+
+    @property
+    def ramp_time(self):
+        return self._ramp_time
+
+    @property
+    def phase_method(self):
+        return self._phase_method
+
+
+class SteppedSound(Sound):
+    """
+    A staircase made of copies of a sound with different amplitudes, separated by silent gaps, so that several amplitudes can be measured with a single playback.
+
+    Attributes
+    ----------
+    sound : Sound
+        The sound repeated in every step.
+    amplitudes : numpy.ndarray
+        The amplitude factor of each step.
+    gap_duration : float
+        The duration of the silent gap between two consecutive steps (s).
+    boundaries : numpy.ndarray
+        The (n, 2) array with the start and end instants of each step (s).
+    """
+
+    def __init__(
+        self,
+        sound: Sound,
+        amplitudes: np.ndarray,
+        gap_duration: float = 0.1,
+    ):
+        self._sound = sound
+        self._amplitudes = np.asarray(amplitudes)
+        self._gap_duration = gap_duration
+
+        step_samples = sound.signal.size
+        gap_samples = int(sound.fs * gap_duration)
+        starts = np.arange(self._amplitudes.size) * (step_samples + gap_samples)
+
+        # The steps are the scaled copies of the sound (already ramped), each one followed by a gap
+        steps = np.zeros((self._amplitudes.size, step_samples + gap_samples))
+        steps[:, :step_samples] = self._amplitudes[:, np.newaxis] * sound.signal
+        signal = steps.reshape(-1)[: starts[-1] + step_samples]
+
+        self._boundaries = np.stack((starts, starts + step_samples), axis=1) / sound.fs
+
+        super().__init__(
+            signal,
+            sound.fs,
+            np.linspace(0, signal.size / sound.fs, signal.size),
+        )
+
+    @property
+    def sound(self):
+        return self._sound
+
+    @property
+    def amplitudes(self):
+        return self._amplitudes
+
+    @property
+    def gap_duration(self):
+        return self._gap_duration
+
+    @property
+    def boundaries(self):
+        return self._boundaries
+
+
 class Chirp(Sound):
     def __init__(
         self,
@@ -265,7 +424,180 @@ class Chirp(Sound):
         return self._eq_filter
 
 
+class LevelAccumulator:
+    """
+    Accumulates the level of a signal that is fed block by block, e.g. during an acquisition, so that it can be finalised without going through the whole signal again.
+
+    Attributes
+    ----------
+    fs : float
+        The sampling frequency of the signal (Hz).
+    window : float, optional
+        The duration of the windows whose mean square values are kept, e.g. to calculate the Leq of each window (s).
+    count : int
+        The number of samples accumulated.
+    sum_squares : float
+        The sum of the squared samples.
+    min : float
+        The minimum sample value.
+    max : float
+        The maximum sample value.
+    """
+
+    fs: float
+    window: Optional[float]
+    count: int
+    sum_squares: float
+    min: float
+    max: float
+
+    def __init__(self, fs: float, window: Optional[float] = None):
+        self.fs = fs
+        self.window = window
+        self.count = 0
+        self.sum_squares = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+        # The cumulative sum of squares at the end of every block
+        self._block_ends = [0]
+        self._block_energy = [0]
+
+        self._window_samples = None if window is None else max(1, int(fs * window))
+        self._window_count = 0
+        self._window_sum = 0
+        self._windows = []
+
+    def add(self, block: np.ndarray):
+        """
+        Adds a block of samples.
+
+        Parameters
+        ----------
+        block : numpy.ndarray
+            The samples to be added.
+        """
+        if block.size == 0:
+            return
+
+        self.count += block.size
+        self.sum_squares += np.dot(block, block)
+        self.min = min(self.min, np.min(block))
+        self.max = max(self.max, np.max(block))
+        self._block_ends.append(self.count)
+        self._block_energy.append(self.sum_squares)
+
+        if self._window_samples is None:
+            return
+
+        # Split the block at the window edges
+        start = 0
+        while start < block.size:
+            end = min(start + self._window_samples - self._window_count, block.size)
+            self._window_sum += np.dot(block[start:end], block[start:end])
+            self._window_count += end - start
+            start = end
+
+            if self._window_count == self._window_samples:
+                self._windows.append(self._window_sum / self._window_samples)
+                self._window_count = 0
+                self._window_sum = 0
+
+    def mean_square(self) -> float:
+        """
+        Returns the mean square value of the samples accumulated.
+        """
+        return self.sum_squares / self.count
+
+    def db_spl(
+        self,
+        mic_factor: float = 1,
+        reference_pressure: float = REFERENCE_PRESSURE,
+    ) -> float:
+        """
+        Returns the intensity in dB SPL of the samples accumulated.
+
+        Parameters
+        ----------
+        mic_factor : float, optional
+            The conversion factor of the microphone (V/Pa).
+        reference_pressure : float, optional
+            The reference pressure (Pa).
+        """
+        rms = np.sqrt(self.mean_square()) / mic_factor
+        return 20 * np.log10(rms / reference_pressure)
+
+    def window_mean_squares(self) -> np.ndarray:
+        """
+        Returns the mean square value of every complete window.
+        """
+        return np.array(self._windows)
+
+    def leq(
+        self,
+        mic_factor: float = 1,
+        reference_pressure: float = REFERENCE_PRESSURE,
+    ) -> np.ndarray:
+        """
+        Returns the equivalent continuous sound level (dB SPL) of every complete window.
+
+        Parameters
+        ----------
+        mic_factor : float, optional
+            The conversion factor of the microphone (V/Pa).
+        reference_pressure : float, optional
+            The reference pressure (Pa).
+        """
+        return 10 * np.log10(
+            self.window_mean_squares() / (mic_factor * reference_pressure) ** 2
+        )
+
+    def energy(self, start: int, end: int, signal: np.ndarray) -> float:
+        """
+        Returns the sum of squares of the samples between two indices. The whole blocks inside the interval come from the accumulated values, so only the partial blocks at its edges are read from the signal.
+
+        Parameters
+        ----------
+        start : int
+            The index of the first sample.
+        end : int
+            The index after the last sample.
+        signal : numpy.ndarray
+            The signal that was accumulated.
+        """
+        ends = np.array(self._block_ends)
+        first = np.searchsorted(ends, start)
+        last = np.searchsorted(ends, end, side="right") - 1
+
+        # There is no whole block inside the interval
+        if first >= last:
+            return np.dot(signal[start:end], signal[start:end])
+
+        head = signal[start : ends[first]]
+        tail = signal[ends[last] : end]
+
+        return (
+            self._block_energy[last]
+            - self._block_energy[first]
+            + np.dot(head, head)
+            + np.dot(tail, tail)
+        )
+
+
 class RecordedSound(Sound):
+    """
+    The class representing a recorded sound.
+
+    The intensity in dB SPL is only calculated when it is needed and it is cached until the signal changes.
+
+    Attributes
+    ----------
+    mic_factor : float
+        The conversion factor of the microphone (V/Pa).
+    accumulator : LevelAccumulator, optional
+        The level accumulated while the signal was acquired, used to calculate the intensity without going through the whole signal again.
+    """
+
     def __init__(
         self,
         signal: np.ndarray,
@@ -273,6 +605,7 @@ class RecordedSound(Sound):
         time: Optional[np.ndarray] = None,
         mic_factor: Optional[float] = None,
         mic_response: Optional[np.ndarray] = None,
+        accumulator: Optional[LevelAccumulator] = None,
     ):
         super().__init__(signal, fs, time)
 
@@ -282,33 +615,206 @@ class RecordedSound(Sound):
             self._mic_factor = 1
 
         self._mic_response = mic_response
+        self._accumulator = accumulator
+        self._levels = {}
+        self._db_spl = None
 
-        self.calculate_db_spl()
+    @property
+    def signal(self):
+        return self._signal
+
+    @signal.setter
+    def signal(self, value: np.ndarray):
+        # The accumulated level and the cached intensities no longer describe the new signal
+        self._signal = value
+        self._accumulator = None
+        self._levels = {}
+        self._db_spl = None
+
+    @property
+    def accumulator(self):
+        return self._accumulator
 
     def calculate_db_spl(
         self,
         mic_factor: Optional[float] = None,
         reference_pressure: float = REFERENCE_PRESSURE,
         domain: Literal["time", "freq"] = "time",
+        crop: float = 0.1,
     ):
+        """
+        Calculates the intensity of the recorded sound in dB SPL. The result is cached for each combination of the parameters.
+
+        Parameters
+        ----------
+        mic_factor : float, optional
+            The conversion factor of the microphone (V/Pa). If not provided, the current one is used.
+        reference_pressure : float, optional
+            The reference pressure (Pa).
+        domain : Literal["time", "freq"], optional
+            The domain in which the intensity is calculated.
+        crop : float, optional
+            The fraction of the signal removed both from its beginning and from its end.
+
+        Returns
+        -------
+        db_spl : float
+            The intensity of the sound in dB SPL.
+        """
         if mic_factor is not None:
             self.mic_factor = mic_factor
 
+        key = (self.mic_factor, reference_pressure, domain, crop)
+        if key in self._levels:
+            self._db_spl = self._levels[key]
+            return self._db_spl
+
         # Remove the beginning and end of the acquisition
-        signal = self.signal[int(0.1 * self.signal.size) : int(0.9 * self.signal.size)]
+        start = int(crop * self.signal.size)
+        end = int((1 - crop) * self.signal.size)
 
         # Calculate dB SPL either in the time or in the frequency domain
         if domain == "time":
-            signal_pascal = signal / self.mic_factor
-            rms = np.sqrt(np.mean(signal_pascal**2))
-            self._db_spl = 20 * np.log10(rms / reference_pressure)
+            if (
+                self._accumulator is not None
+                and self._accumulator.count == self.signal.size
+            ):
+                energy = self._accumulator.energy(start, end, self.signal)
+            else:
+                energy = np.dot(self.signal[start:end], self.signal[start:end])
+            rms = np.sqrt(energy / (end - start)) / self.mic_factor
         else:
-            fft = np.abs(np.fft.fft(signal)) ** 2
+            fft = np.abs(np.fft.fft(self.signal[start:end])) ** 2
             rms = np.sqrt(np.sum(fft) / (fft.size**2 * self.mic_factor**2))
-            self._db_spl = 20 * np.log10(rms / reference_pressure)
+
+        self._db_spl = 20 * np.log10(rms / reference_pressure)
+        self._levels[key] = self._db_spl
 
         return self._db_spl
 
+    def tone_levels(
+        self,
+        freqs: np.ndarray,
+        resolution: float,
+        mic_factor: Optional[float] = None,
+        reference_pressure: float = REFERENCE_PRESSURE,
+        crop: float = 0.1,
+    ) -> np.ndarray:
+        """
+        Calculates the intensity in dB SPL of each tone of a recorded multisine.
+
+        The recording is split into segments of one period of the multisine, so that every tone falls at the centre of a FFT bin, and the power of the segments is averaged.
+
+        Parameters
+        ----------
+        freqs : numpy.ndarray
+            The frequencies of the tones (Hz). They must be multiples of `resolution`.
+        resolution : float
+            The frequency resolution of the multisine (Hz).
+        mic_factor : float, optional
+            The conversion factor of the microphone (V/Pa).
+        reference_pressure : float, optional
+            The reference pressure (Pa).
+        crop : float, optional
+            The fraction of the signal removed both from its beginning and from its end.
+
+        Returns
+        -------
+        db_spl : numpy.ndarray
+            The intensity of each tone in dB SPL.
+        """
+        if mic_factor is not None:
+            self.mic_factor = mic_factor
+
+        # Remove the beginning and end of the acquisition
+        signal = self.signal[
+            int(crop * self.signal.size) : int((1 - crop) * self.signal.size)
+        ]
+
+        segment = round(self.fs / resolution)
+        num_segments = signal.size // segment
+        segments = signal[: num_segments * segment].reshape(num_segments, segment)
+
+        power = np.mean(np.abs(np.fft.rfft(segments, axis=1)) ** 2, axis=0)
+        bins = np.round(np.asarray(freqs) / resolution).astype(int)
+
+        # Amplitude of a tone at the centre of a bin is 2|X|/N and its RMS is amplitude/sqrt(2)
+        rms = np.sqrt(2 * power[bins]) / segment / self.mic_factor
+
+        return 20 * np.log10(rms / reference_pressure)
+
+    def step_levels(
+        self,
+        boundaries: np.ndarray,
+        mic_factor: Optional[float] = None,
+        reference_pressure: float = REFERENCE_PRESSURE,
+        crop: float = 0.1,
+    ) -> np.ndarray:
+        """
+        Calculates the intensity in dB SPL of each step of a recorded staircase.
+
+        The beginning and end of every step are removed as in `calculate_db_spl` and the levels of all steps are computed from a single cumulative sum of the squared signal.
+
+        Parameters
+        ----------
+        boundaries : numpy.ndarray
+            The (n, 2) array with the start and end instants of each step (s).
+        mic_factor : float, optional
+            The conversion factor of the microphone (V/Pa).
+        reference_pressure : float, optional
+            The reference pressure (Pa).
+        crop : float, optional
+            The fraction of each step removed both from its beginning and from its end.
+
+        Returns
+        -------
+        db_spl : numpy.ndarray
+            The intensity of each step in dB SPL.
+        """
+        if mic_factor is not None:
+            self.mic_factor = mic_factor
+
+        samples = np.clip(
+            np.round(boundaries * self.fs).astype(int), 0, self.signal.size
+        )
+        removed = ((samples[:, 1] - samples[:, 0]) * crop).astype(int)
+        starts = samples[:, 0] + removed
+        ends = samples[:, 1] - removed
+
+        energy = np.concatenate(([0], np.cumsum(self.signal**2)))
+        mean_square = (energy[ends] - energy[starts]) / (ends - starts)
+        rms = np.sqrt(mean_square) / self.mic_factor
+
+        return 20 * np.log10(rms / reference_pressure)
+
+    def split(self, boundaries: np.ndarray) -> list[RecordedSound]:
+        """
+        Splits the recording into the steps of a staircase, without copying the signal.
+
+        Parameters
+        ----------
+        boundaries : numpy.ndarray
+            The (n, 2) array with the start and end instants of each step (s).
+
+        Returns
+        -------
+        sounds : list[RecordedSound]
+            The recorded sound of each step.
+        """
+        samples = np.clip(
+            np.round(boundaries * self.fs).astype(int), 0, self.signal.size
+        )
+
+        return [
+            RecordedSound(
+                self.signal[start:end],
+                self.fs,
+                None if self.time is None else self.time[start:end],
+                self.mic_factor,
+            )
+            for start, end in samples
+        ]
+
     # TODO: window?
     def fft_welch(
         self,
@@ -359,6 +865,9 @@ class RecordedSound(Sound):
 
     @property
     def db_spl(self):
+        # The intensity is calculated with the default parameters if it was never calculated
+        if self._db_spl is None:
+            return self.calculate_db_spl()
         return self._db_spl
 
     @property
@@ -407,3 +916,37 @@ def _apply_ramp(signal: np.ndarray, fs: float, ramp_time: float = 0.005):
     )
 
     return np.multiply(signal, ramp_signal)
+
+
+def _schroeder_phases(num_tones: int) -> np.ndarray:
+    k = np.arange(1, num_tones + 1)
+    return -np.pi * k * (k - 1) / num_tones
+
+
+def _multisine_period(
+    bins: np.ndarray, phases: np.ndarray, period_samples: int
+) -> np.ndarray:
+    spectrum = np.zeros(period_samples // 2 + 1, dtype=complex)
+    spectrum[bins] = np.exp(1j * phases) * period_samples / 2
+    return np.fft.irfft(spectrum, n=period_samples)
+
+
+def _clipping_phases(
+    bins: np.ndarray, phases: np.ndarray, period_samples: int, iterations: int
+) -> np.ndarray:
+    # Clip the peaks of the signal and keep the phases of the clipped signal at the tone frequencies
+    best_phases = phases
+    best_peak = np.max(np.abs(_multisine_period(bins, phases, period_samples)))
+
+    for _ in range(iterations):
+        period = _multisine_period(bins, phases, period_samples)
+        threshold = 0.9 * np.max(np.abs(period))
+        clipped = np.clip(period, -threshold, threshold)
+        phases = np.angle(np.fft.rfft(clipped)[bins])
+
+        peak = np.max(np.abs(_multisine_period(bins, phases, period_samples)))
+        if peak < best_peak:
+            best_peak = peak
+            best_phases = phases
+
+    return best_phases
@@ -3,16 +3,25 @@ import threading
 import time
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Literal, Optional
+from typing import TYPE_CHECKING, Literal, Optional
 
 import numpy as np
-from harp.devices.soundcard import SoundCard as HSC
 from multipledispatch import dispatch
 from pydantic.types import StringConstraints
 from typing_extensions import Annotated
 
 from speaker_calibration.sound import Sound
-from speaker_calibration.utils import Speaker
+from speaker_calibration.utils import (
+    MAX_ATTENUATION,
+    Speaker,
+    amplitude_to_attenuation,
+)
+
+# The drivers of the soundcards are only imported when they are used
+if TYPE_CHECKING:
+    from harp.devices.soundcard import SoundCard as HSC
+
+    import speaker_calibration.config as settings
 
 
 class SoundCard(ABC):
@@ -32,6 +41,13 @@ class SoundCard(ABC):
         self.fs = fs
         self.speaker = speaker
 
+    @classmethod
+    @abstractmethod
+    def from_config(cls, config):
+        """
+        Creates the soundcard from its settings. _This is the method used by the backend registry, to be implemented by the soundcards that can be selected in the configuration._
+        """
+
     @abstractmethod
     def play(
         self,
@@ -41,7 +57,140 @@ class SoundCard(ABC):
         """
         Plays a sound. _This is the abstract method to be implemented for the specific soundcards that derive from this abstract class._
         """
-        pass
+
+    def stop(self):
+        """
+        Stops the sound currently being played. Soundcards that cannot stop a sound keep playing it until its end.
+        """
+
+
+class AttenuationController:
+    """
+    This class manages the attenuation registers of the Harp SoundCard.
+
+    The register values of a whole sweep can be precomputed, both speakers are written in a single transaction and the writes are skipped when the registers already hold the desired values.
+
+    Attributes
+    ----------
+    device : Device
+        The Harp device object responsible for the serial communication with the device.
+    speaker : Speaker
+        Indicates which speaker is being used. The other one is muted.
+    """
+
+    device: "HSC"
+    speaker: Speaker
+
+    def __init__(self, device: "HSC", speaker: Speaker = Speaker.BOTH):
+        self.device = device
+        self.speaker = speaker
+        self._table = {}
+        self._current = None
+
+    def precompute(self, amplitudes: np.ndarray) -> np.ndarray:
+        """
+        Precomputes the register values for every amplitude of a sweep.
+
+        Parameters
+        ----------
+        amplitudes : numpy.ndarray
+            The amplitude factors to be used in the sweep.
+
+        Returns
+        -------
+        registers : numpy.ndarray
+            The (n, 2) array with the left and right register values for each amplitude.
+        """
+        amplitudes = np.ravel(amplitudes)
+        amplitudes = amplitudes[~np.isnan(amplitudes)]
+        registers = self.registers(amplitudes)
+
+        self._table.update(
+            zip(amplitudes.tolist(), [tuple(r) for r in registers.tolist()])
+        )
+
+        return registers
+
+    def registers(self, amplitudes: float | np.ndarray) -> np.ndarray:
+        """
+        Calculates the register values for the given amplitudes.
+
+        Parameters
+        ----------
+        amplitudes : float | numpy.ndarray
+            The amplitude factors.
+
+        Returns
+        -------
+        registers : numpy.ndarray
+            The (n, 2) array with the left and right register values for each amplitude.
+        """
+        attenuation = amplitude_to_attenuation(np.atleast_1d(amplitudes))
+        muted = np.full(attenuation.shape, MAX_ATTENUATION, dtype=np.uint16)
+
+        match self.speaker:
+            case Speaker.LEFT:
+                return np.stack((attenuation, muted), axis=1)
+            case Speaker.RIGHT:
+                return np.stack((muted, attenuation), axis=1)
+            case Speaker.BOTH:
+                return np.stack((attenuation, attenuation), axis=1)
+
+    def lookup(self, amplitude: float) -> tuple[int, int]:
+        """
+        Returns the register values of an amplitude, using the precomputed values when available.
+
+        Parameters
+        ----------
+        amplitude : float
+            The amplitude factor.
+
+        Returns
+        -------
+        registers : tuple[int, int]
+            The left and right register values.
+        """
+        registers = self._table.get(amplitude)
+        if registers is None:
+            registers = tuple(self.registers(amplitude)[0].tolist())
+
+        return registers
+
+    def write(self, left: int, right: int):
+        """
+        Writes the attenuation of both speakers in a single transaction, unless the registers already hold these values.
+
+        Parameters
+        ----------
+        left : int
+            The attenuation of the left speaker (1 LSB = 0.1 dB).
+        right : int
+            The attenuation of the right speaker (1 LSB = 0.1 dB).
+        """
+        if self._current == (left, right):
+            return
+
+        self.device.write_attenuation_both([left, right])
+        self._current = (left, right)
+
+    def play(self, index: int, left: int, right: int):
+        """
+        Plays a sound with the desired attenuation. If the attenuation has to change, it is written in the same transaction that starts the sound.
+
+        Parameters
+        ----------
+        index : int
+            The index in which the sound is stored.
+        left : int
+            The attenuation of the left speaker (1 LSB = 0.1 dB).
+        right : int
+            The attenuation of the right speaker (1 LSB = 0.1 dB).
+        """
+        if self._current == (left, right):
+            self.device.write_play_sound_or_frequency(index)
+        else:
+            self.device.write_attenuation_and_play_sound_or_freq([left, right, index])
+            self._current = (left, right)
 
 
 class HarpSoundCard(SoundCard):
@@ -52,9 +201,12 @@ class HarpSoundCard(SoundCard):
     ----------
     device : Device
         The Harp device object responsible for the serial communication with the device.
+    attenuation : AttenuationController
+        The object that manages the attenuation registers of the device.
     """
 
-    device: HSC
+    device: "HSC"
+    attenuation: AttenuationController
 
     def __init__(
         self,
@@ -64,15 +216,31 @@ class HarpSoundCard(SoundCard):
         fs: Literal[96000, 192000] = 192000,
         speaker: Speaker = Speaker.BOTH,
     ):
+        from harp.devices.soundcard import SoundCard as HSC
+
         super().__init__(fs, speaker)
         self.device = HSC(serial_port)
+        self.attenuation = AttenuationController(self.device, speaker)
         self._change_amplitude(1)
 
+    @classmethod
+    def from_config(cls, config: "settings.HarpSoundCard"):
+        """
+        Creates the soundcard from its settings.
+
+        Parameters
+        ----------
+        config : speaker_calibration.config.HarpSoundCard
+            The soundcard settings.
+        """
+        return cls(config.serial_port, config.fs, config.speaker)
+
     def play(
         self,
         index: int = 2,
         amplitude: float = 1,
         start_event: Optional[threading.Event] = None,
+        attenuation: Optional[tuple[int, int]] = None,
     ):
         """
         Plays a sound from the Harp SoundCard.
@@ -81,17 +249,30 @@ class HarpSoundCard(SoundCard):
         ----------
         index : int, optional
             The index in which the sound is stored.
+        amplitude : float, optional
+            The amplitude factor, which is converted into the attenuation of the speakers.
         start_event : threading.Event, optional
             A thread event used to synchronize the start of the sound with the start of the recording. If `start_event` is not provided, the sound will play as soon as possible.
+        attenuation : tuple[int, int], optional
+            The left and right attenuation register values (1 LSB = 0.1 dB). If provided, `amplitude` is ignored.
         """
-        self._change_amplitude(amplitude)
+        if attenuation is not None:
+            left, right = attenuation
+        else:
+            left, right = self.attenuation.lookup(amplitude)
 
         # Wait for the event if it exists
         if start_event is not None:
             start_event.wait()
 
         # Play the sound
-        self.device.write_play_sound_or_frequency(index)
+        self.attenuation.play(index, left, right)
+
+    def stop(self):
+        """
+        Stops the sound currently being played.
+        """
+        self.device.write_stop(1)
 
     def load_sound(self, filename: Path, index: int = 2):
         """
@@ -120,17 +301,7 @@ class HarpSoundCard(SoundCard):
             time.sleep(3)
 
     def _change_amplitude(self, amplitude: float):
-        # x20 because of the 20*log10(x) and x10 due the way this register works (1 LSB = 0.1 dB)
-        match self.speaker:
-            case Speaker.LEFT:
-                self.device.write_attenuation_left(int(-200 * np.log10(amplitude)))
-                self.device.write_attenuation_right(65535)
-            case Speaker.RIGHT:
-                self.device.write_attenuation_left(65535)
-                self.device.write_attenuation_right(int(-200 * np.log10(amplitude)))
-            case Speaker.BOTH:
-                self.device.write_attenuation_left(int(-200 * np.log10(amplitude)))
-                self.device.write_attenuation_right(int(-200 * np.log10(amplitude)))
+        self.attenuation.write(*self.attenuation.lookup(amplitude))
 
 
 @dispatch(Sound, Path, speaker_side=str)
@@ -205,5 +376,176 @@ def create_sound_file(
         wave_int.tofile(f)
 
 
-# TODO
-# class ComputerSoundCard(SoundCard):
+class ComputerSoundCard(SoundCard):
+    """
+    This class is an implementation of the SoundCard class for the computer's soundcards, through the `soundcard` library.
+
+    Sounds are kept in memory and streamed block by block to the output device, so there is no upload step.
+
+    Attributes
+    ----------
+    device : soundcard speaker | None
+        The output device used to play the sounds. If `None`, the null device is used, which consumes the blocks in real time without producing any sound.
+    block_size : int
+        The number of samples written to the output device at a time.
+    latency : float, optional
+        The size of the output device buffer (s). If `None`, the default of the device is used.
+    """
+
+    NULL_DEVICE = "null"
+
+    block_size: int
+    latency: Optional[float]
+
+    def __init__(
+        self,
+        soundcard_name: str = "",
+        fs: int = 48000,
+        speaker: Speaker = Speaker.BOTH,
+        block_size: int = 1024,
+        latency: Optional[float] = None,
+    ):
+        super().__init__(fs, speaker)
+        self.block_size = block_size
+        self.latency = latency
+        self._sounds = {}
+        self._stop_event = threading.Event()
+
+        if soundcard_name == self.NULL_DEVICE:
+            self.device = None
+        else:
+            import soundcard as sc
+
+            if soundcard_name == "":
+                self.device = sc.default_speaker()
+            else:
+                self.device = sc.get_speaker(soundcard_name)
+
+    @classmethod
+    def from_config(cls, config: "settings.ComputerSoundCard"):
+        """
+        Creates the soundcard from its settings.
+
+        Parameters
+        ----------
+        config : speaker_calibration.config.ComputerSoundCard
+            The soundcard settings.
+        """
+        return cls(
+            config.soundcard_name,
+            config.fs,
+            config.speaker,
+            config.block_size,
+            config.latency,
+        )
+
+    def load_sound(self, sound: Sound, index: int = 2):
+        """
+        Loads the sound to be played by the soundcard.
+
+        Parameters
+        ----------
+        sound : Sound
+            The sound to be played.
+        index : int, optional
+            The index in which the sound will be stored.
+        """
+        self._sounds[index] = sound
+
+    def play(
+        self,
+        index: int = 2,
+        amplitude: float = 1,
+        start_event: Optional[threading.Event] = None,
+        start_time: Optional[float] = None,
+    ):
+        """
+        Plays a loaded sound from the computer soundcard.
+
+        Parameters
+        ----------
+        index : int, optional
+            The index in which the sound is stored.
+        amplitude : float, optional
+            The amplitude factor applied to the sound.
+        start_event : threading.Event, optional
+            A thread event used to synchronize the start of the sound with the start of the recording. If `start_event` is not provided, the sound will play as soon as possible.
+        start_time : float, optional
+            The instant, in the `time.perf_counter` clock, at which the sound should start. It is used to start the playback from a clock shared with other devices.
+        """
+        if index not in self._sounds:
+            raise ValueError(f"No sound was loaded to index {index}.")
+
+        self._stop_event.clear()
+        signal = self._sounds[index].signal
+
+        # Open the stream before waiting, so that the device setup time does not delay the start of the sound
+        with self._open_player() as player:
+            # Wait for the event if it exists
+            if start_event is not None:
+                start_event.wait()
+
+            # Wait until the start instant of the shared clock
+            if start_time is not None:
+                delay = start_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            # Stream the sound block by block
+            for start in range(0, signal.size, self.block_size):
+                if self._stop_event.is_set():
+                    break
+
+                block = amplitude * signal[start : start + self.block_size]
+                player.play(self._to_channels(block))
+
+    def stop(self):
+        """
+        Stops the sound currently being played.
+        """
+        self._stop_event.set()
+
+    def _open_player(self):
+        if self.device is None:
+            return _NullPlayer(self.fs)
+
+        buffer_size = None
+        if self.latency is not None:
+            buffer_size = int(self.latency * self.fs)
+
+        return self.device.player(samplerate=self.fs, channels=2, blocksize=buffer_size)
+
+    def _to_channels(self, block: np.ndarray):
+        match self.speaker:
+            case Speaker.LEFT:
+                return np.stack((block, np.zeros(block.size)), axis=1)
+            case Speaker.RIGHT:
+                return np.stack((np.zeros(block.size), block), axis=1)
+            case Speaker.BOTH:
+                return np.stack((block, block), axis=1)
+
+
+class _NullPlayer:
+    """
+    Output stream that discards the blocks at the rate they would be played by a real device.
+    """
+
+    def __init__(self, fs: float):
+        self._fs = fs
+        self._clock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def play(self, data: np.ndarray):
+        # The clock starts with the first block
+        if self._clock is None:
+            self._clock = time.perf_counter()
+
+        self._clock += data.shape[0] / self._fs
+        delay = self._clock - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
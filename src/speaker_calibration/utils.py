@@ -1,6 +1,9 @@
 from enum import Enum
 
+import numpy as np
+
 REFERENCE_PRESSURE = 0.00002
+MAX_ATTENUATION = 65535
 
 
 class Speaker(Enum):
@@ -12,3 +15,27 @@ class Speaker(Enum):
 class SweepType(Enum):
     CALIBRATION = 1
     TEST = 2
+    VERIFICATION = 3
+
+
+def amplitude_to_attenuation(amplitude: float | np.ndarray) -> np.ndarray:
+    """
+    Converts amplitude factors into attenuation register values of the Harp SoundCard.
+
+    Parameters
+    ----------
+    amplitude : float | numpy.ndarray
+        The amplitude factors (between 0 and 1).
+
+    Returns
+    -------
+    attenuation : numpy.ndarray
+        The attenuation values, in which 1 LSB corresponds to 0.1 dB.
+    """
+    amplitude = np.asarray(amplitude, dtype=float)
+
+    # x20 because of the 20*log10(x) and x10 due the way this register works (1 LSB = 0.1 dB)
+    with np.errstate(divide="ignore"):
+        attenuation = np.trunc(-200 * np.log10(amplitude))
+
+    return np.clip(attenuation, 0, MAX_ATTENUATION).astype(np.uint16)